@@ -0,0 +1,92 @@
+"""
+Logging overhead benchmark
+Written by Joshua Kitchen - 2025
+
+Measures how many messages per second a PychatServer can relay over loopback with debug logging off, with debug
+logging on, and with debug logging on but written from a background thread (log_util.start_async_logging()).
+
+Run from the root of the repository:
+    python -m benchmarks.bench_logging
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from TCPLib.tcp_client import TCPClient
+from server.backend.TCP_server import PychatServer
+import log_util
+import utils
+
+logger = logging.getLogger()
+
+BLACKLIST_PATH = os.path.join(tempfile.gettempdir(), ".bench_ipblacklist")
+MEDIA_STORE_DIR = os.path.join(tempfile.gettempdir(), ".bench_media_store")
+with open(BLACKLIST_PATH, 'a'):
+    pass
+
+
+def relay_throughput(port, num_msgs, payload_size):
+    """
+    Starts a server, connects a sender and a receiver, and returns the number of messages relayed per second
+    """
+    server = PychatServer(max_clients=0, ip_blacklist_path=BLACKLIST_PATH, media_store_dir=MEDIA_STORE_DIR)
+    server.start(("127.0.0.1", port))
+    threading.Thread(target=server.process_msg_queue, daemon=True).start()
+    try:
+        receiver = TCPClient()
+        receiver.connect(("127.0.0.1", port))
+        receiver.send(b"receiver")
+        receiver.receive()
+        sender = TCPClient()
+        sender.connect(("127.0.0.1", port))
+        sender.send(b"sender")
+        sender.receive()
+        while server.client_count < 2:
+            time.sleep(0.01)
+        joined = set()
+        while "sender" not in joined: # Joins are announced in batches (see presence.py)
+            data = bytes(utils.decode_msg(receiver.receive())["data"])
+            if data.startswith(b"PRESENCE:"):
+                joined.update(utils.decode_presence(str(data[9:], 'utf-8'))[0])
+
+        msg = utils.encode_msg(b"sender", bytes(payload_size), 1)
+        start = time.perf_counter()
+        threading.Thread(target=lambda: [sender.send(msg) for _ in range(num_msgs)], daemon=True).start()
+        for _ in range(num_msgs):
+            receiver.receive()
+        elapsed = time.perf_counter() - start
+        sender.disconnect()
+        receiver.disconnect()
+    finally:
+        server.stop()
+    return num_msgs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares relay throughput with debug logging off and on")
+    parser.add_argument("-p", "--port", type=int, default=5050, help="Port to run the benchmark server on")
+    parser.add_argument("-n", "--num_msgs", type=int, default=5000, help="Number of messages to relay per run")
+    parser.add_argument("-s", "--payload_size", type=int, default=128, help="Size of each message in bytes")
+    args = vars(parser.parse_args())
+
+    log_path = os.path.join(tempfile.gettempdir(), ".bench_server_log")
+    logger.handlers = []
+    results = {}
+    for mode, port_offset in (("debug off", 0), ("debug on", 1), ("debug on (async)", 2)):
+        log_level = logging.INFO if mode == "debug off" else logging.DEBUG
+        logger.setLevel(log_level)
+        log_util.toggle_file_handler(logger, log_path, log_level, "bench-file-handler")
+        if mode == "debug on (async)":
+            log_util.start_async_logging(logger)
+        results[mode] = relay_throughput(args['port'] + port_offset, args['num_msgs'], args['payload_size'])
+        log_util.stop_async_logging(logger)
+
+    for mode, msgs_per_sec in results.items():
+        print(f"{mode:<20}{msgs_per_sec:>12.0f} msg/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark runner
+Written by Joshua Kitchen - 2025
+
+Runs the scenarios in scenarios.py, saves the results as JSON, and compares them against a saved baseline. Baselines
+are machine specific, so they are kept in benchmarks/results/, which git ignores.
+
+Run from the root of the repository:
+    python -m benchmarks.run --save-baseline          # Record a baseline
+    python -m benchmarks.run                          # Compare against it after making changes
+
+The runner exits with status 1 if any result is worse than the baseline by more than --threshold.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+from benchmarks.scenarios import SCENARIOS
+
+DEFAULT_BASELINE = os.path.join("benchmarks", "results", "baseline.json")
+
+
+def run_scenarios(names, quick=False):
+    results = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        for result in SCENARIOS[name](quick=quick):
+            results[result.name] = {
+                "value": result.value,
+                "unit": result.unit,
+                "higher_is_better": result.higher_is_better
+            }
+    return {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick
+        },
+        "results": results
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Returns a list of (name, baseline value, current value, change, is_regression) tuples. `change` is the relative
+    change, where a positive number is always an improvement. New benchmarks have a baseline value and change of None.
+    """
+    rows = []
+    for name, result in current["results"].items():
+        try:
+            old = baseline["results"][name]["value"]
+        except KeyError: # New benchmark
+            rows.append((name, None, result["value"], None, False))
+            continue
+        if old == 0:
+            continue
+        change = (result["value"] - old) / old
+        if not result["higher_is_better"]:
+            change = -change
+        rows.append((name, old, result["value"], change, change < -threshold))
+    return rows
+
+
+def print_results(report, rows=None):
+    if rows is None:
+        for name, result in report["results"].items():
+            print(f"{name:<44}{result['value']:>14.2f} {result['unit']}")
+        return
+    print(f"{'BENCHMARK':<44}{'BASELINE':>14}{'CURRENT':>14}{'CHANGE':>10}")
+    for name, old, new, change, is_regression in rows:
+        if old is None:
+            print(f"{name:<44}{'-':>14}{new:>14.2f}{'-':>10}")
+            continue
+        flag = "  REGRESSION" if is_regression else ""
+        print(f"{name:<44}{old:>14.2f}{new:>14.2f}{change * 100:>9.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the pychat benchmark suite")
+    parser.add_argument("-s", "--scenarios", nargs="+", choices=sorted(SCENARIOS.keys()),
+                        default=list(SCENARIOS.keys()), help="Scenarios to run (default: all)")
+    parser.add_argument("-q", "--quick", action="store_true", help="Run fewer iterations")
+    parser.add_argument("-o", "--output", type=str, help="Save the results as JSON to this path")
+    parser.add_argument("-b", "--baseline", type=str, default=DEFAULT_BASELINE,
+                        help=f"Path of the baseline to compare against (default: {DEFAULT_BASELINE})")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("-t", "--threshold", type=float, default=0.10,
+                        help="Relative change that counts as a regression (default: 0.10)")
+    args = vars(parser.parse_args())
+
+    report = run_scenarios(args['scenarios'], args['quick'])
+    if args['output']:
+        with open(args['output'], 'w') as file:
+            json.dump(report, file, indent=4)
+
+    if args['save_baseline']:
+        os.makedirs(os.path.dirname(args['baseline']) or '.', exist_ok=True)
+        with open(args['baseline'], 'w') as file:
+            json.dump(report, file, indent=4)
+        print_results(report)
+        print(f"\nSaved baseline to {args['baseline']}")
+        return
+
+    if not os.path.exists(args['baseline']):
+        print_results(report)
+        print(f"\nNo baseline found at {args['baseline']}. Run with --save-baseline to create one")
+        return
+
+    with open(args['baseline'], 'r') as file:
+        baseline = json.load(file)
+    rows = compare(report, baseline, args['threshold'])
+    print_results(report, rows)
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args['threshold'] * 100:.0f}%")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
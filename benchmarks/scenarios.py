@@ -0,0 +1,830 @@
+"""
+Benchmark scenarios
+Written by Joshua Kitchen - 2025
+
+Each scenario is a function registered with @scenario that takes a `quick` argument (run fewer iterations) and returns
+a list of Result objects. Scenarios that need a server run one in a separate process (see LoopbackServer) so that the
+benchmark's clients don't compete with the server for the GIL.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+
+from buffer_pool import BufferPool
+from frame_parser import FrameParser, encode_frame
+from loadtest.bot import AsyncPychatClient
+from socket_options import PROFILES
+import utils
+
+SCENARIOS = {}
+
+PAYLOAD_SIZES = [64, 4096, 65536, 1048576]
+ROOM_SIZES = [2, 16, 64]
+MIXES = {
+    "text": ((1, 0, 0), {}),
+    "mixed": ((90, 8, 2), {}),
+    "mixed_eager": ((90, 8, 2), {"lazy_media": False})  # Media is sent in full instead of announced
+}
+MIX_SIZES = (64, 65536, 262144)  # text, image, mp3
+MEDIA_FILE_SIZES = [1048576, 16777216, 67108864]
+PARSER_CHUNK_SIZES = [4096, 65536]
+REPEAT = 3  # Scenarios that run over loopback report the median of this many runs
+
+
+@dataclass
+class Result:
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool = True
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def _run_server(port, ready, stop, server_kwargs):
+    from server.backend.TCP_server import PychatServer
+    from benchmarks.bench_logging import BLACKLIST_PATH, MEDIA_STORE_DIR
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("TCPLib").setLevel(logging.CRITICAL)  # Clients disconnecting are logged as errors
+    server = PychatServer(max_clients=0, ip_blacklist_path=BLACKLIST_PATH, media_store_dir=MEDIA_STORE_DIR,
+                          **server_kwargs)
+    server.start(("127.0.0.1", port))
+    threading.Thread(target=server.process_msg_queue, daemon=True).start()
+    ready.set()
+    stop.wait()
+    server.stop()
+
+
+class LoopbackServer:
+    """
+    Runs a PychatServer on localhost in a child process for the duration of a `with` block
+    """
+    _next_port = 5600
+
+    def __init__(self, **server_kwargs):
+        LoopbackServer._next_port += 1
+        self.addr = ("127.0.0.1", LoopbackServer._next_port)
+        self._server_kwargs = server_kwargs
+        ctx = multiprocessing.get_context("spawn")
+        self._ready = ctx.Event()
+        self._stop = ctx.Event()
+        self._proc = ctx.Process(target=_run_server, args=(self.addr[1], self._ready, self._stop, server_kwargs),
+                                 daemon=True)
+
+    def __enter__(self):
+        self._proc.start()
+        if not self._ready.wait(timeout=15):
+            raise RuntimeError("Benchmark server did not start")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._proc.join(timeout=5)
+        if self._proc.is_alive():
+            self._proc.kill()
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def _size_label(size):
+    if size >= 1048576:
+        return f"{size // 1048576}MiB"
+    if size >= 1024:
+        return f"{size // 1024}KiB"
+    return f"{size}B"
+
+
+@scenario("codec")
+def codec(quick=False):
+    results = []
+    for size in PAYLOAD_SIZES:
+        data = bytes(size)
+        number = max(10, (2000 if quick else 20000) * 64 // max(size, 64))
+        encoded = utils.encode_msg(b"benchmark", data, 1)
+        encode_time = min(timeit.repeat(lambda: utils.encode_msg(b"benchmark", data, 1), number=number, repeat=3))
+        decode_time = min(timeit.repeat(lambda: utils.decode_msg(encoded), number=number, repeat=3))
+        results.append(Result(f"codec.encode.{_size_label(size)}", number / encode_time, "ops/s"))
+        results.append(Result(f"codec.decode.{_size_label(size)}", number / decode_time, "ops/s"))
+    return results
+
+
+@scenario("frame_parser")
+def frame_parser(quick=False):
+    """
+    Feeds a stream of messages to a FrameParser in fixed size chunks, like a receive loop reading from a socket
+    """
+    results = []
+    for size in PAYLOAD_SIZES:
+        count = max(4, (2 if quick else 20) * 1048576 // max(size, 1024))
+        stream = bytes(encode_frame(utils.encode_msg(b"benchmark", bytes(size), 1))) * count
+        for chunk_size in PARSER_CHUNK_SIZES:
+            chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+            def parse():
+                parser = FrameParser()
+                for chunk in chunks:
+                    parser.feed(chunk)
+
+            elapsed = min(timeit.repeat(parse, number=1, repeat=REPEAT))
+            label = f"frame_parser.{_size_label(size)}.chunk{_size_label(chunk_size)}"
+            results.append(Result(f"{label}.messages", count / elapsed, "msg/s"))
+            results.append(Result(f"{label}.throughput", len(stream) / elapsed / 1048576, "MiB/s"))
+    return results
+
+
+async def _wait_for_joins(client, usernames):
+    """
+    Reads messages until `client` has been told that every one of `usernames` joined. Joins are announced in batches
+    (see presence.py), and a member is told about its own as well.
+    """
+    waiting = set(usernames)
+    while waiting:
+        msg = await client.receive()
+        if msg.flags != 4:
+            continue
+        info = str(msg.data, 'utf-8')
+        if info.startswith("PRESENCE:"):
+            waiting.difference_update(utils.decode_presence(info[9:])[0])
+
+
+async def _handshakes(addr, count):
+    start = time.perf_counter()
+    for i in range(count):
+        client = AsyncPychatClient(f"hs{i}")
+        await client.init_connection(addr)
+        await client.disconnect()
+    return count / (time.perf_counter() - start)
+
+
+@scenario("handshake")
+def handshake(quick=False):
+    with LoopbackServer() as server:
+        rate = asyncio.run(_handshakes(server.addr, 50 if quick else 300))
+    return [Result("handshake.sequential", rate, "handshakes/s")]
+
+
+async def _fanout(addr, room_size, weights, num_msgs, socket_options=None):
+    """
+    One member sends `num_msgs` messages to a room of `room_size` members. Returns deliveries per second, bytes
+    delivered per second, and the median send-to-receive latency.
+    """
+    clients = []
+    for i in range(room_size):
+        client = AsyncPychatClient(f"member{i}", socket_options)
+        await client.init_connection(addr)
+        clients.append(client)
+    # Wait until every member has been told everyone who joined after them did (themselves included)
+    for i, client in enumerate(clients):
+        await _wait_for_joins(client, [member.username for member in clients[i:]])
+
+    latencies = []
+    received_bytes = 0
+
+    async def receive_all(client):
+        nonlocal received_bytes
+        for _ in range(num_msgs):
+            msg = await client.receive()
+            received_bytes += len(msg.payload)
+            if msg.flags == 1:
+                sent_at = bytes(msg.data).split(b":", 1)[0]
+            else:
+                sent_at = utils.decode_multimedia_body(msg.data)[0].split(".", 1)[0]
+            latencies.append(time.perf_counter_ns() - int(sent_at))
+
+    rng = random.Random(0)
+    kinds = rng.choices(("text", "image", "mp3"), weights=weights, k=num_msgs)
+    payloads = {"image": rng.randbytes(MIX_SIZES[1]), "mp3": rng.randbytes(MIX_SIZES[2])}
+
+    async def send_all(sender):
+        for kind in kinds:
+            sent_at = time.perf_counter_ns()
+            if kind == "text":
+                await sender.send_chat_msg(f"{sent_at}:".encode() + b"x" * MIX_SIZES[0], 1)
+            else:
+                await sender.send_multimedia_msg(f"{sent_at}.{'png' if kind == 'image' else 'mp3'}", payloads[kind])
+
+    start = time.perf_counter()
+    await asyncio.gather(send_all(clients[0]), *(receive_all(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.disconnect()
+    latencies.sort()
+    return len(latencies) / elapsed, received_bytes / elapsed, latencies[len(latencies) // 2] / 1e9
+
+
+@scenario("fanout")
+def fanout(quick=False):
+    results = []
+    for mix_name, (weights, server_kwargs) in MIXES.items():
+        for room_size in ROOM_SIZES:
+            num_msgs = 100 if quick else 500
+            if mix_name != "text":
+                num_msgs //= 5
+            runs = []
+            for _ in range(REPEAT):
+                with LoopbackServer(**server_kwargs) as server:
+                    runs.append(asyncio.run(_fanout(server.addr, room_size, weights, num_msgs)))
+            deliveries = _median([run[0] for run in runs])
+            throughput = _median([run[1] for run in runs])
+            p50 = _median([run[2] for run in runs])
+            label = f"fanout.{mix_name}.room{room_size}"
+            results.append(Result(f"{label}.deliveries", deliveries, "msg/s"))
+            results.append(Result(f"{label}.throughput", throughput / 1048576, "MiB/s"))
+            results.append(Result(f"{label}.p50_latency", p50 * 1000, "ms", higher_is_better=False))
+    return results
+
+
+@scenario("logging")
+def relay_logging(quick=False):
+    from benchmarks.bench_logging import relay_throughput
+    root = logging.getLogger()
+    old_level = root.level
+    results = []
+    for label, level in (("debug_off", logging.INFO), ("debug_on", logging.DEBUG)):
+        root.setLevel(level)
+        handler = logging.FileHandler(os.path.join(tempfile.gettempdir(), ".bench_server_log"), mode='w')
+        root.addHandler(handler)
+        LoopbackServer._next_port += 1
+        try:
+            rate = relay_throughput(LoopbackServer._next_port, 500 if quick else 3000, 128)
+        finally:
+            root.removeHandler(handler)
+            handler.close()
+        results.append(Result(f"logging.relay.{label}", rate, "msg/s"))
+    root.setLevel(old_level)
+    return results
+
+
+async def _direct(addr, room_size, num_msgs):
+    """
+    One member sends `num_msgs` direct messages to another member of a room of `room_size` members. Returns direct
+    messages delivered per second.
+    """
+    clients = []
+    for i in range(room_size):
+        client = AsyncPychatClient(f"member{i}")
+        await client.init_connection(addr)
+        clients.append(client)
+    for i, client in enumerate(clients):
+        await _wait_for_joins(client, [member.username for member in clients[i:]])
+
+    async def send_all(sender):
+        for _ in range(num_msgs):
+            await sender.send_chat_msg(utils.encode_direct_body(["member1"], b"x" * MIX_SIZES[0]), 1 | 16)
+
+    async def receive_all(client):
+        for _ in range(num_msgs):
+            await client.receive()
+
+    start = time.perf_counter()
+    await asyncio.gather(send_all(clients[0]), receive_all(clients[0]), receive_all(clients[1]))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.disconnect()
+    return num_msgs / elapsed
+
+
+@scenario("direct")
+def direct(quick=False):
+    results = []
+    for room_size in ROOM_SIZES:
+        runs = []
+        for _ in range(REPEAT):
+            with LoopbackServer() as server:
+                runs.append(asyncio.run(_direct(server.addr, room_size, 200 if quick else 2000)))
+        rate = _median(runs)
+        results.append(Result(f"direct.text.room{room_size}", rate, "msg/s"))
+    return results
+
+
+def _read_then_send(soc, path, sender, filename):
+    """
+    How stored media was served before it was sent straight from disk: read the file, build the message, then send it
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    msg = utils.encode_msg(sender, utils.encode_multimedia_body(filename, data), 2)
+    soc.sendall(len(msg).to_bytes(4, "big") + msg)
+
+
+def _sendfile(soc, path, sender, filename):
+    """
+    How the server serves stored media: the file is queued in the client's outbox, which sends it straight from disk
+    (see Outbox.put_file())
+    """
+    from server.backend.outbox import Outbox
+    size = os.path.getsize(path)
+    header = utils.encode_multimedia_header(sender, filename, size)
+    outbox = Outbox(soc, "benchmark")
+    outbox.start()
+    outbox.put_file((len(header) + size).to_bytes(4, "big") + header, open(path, 'rb'), size)
+    outbox.flush(60)
+    outbox.close()
+
+
+def _serve_file(send_func, path, count):
+    """
+    Sends the file at `path` `count` times over loopback to a reader that discards it. Returns the time taken and the
+    peak memory allocated by Python while sending.
+    """
+    listener = socket.create_server(("127.0.0.1", 0))
+    receiver = socket.create_connection(listener.getsockname())
+    soc, _ = listener.accept()
+    listener.close()
+    expected = count * (4 + len(utils.encode_multimedia_header(b"benchmark", "bench.mp3", 0)) + os.path.getsize(path))
+
+    def drain():
+        buff = bytearray(1048576)
+        received = 0
+        while received < expected:
+            received += receiver.recv_into(buff)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        send_func(soc, path, b"benchmark", "bench.mp3")
+    reader.join()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    soc.close()
+    receiver.close()
+    return elapsed, peak
+
+
+@scenario("media_serving")
+def media_serving(quick=False):
+    results = []
+    for size in MEDIA_FILE_SIZES:
+        count = max(2, (64 if quick else 512) * 1048576 // size)
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(os.urandom(size))
+            for label, send_func in (("read_send", _read_then_send), ("sendfile", _sendfile)):
+                runs = [_serve_file(send_func, path, count) for _ in range(REPEAT)]
+                elapsed = _median([run[0] for run in runs])
+                peak = _median([run[1] for run in runs])
+                name = f"media_serving.{label}.{_size_label(size)}"
+                results.append(Result(f"{name}.throughput", count * size / elapsed / 1048576, "MiB/s"))
+                results.append(Result(f"{name}.peak_alloc", peak / 1048576, "MiB", higher_is_better=False))
+        finally:
+            os.remove(path)
+    return results
+
+
+async def _shutdown(room_size, method):
+    """
+    Connects `room_size` members to a server running in this process, then times how long the server takes to shut
+    down with `method` ("stop" or "drain"). Members close their connection as soon as the server closes its side.
+    """
+    from server.backend.TCP_server import PychatServer
+    from benchmarks.bench_logging import BLACKLIST_PATH, MEDIA_STORE_DIR
+    LoopbackServer._next_port += 1
+    addr = ("127.0.0.1", LoopbackServer._next_port)
+    server = PychatServer(max_clients=0, ip_blacklist_path=BLACKLIST_PATH, media_store_dir=MEDIA_STORE_DIR)
+    server.start(addr)
+    threading.Thread(target=server.process_msg_queue, daemon=True).start()
+    clients = []
+    for i in range(room_size):
+        client = AsyncPychatClient(f"member{i}")
+        await client.init_connection(addr)
+        clients.append(client)
+
+    async def close_on_eof(client):
+        while await client.receive() is not None:
+            pass
+        await client.close()
+
+    readers = [asyncio.create_task(close_on_eof(client)) for client in clients]
+    start = time.perf_counter()
+    await asyncio.to_thread(getattr(server, method))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*readers)
+    return elapsed
+
+
+@scenario("shutdown")
+def shutdown(quick=False):
+    logging.getLogger("TCPLib").setLevel(logging.CRITICAL)
+    results = []
+    for room_size in ROOM_SIZES:
+        for method in ("stop", "drain"):
+            elapsed = _median([asyncio.run(_shutdown(room_size, method)) for _ in range(REPEAT)])
+            results.append(Result(f"shutdown.{method}.room{room_size}", elapsed * 1000, "ms", higher_is_better=False))
+    return results
+
+
+async def _bursts(addr, num_bursts, burst_size, socket_options=None):
+    """
+    One member of a room of two sends `num_bursts` bursts of `burst_size` short text messages, waiting for the other
+    member to receive each burst before sending the next. Returns the median time from the start of a burst until its
+    last message arrived, which is what Nagle's algorithm delays.
+    """
+    sender = AsyncPychatClient("sender", socket_options)
+    receiver = AsyncPychatClient("receiver", socket_options)
+    await sender.init_connection(addr)
+    await receiver.init_connection(addr)
+    await _wait_for_joins(sender, ["sender", "receiver"])
+    await _wait_for_joins(receiver, ["receiver"])
+    latencies = []
+    for _ in range(num_bursts):
+        start = time.perf_counter_ns()
+        for _ in range(burst_size):
+            await sender.send_chat_msg(f"{start}:".encode() + b"x" * MIX_SIZES[0], 1)
+        for _ in range(burst_size):
+            await receiver.receive()
+            await sender.receive()  # Its own copy, so nothing backs up
+        latencies.append(time.perf_counter_ns() - start)
+    await sender.disconnect()
+    await receiver.disconnect()
+    return _median(latencies) / 1e9
+
+
+@scenario("socket_profiles")
+def socket_profiles(quick=False):
+    # "none" is the OS defaults
+    results = []
+    for profile in ("none", *PROFILES):
+        options = PROFILES.get(profile)
+        bursts, throughputs = [], []
+        for _ in range(REPEAT):
+            with LoopbackServer(socket_options=options, lazy_media=False) as server:
+                bursts.append(asyncio.run(_bursts(server.addr, 50 if quick else 300, 4, options)))
+                throughputs.append(asyncio.run(_fanout(server.addr, ROOM_SIZES[1], (0, 0, 1), 20 if quick else 100,
+                                                       options))[1])
+        results.append(Result(f"socket_profiles.{profile}.text_burst_latency", _median(bursts) * 1000, "ms",
+                              higher_is_better=False))
+        results.append(Result(f"socket_profiles.{profile}.media_throughput", _median(throughputs) / 1048576,
+                              "MiB/s"))
+    return results
+
+
+class _ThrottledReader:
+    """
+    Wraps a client's StreamReader so the client reads at about `rate` bytes per second, like one on a slow link
+    """
+    def __init__(self, reader, rate):
+        self._reader = reader
+        self._rate = rate
+
+    async def read(self, size):
+        data = await self._reader.read(min(size, 65536))
+        await asyncio.sleep(len(data) / self._rate)
+        return data
+
+    async def readexactly(self, size):
+        return await self._reader.readexactly(size)
+
+
+async def _text_behind_media(addr, num_files, file_size, num_texts, read_rate):
+    """
+    One member of a room of two sends `num_files` MP3s followed by `num_texts` short text messages. The other member
+    reads at `read_rate` bytes per second. Returns the median and worst time for the text messages to arrive.
+    """
+    sender = AsyncPychatClient("sender")
+    receiver = AsyncPychatClient("receiver")
+    await sender.init_connection(addr)
+    await receiver.init_connection(addr)
+    await _wait_for_joins(sender, ["sender", "receiver"])
+    await _wait_for_joins(receiver, ["receiver"])
+    receiver._reader = _ThrottledReader(receiver._reader, read_rate)
+    data = random.Random(0).randbytes(file_size)
+    for _ in range(num_files):
+        await sender.send_multimedia_msg(f"{time.perf_counter_ns()}.mp3", data)
+    for _ in range(num_texts):
+        await sender.send_chat_msg(f"{time.perf_counter_ns()}:".encode() + b"x" * MIX_SIZES[0], 1)
+    latencies = []
+    while len(latencies) < num_texts:
+        msg = await receiver.receive()
+        if msg.flags == 1:
+            latencies.append((time.perf_counter_ns() - int(bytes(msg.data).split(b":", 1)[0])) / 1e9)
+    await sender.disconnect()
+    await receiver.disconnect()
+    return _median(latencies), max(latencies)
+
+
+@scenario("priority")
+def priority(quick=False):
+    runs = []
+    for _ in range(REPEAT):
+        with LoopbackServer(lazy_media=False) as server:
+            runs.append(asyncio.run(_text_behind_media(server.addr, 4, 4194304, 10, 100 * 1048576)))
+    return [Result("priority.text_behind_media.p50_latency", _median([run[0] for run in runs]) * 1000, "ms",
+                   higher_is_better=False),
+            Result("priority.text_behind_media.max_latency", _median([run[1] for run in runs]) * 1000, "ms",
+                   higher_is_better=False)]
+
+
+async def _many_senders(addr, room_size, weights, num_msgs):
+    """
+    Every member of a room of `room_size` members sends `num_msgs` messages at once. Returns deliveries per second.
+    """
+    clients = []
+    for i in range(room_size):
+        client = AsyncPychatClient(f"member{i}")
+        await client.init_connection(addr)
+        clients.append(client)
+    for i, client in enumerate(clients):
+        await _wait_for_joins(client, [member.username for member in clients[i:]])
+
+    rng = random.Random(0)
+    payloads = {"image": rng.randbytes(MIX_SIZES[1]), "mp3": rng.randbytes(MIX_SIZES[2])}
+
+    async def send_all(sender, kinds):
+        for i, kind in enumerate(kinds):
+            if kind == "text":
+                await sender.send_chat_msg(b"x" * MIX_SIZES[0], 1)
+            else: # Named after the sender, so every file is stored rather than found already in the store
+                await sender.send_multimedia_msg(f"{sender.username}-{i}.{'png' if kind == 'image' else 'mp3'}",
+                                                 sender.username.encode() + i.to_bytes(4, "big") + payloads[kind])
+
+    async def receive_all(client):
+        received = 0
+        while received < room_size * num_msgs:
+            msg = await client.receive()
+            if msg.flags in (1, 2, 32):
+                received += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send_all(client, rng.choices(("text", "image", "mp3"), weights=weights, k=num_msgs))
+                           for client in clients),
+                         *(receive_all(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.disconnect()
+    return room_size * room_size * num_msgs / elapsed
+
+
+@scenario("routing_workers")
+def routing_workers(quick=False):
+    results = []
+    for mix_name in ("text", "mixed"):
+        weights, server_kwargs = MIXES[mix_name]
+        num_msgs = 20 if quick else 100
+        for workers in (1, 2, 4):
+            runs = []
+            for _ in range(REPEAT):
+                with LoopbackServer(routing_workers=workers, **server_kwargs) as server:
+                    runs.append(asyncio.run(_many_senders(server.addr, ROOM_SIZES[1], weights, num_msgs)))
+            results.append(Result(f"routing_workers.{mix_name}.workers{workers}.deliveries", _median(runs), "msg/s"))
+    return results
+
+
+
+def _run_churners(addr, num_churners, stop, sessions):
+    """
+    Keeps `num_churners` clients joining and leaving the room until `stop` is set, counting sessions in `sessions`
+    """
+    async def churn(churner_id):
+        session = 0
+        while not stop.is_set():
+            client = AsyncPychatClient(f"churn{churner_id}-{session}")
+            await client.init_connection(addr)
+            await client.disconnect()
+            session += 1
+            with sessions.get_lock():
+                sessions.value += 1
+
+    async def main():
+        await asyncio.gather(*(churn(i) for i in range(num_churners)))
+
+    asyncio.run(main())
+
+
+async def _churn(addr, room_size, num_msgs, num_churners):
+    """
+    One member sends `num_msgs` messages to a room of `room_size` members while `num_churners` other clients keep
+    joining and leaving (from another process, so they don't compete with the room for the GIL). Returns deliveries
+    per second and the number of joins and leaves per second.
+    """
+    clients = []
+    for i in range(room_size):
+        client = AsyncPychatClient(f"member{i}")
+        await client.init_connection(addr)
+        clients.append(client)
+    for i, client in enumerate(clients):
+        await _wait_for_joins(client, [member.username for member in clients[i:]])
+
+    async def receive_all(client):
+        received = 0
+        while received < num_msgs:
+            msg = await client.receive()
+            if msg.flags == 1:
+                received += 1
+
+    async def send_all(sender):
+        for _ in range(num_msgs):
+            await sender.send_chat_msg(b"x" * MIX_SIZES[0], 1)
+
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    sessions = ctx.Value("i", 0)
+    churners = ctx.Process(target=_run_churners, args=(addr, num_churners, stop, sessions), daemon=True)
+    if num_churners:
+        churners.start()
+        while not sessions.value:
+            await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    start_sessions = sessions.value
+    await asyncio.gather(send_all(clients[0]), *(receive_all(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    churned = sessions.value - start_sessions
+    stop.set()
+    if num_churners:
+        churners.join(timeout=5)
+    for client in clients:
+        await client.disconnect()
+    return room_size * num_msgs / elapsed, churned * 2 / elapsed
+
+
+@scenario("churn")
+def churn(quick=False):
+    results = []
+    for num_churners in (0, 8):
+        runs = []
+        for _ in range(REPEAT):
+            with LoopbackServer() as server:
+                runs.append(asyncio.run(_churn(server.addr, ROOM_SIZES[2], 500 if quick else 2000, num_churners)))
+        results.append(Result(f"churn.churners{num_churners}.deliveries", _median([run[0] for run in runs]), "msg/s"))
+        if num_churners:
+            results.append(Result(f"churn.churners{num_churners}.joins_and_leaves", _median([run[1] for run in runs]),
+                                  "events/s"))
+    return results
+
+
+async def _join_burst(addr, room_size):
+    """
+    `room_size` members join at once, as after a network outage. Returns the time until every member knew everyone
+    else was in the room, and the number of info messages each member was sent on average.
+    """
+    clients = [AsyncPychatClient(f"member{i}") for i in range(room_size)]
+    everyone = {client.username for client in clients}
+    received = 0
+
+    async def join(client):
+        nonlocal received
+        known = set(await client.init_connection(addr))
+        known.add(client.username)
+        while known != everyone:
+            msg = await client.receive()
+            if msg.flags != 4:
+                continue
+            received += 1
+            info = str(msg.data, 'utf-8')
+            if info.startswith("PRESENCE:"):
+                known.update(utils.decode_presence(info[9:])[0])
+            elif info.startswith("JOINED:"):
+                known.add(info[7:])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(join(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.disconnect()
+    return elapsed, received / room_size
+
+
+@scenario("presence")
+def presence(quick=False):
+    results = []
+    for label, interval in (("immediate", 0), ("batched", 0.25)):
+        for room_size in (ROOM_SIZES[2], 256):
+            runs = []
+            for _ in range(1 if quick else REPEAT):
+                # No summaries, so that members can tell when they know everyone
+                with LoopbackServer(presence_interval=interval, presence_summary_size=room_size) as server:
+                    runs.append(asyncio.run(_join_burst(server.addr, room_size)))
+            name = f"presence.{label}.room{room_size}"
+            results.append(Result(f"{name}.settle_time", _median([run[0] for run in runs]) * 1000, "ms",
+                                  higher_is_better=False))
+            results.append(Result(f"{name}.msgs_per_member", _median([run[1] for run in runs]), "msgs",
+                                  higher_is_better=False))
+    return results
+
+
+async def _audience(addr, audience_size, spectate, num_msgs):
+    """
+    `audience_size` members or spectators join a room one after another, then one member sends `num_msgs` messages.
+    Returns the number of joins per second and the number of deliveries per second.
+    """
+    sender = AsyncPychatClient("sender")
+    await sender.init_connection(addr)
+    audience = [AsyncPychatClient(f"viewer{i}", spectate=spectate) for i in range(audience_size)]
+    start = time.perf_counter()
+    for client in audience:
+        await client.init_connection(addr)
+    joins = audience_size / (time.perf_counter() - start)
+
+    async def receive_all(client):
+        received = 0
+        while received < num_msgs:
+            msg = await client.receive()
+            if msg.flags == 1:
+                received += 1
+
+    async def send_all():
+        for _ in range(num_msgs):
+            await sender.send_chat_msg(b"x" * MIX_SIZES[0], 1)
+
+    start = time.perf_counter()
+    await asyncio.gather(send_all(), *(receive_all(client) for client in [sender, *audience]))
+    deliveries = audience_size * num_msgs / (time.perf_counter() - start)
+    for client in [sender, *audience]:
+        await client.disconnect()
+    return joins, deliveries
+
+
+@scenario("spectators")
+def spectators(quick=False):
+    results = []
+    audience_size = 64 if quick else 256
+    for label, spectate in (("members", False), ("spectators", True)):
+        runs = []
+        for _ in range(REPEAT):
+            with LoopbackServer() as server:
+                runs.append(asyncio.run(_audience(server.addr, audience_size, spectate, 100 if quick else 500)))
+        name = f"spectators.{label}.audience{audience_size}"
+        results.append(Result(f"{name}.joins", _median([run[0] for run in runs]), "joins/s"))
+        results.append(Result(f"{name}.deliveries", _median([run[1] for run in runs]), "msg/s"))
+    return results
+
+
+def _read_messages(frame, count, pooled, measure_allocations=False):
+    """
+    Reads `count` copies of `frame` from a socket and decodes them, the way the server does: with recv() and a new
+    buffer for every message, or (if `pooled`) with recv_into() and pooled buffers. Returns the elapsed time and, if
+    `measure_allocations`, the bytes allocated per message (see tracemalloc).
+    """
+    reader, writer = socket.socketpair()
+
+    def write():
+        for _ in range(count):
+            writer.sendall(frame)
+        writer.close()
+
+    pool = BufferPool() if pooled else None
+    parser = FrameParser(pool=pool)
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+    allocated = 0
+    received = 0
+    threading.Thread(target=write, daemon=True).start()
+    if measure_allocations:
+        tracemalloc.start()
+    start = time.perf_counter()
+    while received < count:
+        if measure_allocations:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+        if pooled:
+            chunk = view[:reader.recv_into(buffer)]
+        else:
+            chunk = reader.recv(65536)
+        for msg in parser.feed(chunk):
+            utils.decode_msg(msg.payload)
+            if pooled:
+                pool.release(msg.payload)
+            received += 1
+        del chunk
+        if measure_allocations:
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    elapsed = time.perf_counter() - start
+    if measure_allocations:
+        tracemalloc.stop()
+    reader.close()
+    return elapsed, allocated / count
+
+
+@scenario("receive_path")
+def receive_path(quick=False):
+    results = []
+    for size in PAYLOAD_SIZES:
+        frame = bytes(encode_frame(utils.encode_msg(b"benchmark", bytes(size), 1)))
+        count = max(50, (16 if quick else 128) * 1048576 // max(size, 4096))
+        for pooled in (False, True):
+            label = f"receive_path.{'pooled' if pooled else 'unpooled'}.{_size_label(size)}"
+            elapsed = min(_read_messages(frame, count, pooled)[0] for _ in range(REPEAT))
+            _, allocated = _read_messages(frame, min(count, 2000), pooled, measure_allocations=True)
+            results.append(Result(f"{label}.throughput", count * size / elapsed / 1048576, "MiB/s"))
+            results.append(Result(f"{label}.allocated_per_msg", allocated, "bytes", higher_is_better=False))
+    return results
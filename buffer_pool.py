@@ -0,0 +1,85 @@
+"""
+Buffer pool (for pychat)
+Written by Joshua Kitchen - 2025
+
+Reuses the buffers that large messages are received into. A buffer too large for Python's own allocator comes straight
+from malloc, which (over 128 KiB with glibc) maps fresh pages for it that are faulted in as they are written and
+unmapped again once the message has been relayed. With media arriving all the time, that churns the allocator and
+fragments the heap, so the server keeps the buffers instead and receives the next message into one of them.
+
+Buffers come in size classes, powers of two from `min_size` up to the largest message allowed. acquire() returns a
+bytearray from the smallest class that fits, which is usually larger than was asked for, so callers use a memoryview of
+the part they need. release() gives it back (a memoryview of it can be passed as well). Each class keeps at most
+`max_free` buffers, and the pool keeps at most `max_bytes` in all. Anything more is left to the garbage collector, and
+so are buffers that are never released, so forgetting to release one only costs an allocation.
+
+A buffer must not be released while anything still uses it. The server releases a message's buffer once the message
+has been routed, since every frame queued for a client is a copy (see encode_frame()).
+"""
+
+import threading
+
+DEFAULT_MIN_SIZE = 65536 # Smaller messages are left to Python's allocator, which is faster for them
+DEFAULT_MAX_FREE = 16
+DEFAULT_MAX_BYTES = 134_217_728 # 128 MiB
+
+
+class BufferPool:
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, max_free=DEFAULT_MAX_FREE, max_bytes=DEFAULT_MAX_BYTES):
+        if min_size <= 0 or min_size & (min_size - 1):
+            raise ValueError("min_size must be a power of two")
+        self.min_size = min_size
+        self.max_free = max_free
+        self.max_bytes = max_bytes
+        self._free = {} # Size class -> list of free buffers
+        self._free_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def size_class(self, size):
+        """
+        Returns the size of the buffers that a message of `size` bytes is received into, or None if it isn't pooled
+        """
+        if size < self.min_size:
+            return
+        return 1 << (size - 1).bit_length()
+
+    def acquire(self, size):
+        """
+        Returns a bytearray of at least `size` bytes. Its contents are whatever was left in it.
+        """
+        size_class = self.size_class(size)
+        if size_class is None:
+            return bytearray(size)
+        with self._lock:
+            free = self._free.get(size_class)
+            if free:
+                self._free_bytes -= size_class
+                self._hits += 1
+                return free.pop()
+            self._misses += 1
+        return bytearray(size_class)
+
+    def release(self, buffer):
+        """
+        Takes back a buffer returned by acquire(), or a memoryview of one. Anything else is ignored.
+        """
+        if isinstance(buffer, memoryview):
+            buffer = buffer.obj
+        if not isinstance(buffer, bytearray) or self.size_class(len(buffer)) != len(buffer):
+            return
+        with self._lock:
+            free = self._free.setdefault(len(buffer), [])
+            if len(free) >= self.max_free or self._free_bytes + len(buffer) > self.max_bytes:
+                return
+            free.append(buffer)
+            self._free_bytes += len(buffer)
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of pooled buffers that were reused ("hits") and allocated ("misses"), and
+        the number of bytes held in free buffers ("free_bytes")
+        """
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "free_bytes": self._free_bytes}
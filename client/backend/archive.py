@@ -0,0 +1,126 @@
+"""
+Chat archive export (for pychat)
+Written by Joshua Kitchen - 2025
+
+Writes a chat archive to a zip file from a thread of its own, so exporting a long history never freezes the window.
+The archive holds "chat.txt", one line per message, followed by the media the messages refer to, copied byte for byte
+from where they were saved into "media/". Each file is added once, however many messages refer to it.
+
+The lines are streamed into the compressed text file as they come, so the archive is written in one pass over the
+history without holding it in memory. Media is already compressed, so it is stored as it is. The archive is written
+to "<path>.part" and only renamed to `path` once it is complete, so a cancelled or failed export leaves nothing behind.
+
+The window follows an export by polling it (see ExportDialog), so nothing here touches Tk.
+"""
+
+import io
+import logging
+import os
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = "messages"
+MEDIA = "media"
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ArchiveExport:
+    """
+    `records` is an iterable of (line, media path) tuples, where the media path is the saved file the message refers
+    to, or None. It is consumed by the export thread, so a generator can read the history lazily. `total` is how many
+    records there are, for reporting progress.
+    """
+    def __init__(self, path, records, total):
+        self.path = path
+        self._records = records
+        self.phase = MESSAGES
+        self.done = 0
+        self.total = total
+        self.error = None
+        self._cancelled = False
+        self._finished = threading.Event()
+        self._thread = None
+
+    @property
+    def is_finished(self):
+        return self._finished.is_set()
+
+    @property
+    def was_cancelled(self):
+        return self._cancelled
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="PychatArchiveExport")
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled = True
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _check_cancelled(self):
+        if self._cancelled:
+            raise ExportCancelled()
+
+    def _write_messages(self, archive):
+        """
+        Returns a dictionary of the name in the archive -> the path of every media file referred to
+        """
+        media = {}
+        with archive.open("chat.txt", 'w', force_zip64=True) as raw:
+            text = io.TextIOWrapper(raw, encoding='utf-8', newline='\n')
+            for line, media_path in self._records:
+                if media_path is not None and os.path.exists(media_path):
+                    name = f"media/{os.path.basename(media_path)}"
+                    media[name] = media_path
+                    line = f"{line} [{name}]"
+                text.write(f"{line}\n")
+                self.done += 1
+                if not self.done % 1000:
+                    self._check_cancelled()
+            text.flush()
+            text.detach()
+        return media
+
+    def _write_media(self, archive, media):
+        self.phase = MEDIA
+        self.done = 0
+        self.total = len(media)
+        for name, media_path in media.items():
+            self._check_cancelled()
+            try:
+                archive.write(media_path, name, compress_type=zipfile.ZIP_STORED)
+            except OSError as e: # Deleted since, or unreadable
+                logger.warning("Could not add %s to the archive: %s", media_path, e)
+            self.done += 1
+
+    def _run(self):
+        part_path = f"{self.path}.part"
+        try:
+            with zipfile.ZipFile(part_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+                self._write_media(archive, self._write_messages(archive))
+            self._check_cancelled()
+            os.replace(part_path, self.path)
+            logger.info("Chat archive saved to %s", self.path)
+        except ExportCancelled:
+            logger.info("Chat archive export to %s was cancelled", self.path)
+        except Exception as e: # Reported to the window, which has no other way of finding out
+            logger.exception("Could not export the chat archive to %s", self.path)
+            self.error = e
+        finally:
+            if hasattr(self._records, "close"): # Closes a generator's database connection from the thread that used it
+                self._records.close()
+            if os.path.exists(part_path):
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+            self._finished.set()
@@ -0,0 +1,209 @@
+"""
+Chat history (for pychat)
+Written by Joshua Kitchen - 2025
+
+Keeps every message the client receives in a SQLite database, one per chat room (server address and port), so a
+conversation outlives the window. The server echoes a client's own messages back to it, so they are recorded the same
+way as everyone else's.
+
+Messages are recorded from the network thread (see PychatClient.msg_loop()). Each one is only added to a list, and
+everything received from one read of the socket is then inserted in a single transaction (see commit()). The database
+is in WAL mode, so the window can search it and load scrollback from a connection of its own while messages are being
+written, without either waiting on the other.
+
+Message text, senders and filenames are indexed with FTS5, so a search takes milliseconds however much history there
+is. Results are read from the index newest first, and only as many as are shown. The last term of a search matches any
+word starting with it, since it is usually still being typed, and the index keeps the 2 and 3 character prefixes of
+every word so that short ones are as quick to search for as whole words.
+
+Media is recorded by its SHA-256 digest rather than by filename, since any number of different files can share a name.
+The window saves files under their digest as well (see MainWin.save_media()), so a recorded file can be found again
+whether it was received in full or only announced and downloaded later.
+
+SCHEMA
+    messages     - id, time (seconds since the epoch), sender, flags (as in the protocol: text, multimedia or info,
+                   combined with direct), recipients (comma separated, for direct messages), body (the text, the
+                   filename of a file, or the info message), digest and size (of a file)
+    messages_fts - FTS5 index of the sender and body of every message, kept up to date by triggers
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    sender TEXT NOT NULL,
+    flags INTEGER NOT NULL,
+    recipients TEXT,
+    body TEXT NOT NULL,
+    digest TEXT,
+    size INTEGER
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(sender, body, content='messages', content_rowid='id',
+                                                        prefix='2 3');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, sender, body) VALUES (new.id, new.sender, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, body) VALUES ('delete', old.id, old.sender, old.body);
+END;
+"""
+COLUMNS = "id, time, sender, flags, recipients, body, digest, size"
+RECORDED_INFO = ("JOINED:", "LEFT:", "PRESENCE:", "PRESENCE_SUMMARY:", "SERVERMSG:") # Info messages worth keeping
+
+
+class HistoryEntry:
+    __slots__ = ("id", "time", "sender", "flags", "recipients", "body", "digest", "size")
+
+    def __init__(self, id, time, sender, flags, recipients, body, digest, size):
+        self.id = id
+        self.time = time
+        self.sender = sender
+        self.flags = flags
+        self.recipients = recipients.split(',') if recipients else []
+        self.body = body
+        self.digest = digest
+        self.size = size
+
+
+def room_filename(addr):
+    """
+    Returns the name of the database file for the chat room at `addr` (host, port)
+    """
+    host = re.sub(r"[^A-Za-z0-9.-]", "_", str(addr[0]))
+    return f"{host}_{addr[1]}.sqlite3"
+
+
+class ChatHistory:
+    """
+    The history of one chat room, stored at `path`. Recording (record_*() and commit()) is meant for the network thread,
+    and reading (page(), count() and search()) for the window's.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._reader = self._connect()
+        self._pending = []
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self.session_start = self._writer.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM messages").fetchone()[0]
+
+    @classmethod
+    def open_room(cls, directory, addr):
+        """
+        Opens (or creates) the history of the chat room at `addr` (host, port) in `directory`
+        """
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, room_filename(addr)))
+
+    def _connect(self):
+        # Each connection is only used by one thread at a time, under its lock
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # Safe in WAL mode, unless the OS itself crashes
+        return connection
+
+    def close(self):
+        self.commit()
+        with self._write_lock:
+            self._writer.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def _record(self, sender, flags, body, recipients=None, digest=None, size=None):
+        recipients = ','.join(recipients) if recipients else None
+        with self._write_lock:
+            self._pending.append((time.time(), sender, flags, recipients, body, digest, size))
+
+    def record_text(self, sender, text, recipients=None):
+        self._record(sender, 1 | (16 if recipients else 0), text, recipients)
+
+    def record_media(self, sender, filename, digest, size, recipients=None):
+        self._record(sender, 2 | (16 if recipients else 0), filename, recipients, digest, size)
+
+    def record_info(self, msg):
+        if msg.startswith(RECORDED_INFO):
+            self._record("SERVER", 4, msg)
+
+    def commit(self):
+        """
+        Writes every message recorded since the last commit in one transaction
+        """
+        with self._write_lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = []
+            try:
+                with self._writer: # isolation_level=None, so the transaction has to be started here
+                    self._writer.execute("BEGIN")
+                    self._writer.executemany("INSERT INTO messages (time, sender, flags, recipients, body, digest, size) "
+                                             "VALUES (?, ?, ?, ?, ?, ?, ?)", pending)
+            except sqlite3.Error as e:
+                logger.warning("Could not write %d message(s) to %s: %s", len(pending), self.path, e)
+
+    def _query(self, sql, params):
+        with self._read_lock:
+            try:
+                rows = self._reader.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                logger.warning("Could not read from %s: %s", self.path, e)
+                return []
+        return [HistoryEntry(*row) for row in rows]
+
+    def page(self, before_id, limit):
+        """
+        Returns up to `limit` of the messages recorded before `before_id`, oldest first
+        """
+        entries = self._query(f"SELECT {COLUMNS} FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?",
+                              (before_id, limit))
+        entries.reverse()
+        return entries
+
+    def count(self):
+        with self._read_lock:
+            try:
+                return self._reader.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            except sqlite3.Error as e:
+                logger.warning("Could not read from %s: %s", self.path, e)
+                return 0
+
+    def iter_messages(self, batch_size=1000):
+        """
+        Yields every message recorded, oldest first. It reads from a connection of its own, so it can be used from any
+        thread for as long as it takes without holding up the window's reads.
+        """
+        connection = sqlite3.connect(self.path)
+        try:
+            cursor = connection.execute(f"SELECT {COLUMNS} FROM messages ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield HistoryEntry(*row)
+        finally:
+            connection.close()
+
+    def search(self, query, limit=200):
+        """
+        Returns up to `limit` of the most recent messages whose sender, text or filename contains every term in
+        `query` (the last one as the start of a word), newest first
+        """
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if not terms:
+            return []
+        terms[-1] += '*'
+        columns = ", ".join(f"m.{column}" for column in COLUMNS.split(", "))
+        return self._query(f"SELECT {columns} FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                           f"WHERE messages_fts MATCH ? ORDER BY messages_fts.rowid DESC LIMIT ?",
+                           (' '.join(terms), limit))
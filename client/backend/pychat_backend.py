@@ -14,23 +14,58 @@ FLAGS:
     2 = Multimedia
     4 = Information
     8 = Disconnect
+    16 = Direct (combined with 1 or 2)
+    32 = Media announcement
+    128 = Trace (may be combined with any other flag)
+
+If the trace flag is set, the first 8 bytes of the data are the client's send timestamp (nanoseconds since the epoch).
+The server strips the timestamp and the trace flag before relaying the message.
+
+If the direct flag is set, an additional header is included at the start of the data. The message is only sent to the
+listed recipients (and echoed back to the sender):
+[Recipients Length (4 bytes)][Comma separated list of recipient usernames]
+
+A media announcement is sent by the server in place of a multimedia message. Clients download the file only when the
+user opens it by sending the info message "FETCH:<SHA-256 hex digest>", and the server replies with the full
+multimedia message. The announcement's data is:
+[Filename Length (4 bytes)][Filename][File Size (8 bytes)][SHA-256 digest (32 bytes)][PNG thumbnail (may be empty)]
 
 If the message is a multimedia message, an additional header is included in the message body (flags should always be 2):
 [Filename Length (4 bytes)][Filename]
 
 The information flag is used when the server and the client need to pass along information.
 Possible info messages are:
-- JOINED:<user id>
-- LEFT:<user id>
+- JOINED:<user id> (from servers that don't batch joins and leaves)
+- LEFT:<user id> (from servers that don't batch joins and leaves)
+- PRESENCE:<comma separated list of "+<user id>" for members who joined and "-<user id>" for members who left>
+- PRESENCE_SUMMARY:<number of members who joined>:<number who left> (sent instead of PRESENCE in large rooms)
 - MEMBERS:<list of connected users>
-- KICKED:<no message body>
+- KICKED:<no message body> (sent to a client that the server is about to disconnect)
 - SERVERMSG:<message>
+- FETCH:<SHA-256 hex digest> (sent by clients to download an announced file)
+- PING:<token>:<idle timeout in seconds> (sent by the server)
+- PONG:<token> (the client's answer to a PING)
+
+The server pings every client regularly and evicts clients that send nothing (not even a PONG) for the idle timeout.
+Once pinged, the client uses the same timeout to notice a server that has gone away.
+
+Once connected, everything is sent from the send queue's thread (see send_queue.py), so sending never blocks the
+window. Multimedia messages are queued as uploads, which report their progress to the window and can be cancelled.
+
+If given a history directory, the client records every message it receives in the chat room's history (see
+history.py).
 """
+import hashlib
 import logging
 import socket
+import sqlite3
 
 from TCPLib.tcp_client import TCPClient
 import client.backend.exceptions as exc
+from client.backend.history import ChatHistory
+from client.backend.send_queue import SendQueue, Upload
+from frame_parser import FrameParser, ProtocolError, encode_frame
+from socket_options import SocketOptions
 import utils
 
 logger = logging.getLogger(__name__)
@@ -40,24 +75,87 @@ class PychatClient:
     """
     Backend for the pychat client.
     """
-    def __init__(self, window, timeout):
+    def __init__(self, window, timeout, trace=False, socket_options: SocketOptions | None = None, history_dir=None):
         self.tcp_client = TCPClient(timeout=timeout)
+        self.socket_options = socket_options # Applied to the connection once it's made (see socket_options.py)
+        self._send_queue = None # Created once connected
+        self.history_dir = history_dir
+        self.history = None # The ChatHistory of the room last connected to, if history_dir was given
+        self._fetching = set() # Digests of announced files that were asked for, which are already in the history
         self.window = window
         self.username = ""
+        self.trace = trace
 
-    def send_chat_msg(self, data: bytes, flags: int):
-        return self.tcp_client.send(utils.encode_msg(bytes(self.username, 'utf-8'), data, flags))
+    def send_chat_msg(self, data: bytes, flags: int, recipients=None):
+        """
+        If a list of recipients is given, the message is sent as a direct message that only they will receive
+        """
+        if recipients:
+            data = utils.encode_direct_body(recipients, data)
+            flags |= 16
+        if self.trace:
+            data = utils.add_trace_timestamp(data)
+            flags |= 128
+        return self._send(utils.encode_msg(bytes(self.username, 'utf-8'), data, flags))
 
-    def send_multimedia_msg(self, filename, data):
+    def _send(self, msg: bytes):
+        """
+        Queues a message ahead of any uploads. Returns False if not connected.
+        """
+        send_queue = self._send_queue
+        return send_queue is not None and send_queue.put(encode_frame(msg))
+
+    def send_multimedia_msg(self, filename, data, recipients=None):
         """
         Additional multimedia message header included in the message body:
         [Filename Length (4 bytes)][Filename]
+
+        Returns the queued Upload (see send_queue.py), or None if not connected. The window's show_upload_progress()
+        is called as it is sent, and upload_finished() once it has been sent, cancelled, or has failed.
+        """
+        prefix = utils.encode_multimedia_body(filename, b"") # Everything in the data that comes before the file
+        flags = 2
+        if recipients:
+            prefix = utils.encode_direct_body(recipients, prefix)
+            flags |= 16
+        if self.trace:
+            prefix = utils.add_trace_timestamp(prefix)
+            flags |= 128
+        header = utils.encode_msg(bytes(self.username, 'utf-8'), prefix, flags)
+        header[4:8] = (len(prefix) + len(data)).to_bytes(4, "big")
+        upload = Upload(filename, (len(header) + len(data)).to_bytes(4, "big") + header, data)
+        send_queue = self._send_queue
+        if send_queue is None or not send_queue.put_upload(upload):
+            return
+        return upload
+
+    def cancel_upload(self, upload: Upload):
+        """
+        Cancels an upload. If it has already started being sent, this disconnects from the server (see send_queue.py).
         """
-        msg = bytearray()
-        msg.extend(len(filename).to_bytes(4, byteorder="big"))
-        msg.extend(bytes(filename, "utf-8"))
-        msg.extend(data)
-        return self.send_chat_msg(msg, flags=2)
+        send_queue = self._send_queue
+        if send_queue is not None:
+            send_queue.cancel(upload)
+
+    def pending_uploads(self):
+        """
+        Returns the uploads that haven't finished, starting with the one being sent
+        """
+        send_queue = self._send_queue
+        return send_queue.pending_uploads() if send_queue is not None else []
+
+    def fetch_media(self, digest: str):
+        """
+        Asks the server for the full contents of an announced file. The server replies with a multimedia message.
+        """
+        self._fetching.add(digest)
+        return self._send(utils.encode_msg(bytes(self.username, 'utf-8'), bytes(f"FETCH:{digest}", 'utf-8'), 4))
+
+    def answer_ping(self, ping: str):
+        _, token, idle_timeout = ping.split(':', 2)
+        if self.tcp_client.timeout is None and float(idle_timeout) > 0:
+            self.tcp_client.timeout = float(idle_timeout)
+        return self._send(utils.encode_msg(bytes(self.username, 'utf-8'), bytes(f"PONG:{token}", 'utf-8'), 4))
 
     def set_username(self, username):
         self.username = username
@@ -89,10 +187,12 @@ class PychatClient:
             return False
         except socket.gaierror: # Unresolvable address
             return False
+        if self.socket_options is not None:
+            self.socket_options.apply(self.tcp_client._soc)
         self.tcp_client.send(bytes(self.username, "utf-8"))
         server_response = self.tcp_client.receive()
         server_response = bytearray.decode(server_response, "utf-8")
-        logger.debug(f"Server Response={server_response}")
+        logger.debug("Server Response=%s", server_response)
         if server_response == "USERNAME TAKEN":
             self.tcp_client.disconnect()
             raise exc.UserIDTaken()
@@ -103,36 +203,115 @@ class PychatClient:
             self.tcp_client.disconnect()
             raise exc.ServerFull()
         elif server_response[0:8] == "MEMBERS:":
+            self.open_history(addr)
+            self._send_queue = SendQueue(self.tcp_client._soc, self.window.show_upload_progress,
+                                         self.window.upload_finished)
+            self._send_queue.start()
             self.window.create_member_list(server_response[8:])
             return True
         else:
             self.tcp_client.disconnect()
             return False
 
+    def open_history(self, addr):
+        """
+        Opens the history of the chat room at `addr`. It stays open after disconnecting, so it can still be searched.
+        """
+        if self.history_dir is None:
+            return
+        if self.history is not None:
+            self.history.close()
+            self.history = None
+        try:
+            self.history = ChatHistory.open_room(self.history_dir, addr)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Could not open the chat history for %s @ %d: %s", addr[0], addr[1], e)
+
     def disconnect(self):
+        if self._send_queue is not None:
+            self._send_queue.close()
         self.tcp_client.disconnect()
+        if self.history is not None:
+            self.history.commit()
         self.window.show_disconnect_msg()
 
     def msg_loop(self):
+        """
+        Reads from the server into the same buffer every time, since the parser copies out whatever it keeps
+        """
+        parser = FrameParser()
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
         while self.tcp_client.is_connected:
             try:
-                msg = self.tcp_client.receive()
+                count = self.tcp_client._soc.recv_into(buffer)
+            except AttributeError: # Disconnected from another thread
+                count = 0
             except ConnectionError:
                 self.disconnect()
                 return
-            if msg == b'':
+            except TimeoutError:
+                logger.warning("Nothing was received from the server for %s seconds. Disconnecting.",
+                               self.tcp_client.timeout)
                 self.disconnect()
                 return
-            msg_contents = utils.decode_msg(msg)
-            logger.debug(f"MESSAGE FROM {msg_contents['username']}:"
-                          f"    DATA SIZE: {msg_contents['data_size']}"
-                          f"        FLAGS: {msg_contents['flags']}")
-            if msg_contents['flags'] == 1:
-                self.window.process_msg(msg_contents['username'], str(msg_contents['data'], 'utf-8'))
-            elif msg_contents['flags'] == 2:
-                self.window.process_multimedia_msg(msg_contents['username'], msg_contents['data'])
-            elif msg_contents['flags'] == 4:
-                self.window.process_info_msg(str(msg_contents['data'], 'utf-8'))
-            elif msg_contents['flags'] == 8:
-                self.tcp_client.disconnect()
+            if count == 0:
+                self.disconnect()
+                return
+            try:
+                msgs = parser.feed(view[:count])
+            except ProtocolError as e:
+                logger.warning("Disconnecting from the server: %s", e)
+                self.disconnect()
+                return
+            for msg in msgs:
+                self.process_msg(msg)
+            if msgs and self.history is not None:
+                self.history.commit()
+
+    def process_msg(self, msg):
+        """
+        Passes a message from the server (a frame_parser.ChatMessage) to the window, and records it in the history
+        """
+        logger.debug("MESSAGE FROM %s:    DATA SIZE: %d        FLAGS: %d", msg.username, len(msg.data), msg.flags)
+        history = self.history
+        if msg.flags == 1:
+            text = str(msg.data, 'utf-8')
+            if history is not None:
+                history.record_text(msg.username, text)
+            self.window.process_msg(msg.username, text)
+        elif msg.flags == 2:
+            self.process_multimedia_msg(msg.username, msg.data)
+        elif msg.flags == 4 and msg.data[0:5] == b"PING:":
+            self.answer_ping(str(msg.data, 'utf-8'))
+        elif msg.flags == 4:
+            info = str(msg.data, 'utf-8')
+            if history is not None:
+                history.record_info(info)
+            self.window.process_info_msg(info)
+        elif msg.flags == 8:
+            self._send_queue.close()
+            self.tcp_client.disconnect()
+        elif msg.flags == 32:
+            filename, size, digest, thumbnail = utils.decode_media_announcement(msg.data)
+            if history is not None:
+                history.record_media(msg.username, filename, digest, size)
+            self.window.process_media_announcement(msg.username, filename, size, digest, thumbnail)
+        elif msg.flags & 16:
+            recipients, data = utils.decode_direct_body(msg.data)
+            if msg.flags & 1:
+                text = str(data, 'utf-8')
+                if history is not None:
+                    history.record_text(msg.username, text, recipients)
+                self.window.process_direct_msg(msg.username, recipients, text)
+            elif msg.flags & 2:
+                self.process_multimedia_msg(msg.username, data, recipients)
 
+    def process_multimedia_msg(self, sender, body, recipients=None):
+        filename, data = utils.decode_multimedia_body(body)
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self._fetching:
+            self._fetching.discard(digest)
+        elif self.history is not None:
+            self.history.record_media(sender, filename, digest, len(data), recipients)
+        self.window.process_multimedia_msg(sender, filename, data, digest)
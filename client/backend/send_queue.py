@@ -0,0 +1,222 @@
+"""
+Send queue (for pychat)
+Written by Joshua Kitchen - 2025
+
+Sends the client's messages from a thread of its own, so the window never waits on the connection. Sending used to
+happen on the Tk thread, and an MP3 froze the window until the socket had taken every byte of it.
+
+Text and info messages (PONGs and FETCHes) always go ahead of any uploads that are waiting. An upload is a multimedia
+message, which is written CHUNK_SIZE bytes at a time, and its progress is reported after every chunk (see Upload).
+Since the protocol has no way of splitting a message, text written while an upload is being sent goes out as soon as
+that upload's message has been written, ahead of every upload queued after it.
+
+An upload that is still waiting can be cancelled without anyone noticing. One that has started being written can only
+be cancelled by closing the connection, since the server would otherwise take whatever is sent next as the rest of
+the file. The server throws away the part of the message it had received.
+"""
+
+import collections
+import logging
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 65536
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+class Upload:
+    """
+    A multimedia message waiting to be sent, or being sent, made of `header` (frame size header included) followed by
+    the file's `data`, which is sent as it is rather than copied into one frame. `sent` is how many bytes of it have
+    been written.
+    """
+    __slots__ = ("filename", "header", "data", "size", "sent", "status")
+
+    def __init__(self, filename, header: bytes, data: bytes):
+        self.filename = filename
+        self.header = header
+        self.data = data
+        self.size = len(header) + len(data)
+        self.sent = 0
+        self.status = QUEUED
+
+    @property
+    def progress(self):
+        """
+        The fraction of the upload that has been sent (0 to 1)
+        """
+        return self.sent / self.size if self.size else 1.0
+
+    @property
+    def is_finished(self):
+        return self.status in (SENT, CANCELLED, FAILED)
+
+
+class SendQueue:
+    """
+    `on_progress` is called with an Upload after each chunk of it has been written, and `on_finished` once it has been
+    sent, cancelled, or has failed. Both are called from the sender thread, or from whichever thread closed the queue.
+    """
+    def __init__(self, soc: socket.socket, on_progress=None, on_finished=None):
+        self._soc = soc
+        self._on_progress = on_progress
+        self._on_finished = on_finished
+        self._msgs = collections.deque()
+        self._uploads = collections.deque()
+        self._current = None # The upload being written
+        self._closed = False
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._thread = None
+
+    @property
+    def is_closed(self):
+        return self._closed
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._write_loop, daemon=True, name="PychatSendQueue")
+        self._thread.start()
+
+    def put(self, frame: bytes) -> bool:
+        """
+        Queues a text or info message (size header included) ahead of any waiting uploads. Returns False if the queue
+        is closed.
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            self._msgs.append(frame)
+            self._cond.notify()
+        return True
+
+    def put_upload(self, upload: Upload) -> bool:
+        """
+        Queues an upload behind any others. Returns False if the queue is closed.
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            self._uploads.append(upload)
+            self._cond.notify()
+        return True
+
+    def pending_uploads(self):
+        """
+        Returns a list of the upload being written (if any) followed by those waiting
+        """
+        with self._cond:
+            current = [self._current] if self._current is not None else []
+            return current + list(self._uploads)
+
+    def cancel(self, upload: Upload):
+        """
+        Cancels an upload. If it has started being written, the connection is closed (see the module docstring).
+        """
+        with self._cond:
+            if upload.is_finished:
+                return
+            if upload is not self._current:
+                try:
+                    self._uploads.remove(upload)
+                except ValueError:
+                    return
+                upload.status = CANCELLED
+            else:
+                if upload.sent == upload.size: # Written already, and about to be reported as sent
+                    return
+                upload.status = CANCELLED # The sender thread reports it once the socket gives up
+                self._shutdown()
+                return
+        self._finished(upload)
+
+    def close(self):
+        """
+        Stops the sender thread and shuts the connection down. Every upload that hasn't been sent fails, and anything
+        else still queued is discarded.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            failed = list(self._uploads)
+            self._uploads.clear()
+            self._msgs.clear()
+            self._cond.notify_all()
+        self._shutdown() # Closing the socket doesn't wake a thread blocked writing to it
+        for upload in failed:
+            upload.status = FAILED
+            self._finished(upload)
+
+    def _shutdown(self):
+        try:
+            self._soc.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _finished(self, upload):
+        upload.header = upload.data = None
+        if self._on_finished is not None:
+            self._on_finished(upload)
+
+    def _write_upload(self, upload):
+        self._soc.sendall(upload.header)
+        upload.sent = len(upload.header)
+        view = memoryview(upload.data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            if upload.status == CANCELLED or self._closed:
+                raise ConnectionAbortedError("Upload cancelled")
+            chunk = view[start:start + CHUNK_SIZE]
+            self._soc.sendall(chunk)
+            upload.sent += len(chunk)
+            if self._on_progress is not None:
+                self._on_progress(upload)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._msgs and not self._uploads:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                upload = None
+                if self._msgs:
+                    data = b"".join(self._msgs)
+                    self._msgs.clear()
+                else:
+                    upload = self._uploads.popleft()
+                    upload.status = SENDING
+                    self._current = upload
+            try:
+                if upload is None:
+                    self._soc.sendall(data)
+                else:
+                    self._write_upload(upload)
+            except OSError as e: # Includes ConnectionError and TimeoutError
+                logger.debug("Could not send to the server: %s", e)
+                with self._cond:
+                    self._current = None
+                if upload is not None:
+                    if upload.status != CANCELLED:
+                        upload.status = FAILED
+                    self._finished(upload)
+                self.close() # Shuts the socket down, so the receive loop notices and the client disconnects
+                return
+            if upload is not None:
+                with self._cond:
+                    self._current = None
+                    cancelled = upload.status == CANCELLED # Cancelled as the last chunk was being written
+                    if not cancelled:
+                        upload.status = SENT
+                self._finished(upload)
+                if cancelled: # The connection has already been shut down
+                    self.close()
+                    return
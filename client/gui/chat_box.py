@@ -15,14 +15,23 @@ class ChatBox(tk.Frame):
                                 foreground=self.parent.widget_fg, font=self.parent.font, insertbackground=self.parent.widget_bg,
                                 state=tk.DISABLED, cursor="arrow")
         self.chat_scroll = ttk.Scrollbar(self, command=self.chat_box.yview)
-        self.chat_box.configure(yscrollcommand=self.chat_scroll.set, relief=tk.FLAT)
+        self.chat_box.configure(yscrollcommand=self._on_scroll, relief=tk.FLAT)
+        self.load_older = None # Returns the text of the next page of history above what's shown (see start_scrollback)
+        self._loading = False
         self.chat_box.tag_configure("Center", justify='center')
         self.chat_box.tag_configure("serverMsg", justify='center', foreground="#FF0000")
-        for color in self.parent.available_colors:
+        self.chat_box.tag_configure("directMsg", font=(self.parent.font_family, self.parent.font_size, "italic"))
+        self.chat_box.tag_configure("history", foreground="#808080")
+        self.color_tags = set() # Configured as members are first shown (see add_color_tag)
+
+    def add_color_tag(self, color):
+        if color not in self.color_tags:
             self.chat_box.tag_configure(color, foreground=color)
+            self.color_tags.add(color)
 
     def update_font(self):
         self.chat_box.configure(font=(self.parent.font_family, self.parent.font_size))
+        self.chat_box.tag_configure("directMsg", font=(self.parent.font_family, self.parent.font_size, "italic"))
 
     def pack_widgets(self):
         self.chat_scroll.pack(side=tk.RIGHT, fill=tk.Y, padx=(5, self.parent.padx), pady=self.parent.pady)
@@ -36,10 +45,41 @@ class ChatBox(tk.Frame):
         self.chat_box.see(tk.END)
         self.chat_box.configure(state=tk.DISABLED)
 
+    def start_scrollback(self, load_older):
+        """
+        `load_older` is called whenever the chat box is scrolled to the top, and returns a list of lines to show above
+        everything else (oldest first), or an empty list once there is nothing more
+        """
+        self.load_older = load_older
+        self.after_idle(self._load_scrollback)
+
+    def _on_scroll(self, first, last):
+        self.chat_scroll.set(first, last)
+        if float(first) == 0.0 and self.load_older is not None and not self._loading:
+            self._loading = True
+            self.after_idle(self._load_scrollback) # Not while the text widget is redrawing
+
+    def _load_scrollback(self):
+        self._loading = False
+        if self.load_older is None:
+            return
+        lines = self.load_older()
+        if not lines:
+            self.load_older = None
+            return
+        text = "".join(f"{line}\n" for line in lines)
+        num_lines = text.count("\n")
+        top = self.chat_box.index("@0,0")
+        self.chat_box.configure(state=tk.NORMAL)
+        self.chat_box.insert("1.0", text, ["history"])
+        self.chat_box.configure(state=tk.DISABLED)
+        self.chat_box.yview(f"{top} + {num_lines} lines") # Keep showing what was shown before
+
     def get_chat_contents(self):
         return self.chat_box.get(0.0, tk.END)
 
     def clear_chat_box(self, *args):
+        self.load_older = None
         self.chat_box.configure(state=tk.NORMAL)
         self.chat_box.delete(0.0, tk.END)
         self.chat_box.configure(state=tk.DISABLED)
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+Export dialog
+Written by Joshua Kitchen - 2025
+"""
+import tkinter as tk
+import tkinter.ttk as ttk
+from tkinter import messagebox
+
+from client.backend.archive import MESSAGES
+
+POLL_INTERVAL = 100 # Milliseconds
+
+
+class ExportDialog:
+    """
+    Dialog window showing the progress of a chat archive export (see archive.py), which can be cancelled from it. The
+    export runs in a thread of its own, and is polled from here so that only the Tk thread touches the window.
+    """
+    def __init__(self, parent, main_win, export):
+        self.parent = parent
+        self.parent.title("Archive chat")
+        self.parent.geometry("420x110")
+        self.parent.resizable(False, False)
+        self.main_win = main_win
+        self.export = export
+
+        self.status_var = tk.StringVar()
+        self.status_label = tk.Label(self.parent, textvariable=self.status_var, anchor=tk.W)
+        self.progress = ttk.Progressbar(self.parent, mode="determinate", maximum=100, length=400)
+        self.cancel_button = ttk.Button(self.parent, text="Cancel", command=self.cancel)
+
+        self.status_label.pack(side=tk.TOP, fill=tk.X, padx=10, pady=(10, 0))
+        self.progress.pack(side=tk.TOP, padx=10, pady=5)
+        self.cancel_button.pack(side=tk.BOTTOM, pady=(0, 10))
+        self.parent.protocol('WM_DELETE_WINDOW', self.cancel)
+        self._poll()
+
+    def cancel(self):
+        self.export.cancel()
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.status_var.set("Cancelling...")
+
+    def _poll(self):
+        export = self.export
+        if export.is_finished:
+            self.parent.destroy()
+            if export.error is not None:
+                messagebox.showerror(title="Error", message=f"Could not save the chat archive: {export.error}")
+            elif export.was_cancelled:
+                self.main_win.chat_box_frame.write_to_chat_box("-- Chat archive cancelled --", tags=["Center"])
+            else:
+                self.main_win.chat_box_frame.write_to_chat_box(f"-- Chat archive saved to {export.path} --",
+                                                               tags=["Center"])
+            return
+        total = max(export.total, export.done, 1) # Messages received during the export may be added as well
+        self.progress.configure(value=export.done / total * 100)
+        if not export.was_cancelled:
+            kind = "messages" if export.phase == MESSAGES else "media files"
+            self.status_var.set(f"Writing {kind}: {export.done} of {total}")
+        self.parent.after(POLL_INTERVAL, self._poll)
@@ -0,0 +1,56 @@
+"""
+History search
+Written by Joshua Kitchen - 2025
+"""
+import tkinter as tk
+import tkinter.ttk as ttk
+
+SEARCH_DELAY = 150 # Milliseconds after the last key press before searching
+MAX_RESULTS = 500
+
+
+class HistorySearch:
+    """Dialog window for searching the chat history of the room last connected to. Results update as you type."""
+    def __init__(self, parent, main_win, history):
+        self.parent = parent
+        self.parent.title("Search chat history")
+        self.parent.geometry("700x450")
+        self.main_win = main_win
+        self.history = history
+        self._scheduled = None
+
+        self.query_var = tk.StringVar()
+        self.query_box = tk.Entry(self.parent, textvariable=self.query_var, font=self.main_win.font)
+        self.result_count_var = tk.StringVar()
+        self.result_count_label = tk.Label(self.parent, textvariable=self.result_count_var, anchor=tk.W)
+        self.results_box = tk.Listbox(self.parent, font=self.main_win.font, activestyle=tk.NONE)
+        self.scrollbar = ttk.Scrollbar(self.results_box)
+        self.scrollbar.configure(command=self.results_box.yview)
+        self.results_box.configure(yscrollcommand=self.scrollbar.set)
+
+        self.query_box.pack(side=tk.TOP, fill=tk.X, padx=5, pady=(5, 0))
+        self.result_count_label.pack(side=tk.TOP, fill=tk.X, padx=5)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.results_box.pack(side=tk.TOP, expand=True, fill=tk.BOTH, padx=5, pady=(0, 5))
+
+        self.query_var.trace_add("write", self._schedule_search)
+        self.parent.bind("<Escape>", lambda *args: self.parent.destroy())
+        self.query_box.focus_set()
+
+    def _schedule_search(self, *args):
+        if self._scheduled is not None:
+            self.parent.after_cancel(self._scheduled)
+        self._scheduled = self.parent.after(SEARCH_DELAY, self.search)
+
+    def search(self):
+        self._scheduled = None
+        entries = self.history.search(self.query_var.get(), MAX_RESULTS)
+        self.results_box.delete(0, tk.END)
+        for entry in entries:
+            self.results_box.insert(tk.END, self.main_win.format_history_entry(entry))
+        if not self.query_var.get().strip():
+            self.result_count_var.set("")
+        elif len(entries) == MAX_RESULTS:
+            self.result_count_var.set(f"Showing the {MAX_RESULTS} most recent matches")
+        else:
+            self.result_count_var.set(f"{len(entries)} match{'' if len(entries) == 1 else 'es'}")
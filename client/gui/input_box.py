@@ -4,7 +4,6 @@ Written by Joshua Kitchen - 2024
 """
 import tkinter as tk
 
-from PIL import ImageTk, Image
 from client.gui.tooltip import CreateToolTip
 
 
@@ -14,6 +13,7 @@ class InputBox(tk.Frame):
         self.parent = parent
         self.max_char = 150
 
+        from PIL import ImageTk, Image # Imported with the window rather than with the module (see MainWin.__init__())
         self.picture_icon = ImageTk.PhotoImage(image=Image.open("client/icons/picture_streamline.png").resize((48, 48)))
         self.sound_icon = ImageTk.PhotoImage(image=Image.open("client/icons/sound_streamline.png").resize((48, 48)))
         self.send_icon = ImageTk.PhotoImage(image=Image.open("client/icons/send_streamline.png").resize((48, 48)))
@@ -40,6 +40,20 @@ class InputBox(tk.Frame):
 
         self.user_input.bind("<Return>", self.parent.send_msg)
 
+        # Shown above the input while files are being sent
+        self.upload_frame = tk.Frame(self, background=self.parent.widget_bg)
+        self.upload_status_var = tk.StringVar()
+        self.upload_label = tk.Label(self.upload_frame, textvariable=self.upload_status_var, anchor=tk.W,
+                                     background=self.parent.widget_bg, foreground=self.parent.widget_fg,
+                                     font=self.parent.font)
+        self.cancel_upload_button = tk.Button(self.upload_frame, text="Cancel", command=self.parent.cancel_upload,
+                                              background=self.parent.widget_bg, foreground=self.parent.widget_fg,
+                                              font=self.parent.font, relief=tk.FLAT)
+        self.cancel_upload_context = CreateToolTip(self.cancel_upload_button, "Cancel sending this file",
+                                                   self.parent.widget_bg)
+        self.cancel_upload_button.pack(side=tk.RIGHT, padx=(5, 5))
+        self.upload_label.pack(fill=tk.X, expand=True, side=tk.LEFT, padx=(5, 0))
+
     def _on_key_release(self, text):
         if len(text) == self.max_char + 1:
             return False
@@ -50,6 +64,17 @@ class InputBox(tk.Frame):
     def update_font(self):
         self.user_input.configure(font=(self.parent.font_family, self.parent.font_size))
         self.char_limit_label.configure(font=(self.parent.font_family, self.parent.font_size))
+        self.upload_label.configure(font=(self.parent.font_family, self.parent.font_size))
+        self.cancel_upload_button.configure(font=(self.parent.font_family, self.parent.font_size))
+
+    def show_upload_status(self, text):
+        self.upload_status_var.set(text)
+        if not self.upload_frame.winfo_manager():
+            self.upload_frame.pack(fill=tk.X, side=tk.TOP, before=self.send_button, padx=(self.parent.padx, 5),
+                                   pady=(0, 5))
+
+    def hide_upload_status(self):
+        self.upload_frame.pack_forget()
 
     def get_input(self):
         text = self.user_input.get()
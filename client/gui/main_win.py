@@ -3,41 +3,56 @@ Main window for the Pychat client
 Written by Joshua Kitchen - 2023
 """
 import tkinter as tk
-from tkinter import messagebox, filedialog, font as tkfont
-import random
+from tkinter import messagebox, filedialog
 import os
 import re
 import threading
 import socket
 import io
-from PIL import Image, ImageTk
+import zlib
+from datetime import datetime
 import logging
 
 import utils
 from .menu_bar import MenuBar
 from client.backend.pychat_backend import PychatClient
+from client.backend.send_queue import SENDING, CANCELLED, FAILED
 from client.backend.exceptions import UserIDTaken, ServerFull, UserIDTooLong
 from client.gui.notify_sound import NotificationSound
 from client.gui.chat_box import ChatBox
 from client.gui.input_box import InputBox
-from client.gui.mp3_player import MP3Player
+from client.startup_profile import StartupProfile
 
 logger = logging.getLogger(__name__)
 
+SCROLLBACK_PAGE_SIZE = 50 # Messages loaded from the chat history each time the chat box is scrolled to the top
+# Members are coloured by a hash of their username (see member_color()), so colours can be added here freely and any
+# number of members can share a room
+MEMBER_COLORS = [
+    '#9A6324', '#B8860B', '#808000', '#A52A2A', '#00FF7F', '#40E0D0', '#FFD700', '#C71585', '#FABEBE',
+    '#DA70D6', '#46F0F0', '#7B68EE', '#00BFFF', '#4B0082', '#D2B48C', '#4363D8', '#FF7F50', '#FFB6C1',
+    '#FF1493', '#9400D3', '#CD5C5C', '#4682B4', '#F58231', '#800080', '#00FF00', '#3CB44B', '#00FFFF',
+    '#DAA520', '#228B22', '#8A2BE2', '#0000FF', '#8B0000', '#FFD8B1', '#BCF60C', '#8B008B', '#D2691E',
+    '#808080', '#48D1CC', '#FF00FF', '#FFA500', '#ADFF2F', '#FF69B4', '#000080', '#FF6347', '#000075',
+    '#BA55D3', '#6A5ACD', '#00FA9A', '#20B2AA', '#191970', '#E6BEFF', '#008000', '#2E8B57', '#FF8C00',
+    '#FFDEAD', '#800000', '#7FFF00', '#911EB4', '#00CED1', '#008080', '#7CFC00', '#556B2F', '#F032E6',
+    '#1E90FF', '#DC143C', '#9ACD32'
+]
+PRESENCE_NAMES_SHOWN = 5 # Members named in a line about a batch of joins or leaves, before "and N others"
+
 class MainWin(tk.Tk):
-    def __init__(self, connection_info=None):
+    def __init__(self, connection_info=None, trace=False, socket_options=None, history=True, startup_profile=None):
+        """
+        Startup is kept short, since the client is opened and closed often: sounds are only loaded when played, fonts
+        are only listed once the font chooser is opened, and modules that are slow to import (just_playback, zipfile)
+        are imported when first needed. Pillow is only imported here for the input box's icons, and is timed as a phase
+        of its own. Each phase is marked on `startup_profile` (see startup_profile.py).
+        """
+        profile = startup_profile if startup_profile is not None else StartupProfile()
         tk.Tk.__init__(self)
-        self.client = PychatClient(self, None)
-        self.available_colors = [
-            '#9A6324', '#B8860B', '#808000', '#A52A2A', '#00FF7F', '#40E0D0', '#FFD700', '#C71585', '#FABEBE',
-            '#DA70D6', '#46F0F0', '#7B68EE', '#00BFFF', '#4B0082', '#D2B48C', '#4363D8', '#FF7F50', '#FFB6C1',
-            '#FF1493', '#9400D3', '#CD5C5C', '#4682B4', '#F58231', '#800080', '#00FF00', '#3CB44B', '#00FFFF',
-            '#DAA520', '#228B22', '#8A2BE2', '#0000FF', '#8B0000', '#FFD8B1', '#BCF60C', '#8B008B', '#D2691E',
-            '#808080', '#48D1CC', '#FF00FF', '#FFA500', '#ADFF2F', '#FF69B4', '#000080', '#FF6347', '#000075',
-            '#BA55D3', '#6A5ACD', '#00FA9A', '#20B2AA', '#191970', '#E6BEFF', '#008000', '#2E8B57', '#FF8C00',
-            '#FFDEAD', '#800000', '#7FFF00', '#911EB4', '#00CED1', '#008080', '#7CFC00', '#556B2F', '#F032E6',
-            '#1E90FF', '#DC143C', '#9ACD32'
-        ]
+        profile.mark("Tk")
+        self.history_dir = "Pychat History"
+        self.client = PychatClient(self, None, trace, socket_options, self.history_dir if history else None)
 
         self.notification_sounds = [
             NotificationSound('', None),
@@ -50,16 +65,21 @@ class MainWin(tk.Tk):
         self.multimedia_save_dir = "Pychat Media"
         if not os.path.exists(self.multimedia_save_dir):
             os.mkdir(self.multimedia_save_dir)
-        self.room_members = []
-        self.member_colors = {}
+        self.room_members = set()
+        self.member_colors = {} # Username -> colour, of everyone shown in the chat box so far (see member_color())
         self.images = [] # place received images here to avoid garbage collection
+        self.pending_media = {} # SHA-256 hex digest of a requested file -> callback taking (filename, data)
+        self.saved_media = [] # (filename, path) of every file saved this session, for archives without a history
         self.widget_bg = '#ffffff'
         self.widget_fg = '#000000'
         self.app_bg = "#001a4d"
         self.font_family = 'Arial'
         self.font_size = 12
         self.read_config()
+        profile.mark("config")
         self.font = (self.font_family, self.font_size)
+        import PIL.ImageTk # Not needed until the input box loads its icons, which is most of the cost left (see InputBox)
+        profile.mark("Pillow")
         self.padx = 8
         self.pady = 8
         self.notification_sound = self.notification_sounds[0]
@@ -77,6 +97,7 @@ class MainWin(tk.Tk):
         self.input_frame.pack_widgets()
         self.chat_box_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(self.padx, 0), pady=self.pady)
         self.chat_box_frame.pack_widgets()
+        profile.mark("widgets")
         self.bind("<Control-Delete>", self.chat_box_frame.clear_chat_box)
         self.bind("<Control_L>s", self.menubar.archive_chat)
         self.bind("<Control_L>c", self.menubar.copy)
@@ -84,6 +105,7 @@ class MainWin(tk.Tk):
         self.bind("<Control-Down>", self.decrease_font_size)
         self.bind("<Control_L>n", self.menubar.connect_to_room)
         self.bind("<Control-End>", self.menubar.disconnect_from_room)
+        self.bind("<Control_L>f", self.menubar.search_history)
         if os.name == 'posix':
             self.chat_box_frame.bind_all("<Button-4>", self.on_mousewheel_linux)
             self.chat_box_frame.bind_all("<Button-5>", self.on_mousewheel_linux)
@@ -95,6 +117,7 @@ class MainWin(tk.Tk):
         if connection_info is not None:
             threading.Thread(target=self.connect, daemon=True,
                              args=[connection_info[0], connection_info[1], connection_info[2]]).start()
+        profile.mark("bindings")
 
     def on_mousewheel_windows(self, event):
         self.chat_box_frame.chat_box.yview("scroll", int(-1*(event.delta/120)), "units")
@@ -135,8 +158,8 @@ class MainWin(tk.Tk):
             pattern = re.compile(r"^#([A-Fa-f0-9]{6}|[A-Fa-f0-9]{3})$")
             if not re.match(pattern, self.app_bg):
                 self.app_bg = "#001a4d"
-            if self.font_family not in tkfont.families():
-                self.font_family = 'Arial'
+            # A font family that isn't installed isn't checked for here, since listing them all is slow. Tk uses the
+            # closest one it has instead.
         else:
             self.write_config()
 
@@ -164,13 +187,49 @@ class MainWin(tk.Tk):
         data = data.split(',')
         data.append(self.client.username)
         for user_id in data:
-            if user_id == '':
-                continue
-            if user_id not in self.room_members:
-                self.room_members.append(user_id)
-                color = random.choice(self.available_colors)
-                self.available_colors.remove(color)
-                self.member_colors.update({user_id: color})
+            self.add_member(user_id)
+
+    def add_member(self, user_id):
+        if user_id == '':
+            return
+        self.room_members.add(user_id)
+
+    def remove_member(self, user_id):
+        self.room_members.discard(user_id)
+
+    def member_color(self, user_id):
+        """
+        Returns the colour `user_id` is shown in, which is also the name of its chat box tag. It depends only on the
+        username, so a member keeps their colour across sessions and senders in the history are coloured the same way.
+        CRC-32 rather than hash(), which is salted differently in every process.
+        """
+        color = self.member_colors.get(user_id)
+        if color is None:
+            color = MEMBER_COLORS[zlib.crc32(user_id.encode()) % len(MEMBER_COLORS)]
+            self.member_colors[user_id] = color
+            self.chat_box_frame.add_color_tag(color)
+        return color
+
+    @staticmethod
+    def describe_presence(joined, left):
+        """
+        Returns the line shown for a batch of joins and leaves (see presence.py). `joined` and `left` are either lists
+        of usernames or, from a PRESENCE_SUMMARY, numbers of members.
+        """
+        def names(user_ids):
+            if len(user_ids) > PRESENCE_NAMES_SHOWN:
+                return f"{', '.join(user_ids[:PRESENCE_NAMES_SHOWN])} and {len(user_ids) - PRESENCE_NAMES_SHOWN} others"
+            if len(user_ids) > 1:
+                return f"{', '.join(user_ids[:-1])} and {user_ids[-1]}"
+            return user_ids[0]
+
+        if isinstance(joined, int):
+            parts = [f"{count} {action}" for count, action in ((joined, "joined"), (left, "left")) if count]
+            return f"-- {', '.join(parts)} --"
+        parts = [f"{names(user_ids)} {action}" for user_ids, action in ((joined, "joined"), (left, "left")) if user_ids]
+        if len(parts) == 1:
+            return f"-- {parts[0]} the server --"
+        return f"-- {', '.join(parts)} --"
 
     def increase_font_size(self, *args):
         if self.font_size == 20:
@@ -239,9 +298,73 @@ class MainWin(tk.Tk):
         self.title(f"Connected to {host} at port {port} | Username: {user_id}")
         self.chat_box_frame.write_to_chat_box(f"-- Connected to {host} at port {port} | Username: {user_id} --",
                                               tags=["Center"])
+        self.start_scrollback()
         threading.Thread(target=self.client.msg_loop, daemon=True).start()
         self.input_frame.user_input.configure(state=tk.NORMAL)
 
+    def start_scrollback(self):
+        """
+        Loads the room's history into the top of the chat box, a page at a time as it is scrolled up
+        """
+        history = self.client.history
+        if history is None:
+            return
+        oldest = history.session_start
+
+        def load_older():
+            nonlocal oldest
+            entries = history.page(oldest, SCROLLBACK_PAGE_SIZE)
+            if entries:
+                oldest = entries[0].id
+            return [self.format_history_entry(entry) for entry in entries]
+
+        self.chat_box_frame.start_scrollback(load_older)
+
+    def format_history_entry(self, entry):
+        """
+        Returns the text of a message from the chat history (a history.HistoryEntry), with the time it was received
+        """
+        when = datetime.fromtimestamp(entry.time).strftime("%Y-%m-%d %H:%M")
+        sender = entry.sender
+        if entry.recipients:
+            sender = f"{sender} -> {', '.join(entry.recipients)}"
+        if entry.flags & 2:
+            return f"[{when}] {sender}: {entry.body} ({entry.size / 1024:.0f} KB)"
+        if entry.flags & 4:
+            kind, _, detail = entry.body.partition(':')
+            if kind == "JOINED":
+                return f"[{when}] -- {detail} joined the server --"
+            if kind == "LEFT":
+                return f"[{when}] -- {detail} left the server --"
+            if kind == "PRESENCE":
+                return f"[{when}] {self.describe_presence(*utils.decode_presence(detail))}"
+            if kind == "PRESENCE_SUMMARY":
+                num_joined, _, num_left = detail.partition(':')
+                return f"[{when}] {self.describe_presence(int(num_joined), int(num_left))}"
+            return f"[{when}] SERVER MESSAGE: {detail}"
+        return f"[{when}] {sender}: {entry.body}"
+
+    def create_archive_export(self, path):
+        """
+        Returns an ArchiveExport (see archive.py) of the chat history of the room last connected to, or of what's in
+        the chat box if there is no history
+        """
+        from client.backend.archive import ArchiveExport # Imported when needed, since zipfile is slow to import
+
+        history = self.client.history
+        if history is not None:
+            history.commit()
+
+            def records(): # Consumed by the export thread, so this must not touch Tk
+                for entry in history.iter_messages():
+                    media_path = self.media_path(entry.body, entry.digest) if entry.digest else None
+                    yield self.format_history_entry(entry), media_path
+
+            return ArchiveExport(path, records(), history.count())
+        records = [(line, None) for line in self.chat_box_frame.get_chat_contents().splitlines()]
+        records.extend((f"Attached: {filename}", media_path) for filename, media_path in self.saved_media)
+        return ArchiveExport(path, records, len(records))
+
     def handle_error(self, err_msg):
         self.disconnect()
         self.reset_gui()
@@ -258,7 +381,16 @@ class MainWin(tk.Tk):
         if not self.client.is_connected():
             return
         text = self.input_frame.get_input()
-        result = self.client.send_chat_msg(bytes(text, encoding='utf-8'), 1)
+        recipients = None
+        if text.startswith("/msg "): # Direct message: /msg <user>[,<user>...] <message>
+            try:
+                _, recipients, text = text.split(' ', 2)
+            except ValueError:
+                self.chat_box_frame.write_to_chat_box("-- Usage: /msg <user>[,<user>...] <message> --",
+                                                      tags=["Center"])
+                return
+            recipients = [recipient for recipient in recipients.split(',') if recipient]
+        result = self.client.send_chat_msg(bytes(text, encoding='utf-8'), 1, recipients)
         if not result:
             messagebox.showerror(title="Error", message=f"Host closed connection")
             self.disconnect()
@@ -285,10 +417,11 @@ class MainWin(tk.Tk):
             return
 
         filename = os.path.split(path)[-1]
-        result = self.client.send_multimedia_msg(filename, data)
-        if not result:
+        if self.client.send_multimedia_msg(filename, data) is None:
             messagebox.showerror(title="Error", message=f"Host closed connection")
             self.disconnect()
+            return
+        self.update_upload_status()
 
     def send_image_msg(self, *args):
         if not self.client.is_connected():
@@ -298,6 +431,7 @@ class MainWin(tk.Tk):
         if path == () or path == '':
             return
 
+        from PIL import Image
         try:
             img = Image.open(path)
         except FileNotFoundError:
@@ -314,39 +448,176 @@ class MainWin(tk.Tk):
         data = io.BytesIO()
         img.thumbnail((600, 400))
         utils.save_image(img, filename, data)
-        result = self.client.send_multimedia_msg(filename, data.getvalue())
-        if not result:
+        if self.client.send_multimedia_msg(filename, data.getvalue()) is None:
             messagebox.showerror(title="Error", message=f"Host closed connection")
             self.disconnect()
+            return
+        self.update_upload_status()
+
+    def update_upload_status(self):
+        """
+        Shows the progress of the file being sent, if any, above the input box
+        """
+        uploads = self.client.pending_uploads()
+        if not uploads:
+            self.input_frame.hide_upload_status()
+            return
+        upload = uploads[0]
+        text = f"Sending {upload.filename}: {upload.progress:.0%} ({upload.sent / 1_048_576:.1f} of " \
+               f"{upload.size / 1_048_576:.1f} MB)"
+        if len(uploads) > 1:
+            text += f" | {len(uploads) - 1} more waiting"
+        self.input_frame.show_upload_status(text)
+
+    def show_upload_progress(self, upload):
+        self.update_upload_status()
+
+    def upload_finished(self, upload):
+        if upload.status == CANCELLED:
+            self.chat_box_frame.write_to_chat_box(f"-- Cancelled sending {upload.filename} --", tags=["Center"])
+        elif upload.status == FAILED:
+            self.chat_box_frame.write_to_chat_box(f"-- Could not send {upload.filename} --", tags=["Center"])
+        self.update_upload_status()
+
+    def cancel_upload(self, *args):
+        uploads = self.client.pending_uploads()
+        if not uploads:
+            return
+        upload = uploads[0]
+        if upload.status == SENDING:
+            answer = messagebox.askyesno('Disconnect?', f'{upload.filename} is already being sent, so cancelling it '
+                                                        f'will disconnect you from the chatroom. Cancel it anyway?')
+            if not answer:
+                return
+        self.client.cancel_upload(upload)
 
     def process_msg(self, sender, msg):
         if sender == "SERVER":
             self.chat_box_frame.write_to_chat_box("SERVER MSG", "red", newline=False)
         else:
-            self.chat_box_frame.write_to_chat_box(f"{sender}", tags=[self.member_colors[sender]], newline=False)
+            self.chat_box_frame.write_to_chat_box(f"{sender}", tags=[self.member_color(sender)], newline=False)
         self.chat_box_frame.write_to_chat_box(f": {msg}")
         if sender != self.client.username:
             self.play_notification_sound()
 
-    def process_multimedia_msg(self, sender, data):
-        filename_len = int.from_bytes(data[0:4], byteorder='big')
-        filename = str(data[4: filename_len + 4], 'utf-8')
+    def process_direct_msg(self, sender, recipients, msg):
+        self.chat_box_frame.write_to_chat_box(f"{sender} -> {', '.join(recipients)}",
+                                              tags=[self.member_color(sender)], newline=False)
+        self.chat_box_frame.write_to_chat_box(f": {msg}", tags=["directMsg"])
+        if sender != self.client.username:
+            self.play_notification_sound()
+
+    def process_multimedia_msg(self, sender, filename, data, digest):
+        callback = self.pending_media.pop(digest, None) # Check if this is a file we asked the server for
+        if callback is not None:
+            callback(filename, data)
+            return
         ext = filename.split('.')[-1]
         if ext.lower() == "mp3":
-            self.show_sound_msg(sender, data[filename_len + 4:], filename)
+            self.show_sound_msg(sender, data, filename, digest)
         elif ext.lower() in ["jpg", "jpeg", "png", "gif"]:
-            self.show_image_msg(sender, data[filename_len + 4:], filename)
+            self.show_image_msg(sender, data, filename, digest)
 
-    def show_sound_msg(self, sender, data, filename):
-        player = MP3Player(self.font)
+    def process_media_announcement(self, sender, filename, size, digest, thumbnail):
+        ext = filename.split('.')[-1]
+        if ext.lower() == "mp3":
+            self.show_sound_announcement(sender, filename, digest)
+        elif ext.lower() in ["jpg", "jpeg", "png", "gif"]:
+            self.show_image_announcement(sender, filename, size, digest, thumbnail)
+
+    def request_media(self, filename, digest, callback):
+        """
+        Downloads an announced file from the server. `callback` is called with the filename and data once it arrives.
+        A file that was saved before is loaded from disk instead.
+        """
         try:
-            with open(os.path.join("Pychat Media", filename), 'wb') as file:
+            with open(self.media_path(filename, digest), 'rb') as file:
+                data = file.read()
+        except OSError:
+            pass
+        else:
+            callback(filename, data)
+            return
+        if not self.client.is_connected():
+            return
+        already_requested = digest in self.pending_media
+        self.pending_media[digest] = callback
+        if not already_requested:
+            self.client.fetch_media(digest)
+
+    def media_path(self, filename, digest):
+        """
+        Files are saved under their SHA-256 hex digest, which is how the chat history refers to them, and keep their
+        extension so they can still be opened
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        return os.path.join(self.multimedia_save_dir, f"{digest}{ext}")
+
+    def save_media(self, filename, data, digest):
+        path = self.media_path(filename, digest)
+        if not os.path.exists(path): # Anything already saved under this digest is the same file
+            with open(path, 'wb') as file:
                 file.write(data)
-            player.load(os.path.join("Pychat Media", filename))
+        self.saved_media.append((filename, path))
+        return path
+
+    def show_sound_announcement(self, sender, filename, digest):
+        from client.gui.mp3_player import MP3Player # Imported when needed, since just_playback is slow to import
+        player = MP3Player(self.font)
+
+        def on_loaded(name, data):
+            try:
+                player.load(self.save_media(name, data, digest), name)
+            except (FileNotFoundError, PermissionError, OSError):
+                player.filename.set(f"Could not load {name}")
+
+        player.load_lazy(filename, lambda: self.request_media(filename, digest, on_loaded))
+        self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_color(sender), newline=True)
+        self.chat_box_frame.chat_box.window_create(tk.END, window=player)
+        self.chat_box_frame.write_to_chat_box("\n")
+
+    def show_image_announcement(self, sender, filename, size, digest, thumbnail):
+        from PIL import Image, ImageTk
+        try:
+            if not thumbnail:
+                raise OSError()
+            image = ImageTk.PhotoImage(Image.open(io.BytesIO(thumbnail)))
+        except OSError:
+            image = ImageTk.PhotoImage(Image.open("client/icons/picture_streamline.png").resize((48, 48)))
+        self.images.append(image) # Prevents the image from being garbage collected
+        label = tk.Label(self.chat_box_frame.chat_box, image=image, compound=tk.TOP, cursor="hand2",
+                         text=f"{filename} ({size / 1024:.0f} KB) - click to load")
+
+        def on_loaded(name, data):
+            try:
+                full_image = ImageTk.PhotoImage(Image.open(self.save_media(name, data, digest)))
+            except (FileNotFoundError, PermissionError, OSError):
+                full_image = ImageTk.PhotoImage(
+                    Image.open(r"client\icons\broken_image_streamline.png").resize((48, 48)))
+            self.images.append(full_image)
+            label.configure(image=full_image, text=name, cursor="")
+
+        def on_click(*args):
+            label.unbind("<Button-1>")
+            label.configure(text=f"{filename} - loading...")
+            self.request_media(filename, digest, on_loaded)
+
+        label.bind("<Button-1>", on_click)
+        self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_color(sender), newline=False)
+        self.chat_box_frame.write_to_chat_box(f"{filename}")
+        self.chat_box_frame.chat_box.window_create(tk.END, window=label)
+        self.chat_box_frame.write_to_chat_box("\n")
+
+    def show_sound_msg(self, sender, data, filename, digest):
+        from client.gui.mp3_player import MP3Player
+        from PIL import Image, ImageTk
+        player = MP3Player(self.font)
+        try:
+            player.load(self.save_media(filename, data, digest), filename)
         except (FileNotFoundError, PermissionError, OSError):
             image = ImageTk.PhotoImage(Image.open(r"client\icons\broken_image_streamline.png").resize((48, 48)))
             self.images.append(image)  # Prevents the image from being garbage collected
-            self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_colors[sender], newline=False)
+            self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_color(sender), newline=False)
             self.chat_box_frame.write_to_chat_box(f"{filename}")
             self.chat_box_frame.chat_box.window_create(tk.END,
                                                        window=tk.Label(self.chat_box_frame.chat_box, image=image,
@@ -356,20 +627,18 @@ class MainWin(tk.Tk):
 
 
 
-        self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_colors[sender], newline=True)
+        self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_color(sender), newline=True)
         self.chat_box_frame.chat_box.window_create(tk.END, window=player)
         self.chat_box_frame.write_to_chat_box("\n")
 
-    def show_image_msg(self, sender, data, filename):
+    def show_image_msg(self, sender, data, filename, digest):
+        from PIL import Image, ImageTk
         try:
-            with open(os.path.join("Pychat Media", filename), 'wb') as file:
-                file.write(data)
-                file.seek(0)
-            image = ImageTk.PhotoImage(Image.open(os.path.join("Pychat Media", filename)))
+            image = ImageTk.PhotoImage(Image.open(self.save_media(filename, data, digest)))
         except (FileNotFoundError, PermissionError, OSError):
             image = ImageTk.PhotoImage(Image.open(r"client\icons\broken_image_streamline.png").resize((48, 48)))
         self.images.append(image) # Prevents the image from being garbage collected
-        self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_colors[sender], newline=False)
+        self.chat_box_frame.write_to_chat_box(f"{sender}: ", self.member_color(sender), newline=False)
         self.chat_box_frame.write_to_chat_box(f"{filename}")
         self.chat_box_frame.chat_box.window_create(tk.END, window = tk.Label(self.chat_box_frame.chat_box, image=image, text=filename))
         self.chat_box_frame.write_to_chat_box("\n")
@@ -380,25 +649,27 @@ class MainWin(tk.Tk):
         data = msg.split(':')
         if data[0] == 'JOINED':
             self.chat_box_frame.write_to_chat_box(f"-- {data[1]} joined the server --", tags=["Center"])
-            if data[1] not in self.room_members:
-                self.room_members.append(data[1])
-                color = random.choice(self.available_colors)
-                self.available_colors.remove(color)
-                self.member_colors.update({data[1]: color})
+            self.add_member(data[1])
         elif data[0] == 'LEFT':
             self.chat_box_frame.write_to_chat_box(f"-- {data[1]} left the server --", tags=["Center"])
-            if data[1] in self.room_members:
-                self.room_members.remove(data[1])
-                color = self.member_colors[data[1]]
-                del self.member_colors[data[1]]
-                self.available_colors.append(color)
+            self.remove_member(data[1])
+        elif data[0] == 'PRESENCE':
+            joined, left = utils.decode_presence(msg[9:])
+            # Changes can repeat what MEMBERS or an earlier batch already said (see presence.py)
+            joined = [user_id for user_id in joined if user_id and user_id not in self.room_members]
+            left = [user_id for user_id in left if user_id in self.room_members]
+            if not joined and not left:
+                return
+            for user_id in joined:
+                self.add_member(user_id)
+            for user_id in left:
+                self.remove_member(user_id)
+            self.chat_box_frame.write_to_chat_box(self.describe_presence(joined, left), tags=["Center"])
+        elif data[0] == 'PRESENCE_SUMMARY':
+            self.chat_box_frame.write_to_chat_box(self.describe_presence(int(data[1]), int(data[2])), tags=["Center"])
         elif data[0] == 'MEMBERS':
             for user_id in data[1].split(','):
-                if user_id not in self.room_members:
-                    self.room_members.append(user_id)
-                    color = random.choice(self.available_colors)
-                    self.available_colors.remove(color)
-                    self.member_colors.update({user_id: color})
+                self.add_member(user_id)
         elif data[0] == "KICKED":
             self.chat_box_frame.write_to_chat_box(f"-- You were kicked from the chat room --", tags=["Center"])
             self.client.disconnect()
@@ -6,13 +6,11 @@ Written by Joshua Kitchen - 2023
 import tkinter as tk
 from tkinter import filedialog, colorchooser, messagebox, font as tkfont
 from datetime import datetime
-import os
-from PIL import ImageTk
 
-import utils
 from client.gui.connect_dialog import ConnectDialog
 from client.gui.font_chooser import FontChooser
 from client.gui.about_dialog import AboutDialog
+from client.gui.history_search import HistorySearch
 
 
 class MenuBar(tk.Menu):
@@ -23,6 +21,8 @@ class MenuBar(tk.Menu):
         self.FONT_CHOOSE_WIN = None
         self.CONNECT_WIN = None
         self.ABOUT_WIN = None
+        self.SEARCH_WIN = None
+        self.EXPORT_WIN = None
         self.file_menu = tk.Menu(self.parent, tearoff=0)
         self.edit_menu = tk.Menu(self.parent, tearoff=0)
         self.connect_menu = tk.Menu(self.parent, tearoff=0)
@@ -32,6 +32,7 @@ class MenuBar(tk.Menu):
 
         self.file_menu.add_command(label="Clear chat", command=self.parent.chat_box_frame.clear_chat_box, accelerator="Ctrl+Del")
         self.file_menu.add_command(label="Archive chat", command=self.archive_chat, accelerator="Ctrl+S")
+        self.file_menu.add_command(label="Search history", command=self.search_history, accelerator="Ctrl+F")
         self.edit_menu.add_command(label="Copy", command=self.copy, accelerator="Ctrl+C")
         self.edit_menu.add_command(label="Cut", command=lambda: self.parent.user_input.event_generate('<<Cut>>'),
                                    accelerator="Ctrl+X")
@@ -76,15 +77,34 @@ class MenuBar(tk.Menu):
         self.parent.play_notification_sound()
 
     def archive_chat(self, *args):
-        chat_text = self.parent.chat_box_frame.get_chat_contents()
-        chosen_filepath = filedialog.askdirectory()
-        if chosen_filepath == () or chosen_filepath == '':
+        if isinstance(self.EXPORT_WIN, tk.Toplevel) and self.EXPORT_WIN.winfo_exists(): # One export at a time
+            self.EXPORT_WIN.focus_set()
             return
         date = datetime.now()
-        with open(os.path.join(chosen_filepath, f"text_log_{date.strftime('%d-%m-%y--%I-%M-%S-%p')}.txt"), 'a+') as file:
-            file.write(chat_text)
-        for filename, pic in self.parent.images:
-            utils.save_image(ImageTk.getimage(pic), filename, chosen_filepath)
+        chosen_filepath = filedialog.asksaveasfilename(
+            defaultextension=".zip", filetypes=[("Zip archive", "*.zip")],
+            initialfile=f"chat_archive_{date.strftime('%d-%m-%y--%I-%M-%S-%p')}.zip")
+        if chosen_filepath == () or chosen_filepath == '':
+            return
+        from client.gui.export_dialog import ExportDialog # Imported when needed, like the export itself
+        export = self.parent.create_archive_export(chosen_filepath)
+        export.start()
+
+        self.EXPORT_WIN = tk.Toplevel()
+        ExportDialog(self.EXPORT_WIN, self.parent, export)
+        self.EXPORT_WIN.focus_set()
+
+    def search_history(self, *args):
+        history = self.parent.client.history
+        if history is None:
+            messagebox.showinfo(title="Search history", message="Connect to a chatroom to search its history")
+            return
+        if isinstance(self.SEARCH_WIN, tk.Toplevel):
+            self.SEARCH_WIN.destroy()
+
+        self.SEARCH_WIN = tk.Toplevel()
+        HistorySearch(self.SEARCH_WIN, self.parent, history)
+        self.SEARCH_WIN.focus_set()
 
     def copy(self, *args):
         widget = self.parent.focus_get()
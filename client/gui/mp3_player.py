@@ -25,6 +25,8 @@ class MP3Player(tk.Frame):
         self.filename.set("")
         self.controls_disabled = True
         self.playhead_update_interval = 500 # in milliseconds
+        self._fetch = None # Set by load_lazy()
+        self._play_when_loaded = False
 
         self.rewind_icon = ImageTk.PhotoImage(image=Image.open("client/icons/rewind_bootstrap.png").resize(self.icon_size))
         self.stop_icon = ImageTk.PhotoImage(image=Image.open("client/icons/stop_bootstrap.png").resize(self.icon_size))
@@ -105,14 +107,30 @@ class MP3Player(tk.Frame):
         val = self.playhead.get()
         self.playback_obj.seek(val)
 
-    def load(self, filepath):
+    def load(self, filepath, name=None):
+        """
+        `name` is shown instead of the file's name, if given
+        """
         if not os.path.exists(filepath):
             raise FileNotFoundError(f"Could not load {filepath}")
         self.playback_obj.load_file(filepath)
-        self.filename.set(os.path.split(filepath)[-1])
+        self.filename.set(name or os.path.split(filepath)[-1])
         self.total_time.set(self._parse_time(self.playback_obj.duration))
         self.playhead.configure(from_=0, to=self.playback_obj.duration)
-        self._toggle_controls()
+        if self.controls_disabled:
+            self._toggle_controls()
+        if self._play_when_loaded:
+            self._play_when_loaded = False
+            self.play()
+
+    def load_lazy(self, filename, fetch):
+        """
+        Shows the player without loading a file. When play is pressed, `fetch` is called, and it should eventually
+        call load() with the path to the file. Playback starts as soon as the file is loaded.
+        """
+        self._fetch = fetch
+        self.filename.set(filename)
+        self.play_butt.configure(state=tk.NORMAL)
 
     def reset_state(self):
         if self.controls_disabled:
@@ -126,6 +144,13 @@ class MP3Player(tk.Frame):
         self._toggle_controls()
 
     def play(self):
+        if self._fetch is not None: # The file hasn't been downloaded yet
+            fetch, self._fetch = self._fetch, None
+            self._play_when_loaded = True
+            self.play_butt.configure(state=tk.DISABLED)
+            self.filename.set(f"{self.filename.get()} - loading...")
+            fetch()
+            return
         if self.playback_obj.active:
             self.playback_obj.resume()
         else:
@@ -1,10 +1,20 @@
-from just_playback import Playback
-
-class NotificationSound(Playback):
+class NotificationSound:
+    """
+    A notification sound. The file isn't loaded, and just_playback isn't even imported, until the sound is first
+    played, since most of them never are and the client should start quickly.
+    """
     def __init__(self, path_to_file, name):
-        Playback.__init__(self, path_to_file)
         self.filepath = path_to_file
         if name is None:
             self.name = 'None'
         else:
-            self.name = name
\ No newline at end of file
+            self.name = name
+        self._playback = None
+
+    def play(self):
+        if not self.filepath:
+            return
+        if self._playback is None:
+            from just_playback import Playback
+            self._playback = Playback(self.filepath)
+        self._playback.play()
@@ -0,0 +1,30 @@
+"""
+Startup profile (for pychat)
+Written by Joshua Kitchen - 2025
+
+Times the phases of starting the client, for --profile-startup. Phases are marked as they end, and each one is timed
+from the end of the one before it.
+"""
+
+import time
+
+
+class StartupProfile:
+    def __init__(self, start=None):
+        """
+        `start` is the time.perf_counter() value that the first phase started at (now if None)
+        """
+        self._start = time.perf_counter() if start is None else start
+        self._last = self._start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        width = max((len(phase) for phase, _ in self.phases), default=0)
+        lines = [f"{phase:<{width}}  {seconds * 1000:8.1f} ms" for phase, seconds in self.phases]
+        lines.append(f"{'total':<{width}}  {(self._last - self._start) * 1000:8.1f} ms")
+        return '\n'.join(lines)
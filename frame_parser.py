@@ -0,0 +1,349 @@
+"""
+Frame parser (for pychat)
+Written by Joshua Kitchen - 2025
+
+An incremental parser for the pychat protocol that does no I/O of its own. Bytes are passed to feed() as they arrive,
+in chunks of any size, and it returns a list of the events those bytes completed. The server, the client, and the load
+tester all read from their sockets with this parser.
+
+Every message is sent as a TCPLib frame, a 4 byte size header followed by the payload:
+[frame_size (4 bytes)][payload]
+
+During the handshake the payload is raw (a username or the server's response), so the parser starts in raw mode if
+raw=True and the caller switches it off once the handshake is done. Afterwards every payload is a pychat message (see
+TCP_server.py for the layout).
+
+The frame size is checked against `max_frame_size` before any of the payload is buffered, and the pychat header is
+checked against the frame size, so a peer cannot make the parser allocate more than `max_frame_size` bytes. Messages
+can also be limited by type (`size_limits`), which is checked as soon as the 9 byte header has arrived. A parser with
+size limits only accepts the types it has a limit for, so a peer can't get past them with flags that name no type, more
+than one type, or a type only the other side may send (e.g. a client sending a media announcement).
+
+EVENTS
+    RawFrame        - A whole frame (raw mode)
+    ChatMessage     - A whole pychat message
+    MessageStart    - The header of a pychat message (streaming mode)
+    MessageData     - Part of a message's data, in the order it arrived (streaming mode)
+    MessageEnd      - The end of a message's data (streaming mode)
+    MessageRejected - A message over its size limit, which was skipped
+
+In streaming mode the data of a message is never buffered, which lets large files be written out as they arrive.
+
+Given a BufferPool (see buffer_pool.py), large payloads are collected into pooled buffers, and a ChatMessage's payload
+is a memoryview of the part of the buffer it fills. The caller gives the buffer back once it is done with the message.
+Bytes passed to feed() are never kept, so the caller can read into the same buffer every time.
+"""
+
+DEFAULT_MAX_FRAME_SIZE = 67_108_864 # 64 MiB
+
+MODIFIER_FLAGS = 16 | 128 # Direct and trace, which can be combined with the other flags
+DIRECT_TYPES = (1, 2) # Types the direct flag can be combined with
+
+_SIZE = 0
+_HEADER = 1
+_PAYLOAD = 2
+_USERNAME = 3
+_DATA = 4
+_SKIP = 5
+
+
+class ProtocolError(Exception):
+    """
+    Raised when a peer sends something that is not valid pychat protocol. The connection cannot be recovered.
+    """
+    pass
+
+
+class FrameTooLarge(ProtocolError):
+    def __init__(self, size, max_size):
+        self.size = size
+        self.max_size = max_size
+        ProtocolError.__init__(self, f"Frame of {size} bytes is larger than the limit of {max_size} bytes")
+
+
+class RawFrame:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class ChatMessage:
+    """
+    `payload` is the whole message as it was sent, header included, so it can be relayed without being re-encoded.
+    It is a bytearray, or a memoryview if it was received into a pooled buffer. `data` is a memoryview of the data
+    inside it.
+    """
+    __slots__ = ("username", "flags", "data", "payload")
+
+    def __init__(self, username, flags, data, payload):
+        self.username = username
+        self.flags = flags
+        self.data = data
+        self.payload = payload
+
+
+class MessageStart:
+    __slots__ = ("username", "flags", "data_size")
+
+    def __init__(self, username, flags, data_size):
+        self.username = username
+        self.flags = flags
+        self.data_size = data_size
+
+
+class MessageData:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class MessageEnd:
+    __slots__ = ()
+
+
+class MessageRejected:
+    """
+    A message whose data was over the size limit for its type. The rest of the message is skipped.
+    """
+    __slots__ = ("flags", "data_size", "limit")
+
+    def __init__(self, flags, data_size, limit):
+        self.flags = flags
+        self.data_size = data_size
+        self.limit = limit
+
+
+def _decode_username(data):
+    try:
+        return str(data, 'utf-8')
+    except UnicodeDecodeError:
+        raise ProtocolError("Username is not valid UTF-8")
+
+
+class FrameParser:
+    """
+    `size_limits` maps a message type (the flags without the direct and trace flags) to the largest data size allowed
+    for it. A message over its limit is skipped without being buffered and a MessageRejected event is returned in its
+    place. If `size_limits` is given, a message of any other type (or one with the direct flag on a type that can't be
+    direct) raises ProtocolError, as does a frame over `max_frame_size`. Payloads of chat messages are received into
+    buffers from `pool` (a BufferPool) if one is given.
+    """
+    def __init__(self, max_frame_size=DEFAULT_MAX_FRAME_SIZE, raw=False, stream=False, size_limits=None, pool=None):
+        self.max_frame_size = max_frame_size
+        self.raw = raw
+        self.stream = stream
+        self.size_limits = size_limits or {}
+        self.pool = pool
+        self._min_pooled = float("inf") if pool is None else pool.min_size
+        self._state = _SIZE
+        self._partial = bytearray() # A size or header field split across chunks
+        self._frame_size = 0
+        self._header = b""
+        self._payload = None # Buffer the payload is collected into (unless streaming)
+        self._payload_view = None # Assigning to a bytearray's slice would copy the bytes into a temporary first
+        self._filled = 0
+        self._username_size = 0
+        self._flags = 0
+        self._remaining = 0 # Data bytes left to stream or skip
+
+    @property
+    def is_idle(self):
+        """
+        True if the parser is between frames, i.e. it is not holding part of a frame
+        """
+        return self._state == _SIZE and not self._partial
+
+    def save_state(self):
+        """
+        Returns the parser's state as a dictionary that can be serialized as JSON, so that another parser (possibly in
+        another process) can carry on from the same place in the stream with restore_state(). The bytes of an
+        unfinished frame are returned as they were received, so they will be parsed again. Parsers in streaming mode
+        can only be saved between messages.
+        """
+        size = self._frame_size.to_bytes(4, "big")
+        skip = 0
+        if self._state == _SIZE:
+            pending = bytes(self._partial)
+        elif self._state == _HEADER:
+            pending = size + self._partial
+        elif self._state == _PAYLOAD:
+            pending = size + (self._header if self._payload is None else self._payload[:self._filled])
+        elif self._state == _SKIP:
+            pending = b""
+            skip = self._remaining
+        else:
+            raise ValueError("Cannot save the state of a parser in the middle of a streamed message")
+        return {"raw": self.raw, "pending": pending.hex(), "skip": skip}
+
+    def restore_state(self, state):
+        """
+        Carries on from a state returned by save_state(). The parser must not have been fed anything yet. Returns the
+        events completed by the restored bytes (normally none).
+        """
+        self.raw = state["raw"]
+        if state["skip"]:
+            self._remaining = state["skip"]
+            self._state = _SKIP
+            return []
+        return self.feed(bytes.fromhex(state["pending"]))
+
+    def _take(self, view, pos, count):
+        """
+        Collects a field of `count` bytes, which may be split across several calls to feed(). Returns a tuple of the
+        field (or None if more bytes are needed) and the new position in `view`.
+        """
+        if not self._partial and len(view) - pos >= count:
+            return view[pos:pos + count], pos + count
+        taken = min(count - len(self._partial), len(view) - pos)
+        self._partial.extend(view[pos:pos + taken])
+        if len(self._partial) < count:
+            return None, pos + taken
+        field = bytes(self._partial)
+        self._partial.clear()
+        return field, pos + taken
+
+    def _start_frame(self, size):
+        if size > self.max_frame_size:
+            raise FrameTooLarge(size, self.max_frame_size)
+        self._frame_size = size
+        if self.raw:
+            self._header = b""
+            self._filled = 0
+            self._state = _PAYLOAD
+        elif size < 9:
+            raise ProtocolError(f"Frame of {size} bytes is too small to hold a message header")
+        else:
+            self._state = _HEADER
+
+    def _start_message(self, header, events):
+        """
+        Checks a pychat header against the frame size and the size limits, and moves on to the rest of the message
+        """
+        username_size = int.from_bytes(header[0:4], "big")
+        data_size = int.from_bytes(header[4:8], "big")
+        flags = header[8]
+        if 9 + username_size + data_size != self._frame_size:
+            raise ProtocolError(f"Message header ({username_size} + {data_size} bytes) does not match the frame size "
+                                f"({self._frame_size} bytes)")
+        limit = None
+        if self.size_limits:
+            msg_type = flags & ~MODIFIER_FLAGS
+            limit = self.size_limits.get(msg_type)
+            if limit is None or (flags & 16 and msg_type not in DIRECT_TYPES):
+                raise ProtocolError(f"Messages with flags {flags} are not accepted")
+        if limit is not None and data_size > limit:
+            events.append(MessageRejected(flags, data_size, limit))
+            self._remaining = self._frame_size - 9
+            self._state = _SKIP
+            return
+        self._username_size = username_size
+        self._flags = flags
+        if self.stream:
+            self._remaining = data_size
+            self._state = _USERNAME
+        else:
+            self._header = bytes(header)
+            self._filled = 9
+            self._state = _PAYLOAD
+
+    def _finish_payload(self, events):
+        payload = self._payload
+        self._payload = None
+        self._payload_view = None
+        self._state = _SIZE
+        if self.raw:
+            events.append(RawFrame(payload))
+            return
+        view = memoryview(payload)
+        if self._frame_size >= self._min_pooled: # Pooled buffers can be larger than the payload
+            view = payload = view[:self._frame_size]
+        events.append(ChatMessage(_decode_username(view[9:9 + self._username_size]), self._flags,
+                                  view[9 + self._username_size:], payload))
+
+    def _new_payload(self):
+        if self.raw or self._frame_size < self._min_pooled:
+            return bytearray(self._frame_size)
+        return self.pool.acquire(self._frame_size)
+
+    def feed(self, data):
+        """
+        Parses a chunk of bytes and returns a list of the events it completed. Raises ProtocolError if the bytes are
+        not valid pychat protocol.
+        """
+        events = []
+        view = memoryview(data)
+        pos = 0
+        end = len(view)
+        while True:
+            if self._state == _SIZE:
+                if pos == end:
+                    break
+                field, pos = self._take(view, pos, 4)
+                if field is None:
+                    break
+                self._start_frame(int.from_bytes(field, "big"))
+
+            elif self._state == _HEADER:
+                field, pos = self._take(view, pos, 9)
+                if field is None:
+                    break
+                self._start_message(field, events)
+
+            elif self._state == _PAYLOAD:
+                if self._payload is None:
+                    needed = self._frame_size - self._filled
+                    if end - pos >= needed and self._frame_size < self._min_pooled:
+                        # Rest of the payload is in this chunk, copy it in one go
+                        self._payload = bytearray(self._header)
+                        self._payload += view[pos:pos + needed]
+                        pos += needed
+                        self._finish_payload(events)
+                        continue
+                    self._payload = self._new_payload()
+                    self._payload_view = memoryview(self._payload)
+                    self._payload_view[0:self._filled] = self._header
+                taken = min(self._frame_size - self._filled, end - pos)
+                self._payload_view[self._filled:self._filled + taken] = view[pos:pos + taken]
+                self._filled += taken
+                pos += taken
+                if self._filled < self._frame_size:
+                    break
+                self._finish_payload(events)
+
+            elif self._state == _USERNAME:
+                field, pos = self._take(view, pos, self._username_size)
+                if field is None:
+                    break
+                events.append(MessageStart(_decode_username(field), self._flags, self._remaining))
+                self._state = _DATA
+
+            elif self._state == _DATA:
+                taken = min(self._remaining, end - pos)
+                if taken:
+                    events.append(MessageData(bytes(view[pos:pos + taken])))
+                    self._remaining -= taken
+                    pos += taken
+                if self._remaining:
+                    break
+                events.append(MessageEnd())
+                self._state = _SIZE
+
+            elif self._state == _SKIP:
+                taken = min(self._remaining, end - pos)
+                self._remaining -= taken
+                pos += taken
+                if self._remaining:
+                    break
+                self._state = _SIZE
+        return events
+
+
+def encode_frame(payload):
+    """
+    Adds the 4 byte size header to a payload
+    """
+    frame = bytearray(len(payload).to_bytes(4, "big"))
+    frame.extend(payload)
+    return frame
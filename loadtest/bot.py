@@ -0,0 +1,314 @@
+"""
+Headless load-generation bots for pychat
+Written by Joshua Kitchen - 2025
+
+Simulates many chat room members from a single process using asyncio. Every bot speaks the same protocol as
+PychatClient (see pychat_backend.py), but over asyncio streams instead of a TCPClient and a thread per connection.
+
+When the server announces media instead of sending it in full (see media_store.py), a fraction of the announcements
+(`fetch_ratio`) are downloaded, like a user opening them.
+
+Bots can also watch the room as spectators (see spectators.py), which only receive.
+
+Each message a bot sends carries the time it was sent (from time.perf_counter_ns()) so that any bot receiving it can
+measure the send-to-receive latency. Since all bots share one process, they share one clock:
+    - Text messages start with "<send time>:"
+    - Multimedia messages are named "<send time>.<ext>"
+"""
+
+import asyncio
+import collections
+import logging
+import random
+import time
+
+import client.backend.exceptions as exc
+from frame_parser import FrameParser, ProtocolError, encode_frame
+from server.backend.latency import LatencyHistogram
+from server.backend.spectators import SPECTATE_HANDSHAKE
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPychatClient:
+    """
+    An asyncio version of the connection logic in PychatClient. Messages are framed with a 4 byte size header, the
+    same as TCPLib. If `spectate` is True, the client connects as a spectator, and `username` is only its name in the
+    server's log.
+    """
+    def __init__(self, username, socket_options=None, spectate=False):
+        self.username = username
+        self.socket_options = socket_options # See socket_options.py
+        self.spectate = spectate
+        self._reader = None
+        self._writer = None
+        self._parser = FrameParser()
+        self._msgs = collections.deque()
+
+    @property
+    def is_connected(self):
+        return self._writer is not None
+
+    async def _send_frame(self, data: bytes):
+        self._writer.write(encode_frame(data))
+        await self._writer.drain()
+
+    async def _receive_frame(self):
+        """
+        Reads exactly one frame, so that nothing after the server's handshake response is read before the parser
+        takes over
+        """
+        try:
+            size = int.from_bytes(await self._reader.readexactly(4), "big")
+            return await self._reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return b""
+
+    async def receive(self):
+        """
+        Returns the next message from the server (a frame_parser.ChatMessage), or None if the connection was closed.
+        Pings from the server are answered here and not returned.
+        """
+        while True:
+            msg = await self._receive_msg()
+            if msg is None or msg.flags != 4 or msg.data[0:5] != b"PING:":
+                return msg
+            try:
+                await self.send_chat_msg(b"PONG:" + bytes(msg.data[5:]).split(b":")[0], 4)
+            except ConnectionError:
+                return
+
+    async def _receive_msg(self):
+        while not self._msgs:
+            try:
+                data = await self._reader.read(65536)
+            except ConnectionError:
+                return
+            if not data:
+                return
+            try:
+                self._msgs.extend(self._parser.feed(data))
+            except ProtocolError as e:
+                logger.warning("%s received a bad message: %s", self.username, e)
+                return
+        return self._msgs.popleft()
+
+    async def init_connection(self, addr):
+        """
+        Performs the same handshake as PychatClient.init_connection() and returns the list of room members. Raises
+        the exceptions in exceptions.py if the server rejected the connection.
+        """
+        self._reader, self._writer = await asyncio.open_connection(addr[0], addr[1])
+        if self.socket_options is not None:
+            self.socket_options.apply(self._writer.get_extra_info("socket"))
+        username = bytes(self.username, "utf-8")
+        await self._send_frame(SPECTATE_HANDSHAKE + username if self.spectate else username)
+        server_response = str(await self._receive_frame(), "utf-8")
+        if server_response == "USERNAME TAKEN":
+            await self.close()
+            raise exc.UserIDTaken()
+        elif server_response == "USERNAME TOO LONG":
+            await self.close()
+            raise exc.UserIDTooLong()
+        elif server_response == "SERVER IS FULL":
+            await self.close()
+            raise exc.ServerFull()
+        elif server_response[0:8] == "MEMBERS:":
+            return [member for member in server_response[8:].split(',') if member]
+        else:
+            await self.close()
+            raise ConnectionError(f"Unexpected response from server: {server_response}")
+
+    async def send_chat_msg(self, data: bytes, flags: int):
+        await self._send_frame(utils.encode_msg(bytes(self.username, 'utf-8'), data, flags))
+
+    async def send_multimedia_msg(self, filename, data):
+        await self.send_chat_msg(utils.encode_multimedia_body(filename, data), flags=2)
+
+    async def fetch_media(self, digest: str):
+        await self.send_chat_msg(bytes(f"FETCH:{digest}", 'utf-8'), 4)
+
+    async def disconnect(self):
+        if not self.is_connected:
+            return
+        try:
+            await self.send_chat_msg(b"", 8)
+        except ConnectionError:
+            pass
+        await self.close()
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        self._writer = None
+        self._reader = None
+
+
+class LoadStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.connects = 0
+        self.failed_connects = 0
+        self.disconnects = 0
+        self.sent = {"text": 0, "image": 0, "mp3": 0}
+        self.bytes_sent = 0
+        self.received = 0
+        self.bytes_received = 0
+        self.info_received = 0
+        self.fetched = 0
+
+    def report(self, elapsed):
+        summary = self.latency.summary()
+        total_sent = sum(self.sent.values())
+        return {
+            "elapsed": elapsed,
+            "connects": self.connects,
+            "failed_connects": self.failed_connects,
+            "disconnects": self.disconnects,
+            "sent": dict(self.sent),
+            "sent_per_sec": total_sent / elapsed,
+            "received": self.received,
+            "received_per_sec": self.received / elapsed,
+            "bytes_sent_per_sec": self.bytes_sent / elapsed,
+            "bytes_received_per_sec": self.bytes_received / elapsed,
+            "info_received": self.info_received,
+            "fetched": self.fetched,
+            "latency": summary
+        }
+
+
+class Bot:
+    """
+    A simulated chat room member. Sends messages at `rate` messages per second (exponentially distributed gaps) with
+    the mix given by `weights`. If `session_time` is not None, the bot leaves after a random session (exponentially
+    distributed with mean `session_time` seconds) and rejoins under a new username. A spectator bot sends nothing.
+    """
+    def __init__(self, bot_id, addr, stats, rate=1.0, weights=(1, 0, 0), sizes=(64, 65536, 262144),
+                 session_time=None, fetch_ratio=0.1, spectate=False):
+        self.bot_id = bot_id
+        self.addr = addr
+        self.stats = stats
+        self.rate = rate
+        self.weights = weights
+        self.sizes = sizes
+        self.session_time = session_time
+        self.fetch_ratio = fetch_ratio
+        self.spectate = spectate
+        self._session = 0
+        self._pending_fetches = 0
+
+    def _next_username(self):
+        self._session += 1
+        return f"{'spectator' if self.spectate else 'bot'}{self.bot_id}-{self._session}"
+
+    async def _receive_loop(self, client):
+        while True:
+            msg = await client.receive()
+            if msg is None:
+                return
+            now = time.perf_counter_ns()
+            self.stats.bytes_received += len(msg.payload) + 4
+            if msg.flags == 1:
+                sent_at = bytes(msg.data).split(b":", 1)[0]
+            elif msg.flags == 2 and self._pending_fetches > 0:
+                self._pending_fetches -= 1
+                self.stats.fetched += 1
+                continue
+            elif msg.flags == 2:
+                filename, _ = utils.decode_multimedia_body(msg.data)
+                sent_at = filename.split(".", 1)[0]
+            elif msg.flags == 32:
+                filename, _, digest, _ = utils.decode_media_announcement(msg.data)
+                sent_at = filename.split(".", 1)[0]
+                if random.random() < self.fetch_ratio:
+                    self._pending_fetches += 1
+                    try:
+                        await client.fetch_media(digest)
+                    except ConnectionError:
+                        return
+            else:
+                self.stats.info_received += 1
+                continue
+            self.stats.received += 1
+            try:
+                self.stats.latency.record((now - int(sent_at)) / 1e9)
+            except ValueError:  # Message was not sent by a bot
+                pass
+
+    async def _send_one(self, client):
+        kind = random.choices(("text", "image", "mp3"), weights=self.weights)[0]
+        sent_at = time.perf_counter_ns()
+        if kind == "text":
+            data = f"{sent_at}:".encode() + b"x" * self.sizes[0]
+            await client.send_chat_msg(data, 1)
+        elif kind == "image":
+            data = random.randbytes(self.sizes[1])
+            await client.send_multimedia_msg(f"{sent_at}.png", data)
+        else:
+            data = random.randbytes(self.sizes[2])
+            await client.send_multimedia_msg(f"{sent_at}.mp3", data)
+        self.stats.sent[kind] += 1
+        self.stats.bytes_sent += len(data)
+
+    async def _session_loop(self, client, deadline):
+        loop = asyncio.get_running_loop()
+        if self.session_time is not None:
+            deadline = min(deadline, loop.time() + random.expovariate(1 / self.session_time))
+        while loop.time() < deadline:
+            if self.rate > 0:
+                await asyncio.sleep(min(random.expovariate(self.rate), max(deadline - loop.time(), 0)))
+            else:
+                await asyncio.sleep(max(deadline - loop.time(), 0))
+                break
+            if loop.time() >= deadline:
+                break
+            await self._send_one(client)
+
+    async def run(self, duration):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        while loop.time() < deadline:
+            client = AsyncPychatClient(self._next_username(), spectate=self.spectate)
+            try:
+                await client.init_connection(self.addr)
+            except (exc.UserIDTaken, exc.UserIDTooLong, exc.ServerFull, OSError) as e:
+                logger.warning("%s could not connect: %r", client.username, e)
+                self.stats.failed_connects += 1
+                await asyncio.sleep(1)
+                continue
+            self.stats.connects += 1
+            self._pending_fetches = 0
+            receiver = asyncio.create_task(self._receive_loop(client))
+            try:
+                await self._session_loop(client, deadline)
+            except ConnectionError:
+                logger.warning("%s lost its connection", client.username)
+            await client.disconnect()
+            self.stats.disconnects += 1
+            await receiver
+
+
+async def run_load_test(addr, num_bots, duration, rate=1.0, weights=(1, 0, 0), sizes=(64, 65536, 262144),
+                        session_time=None, ramp_up=1.0, fetch_ratio=0.1, num_spectators=0):
+    """
+    Connects `num_bots` bots and `num_spectators` spectators to the server at `addr` (spread out over `ramp_up`
+    seconds), runs them for `duration` seconds, and returns a dictionary of results (see LoadStats.report())
+    """
+    stats = LoadStats()
+    bots = [Bot(i, addr, stats, rate, weights, sizes, session_time, fetch_ratio) for i in range(num_bots)]
+    bots += [Bot(i, addr, stats, 0, weights, sizes, session_time, fetch_ratio, spectate=True)
+             for i in range(num_spectators)]
+
+    async def start_bot(bot, delay):
+        await asyncio.sleep(delay)
+        await bot.run(duration - delay)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(start_bot(bot, ramp_up * i / len(bots)) for i, bot in enumerate(bots)))
+    return stats.report(time.perf_counter() - start)
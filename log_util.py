@@ -3,7 +3,14 @@ log_util.py
 Written by Joshua Kitchen - 2024
 """
 
+import atexit
+import gzip
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 import sys
 
 DEBUG_FORMATTER = logging.Formatter(
@@ -17,16 +24,133 @@ INFO_FORMATTER = logging.Formatter(
 )
 
 
-def toggle_file_handler(logger, log_path, log_level, handler_name):
-    for handler in logger.handlers:
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a single line JSON object for machine parsing
+    """
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "created": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "function": record.funcName,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+JSON_FORMATTER = JsonFormatter()
+
+_listeners = {}  # Logger name -> (QueueListener, QueueHandler)
+
+
+def start_async_logging(logger):
+    """
+    Moves all of the logger's handlers onto a background thread. Records are put on a queue by the logging thread and
+    written out by a QueueListener, so slow handlers (like file handlers) never block the caller. Handlers added with
+    toggle_file_handler() or toggle_stream_handler() afterward are also run on the background thread.
+    """
+    if logger.name in _listeners:
+        return
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.set_name("async-queue-handler")
+    listener = logging.handlers.QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    _listeners[logger.name] = (listener, queue_handler)
+    listener.start()
+    atexit.register(stop_async_logging, logger)
+
+
+def stop_async_logging(logger):
+    """
+    Flushes any queued records and moves the logger's handlers back onto the logging thread.
+    """
+    try:
+        listener, queue_handler = _listeners.pop(logger.name)
+    except KeyError:
+        return
+    logger.removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+
+
+def _get_handlers(logger):
+    if logger.name in _listeners:
+        return list(_listeners[logger.name][0].handlers)
+    return list(logger.handlers)
+
+
+def _add_handler(logger, handler):
+    if logger.name in _listeners:
+        listener = _listeners[logger.name][0]
+        listener.handlers = listener.handlers + (handler,)
+    else:
+        logger.addHandler(handler)
+
+
+def _remove_handler(logger, handler):
+    if logger.name in _listeners:
+        listener = _listeners[logger.name][0]
+        listener.handlers = tuple(h for h in listener.handlers if h is not handler)
+    else:
+        logger.removeHandler(handler)
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+
+def toggle_file_handler(logger, log_path, log_level, handler_name, rotation=None, max_bytes=10_485_760,
+                        when="midnight", backup_count=5, compress=False, json_format=False):
+    """
+    Adds a file handler to the logger, replacing any existing handler named `handler_name`.
+
+    rotation:
+        None - The log is truncated when the handler is created and grows without limit
+        "size" - The log is rotated once it reaches `max_bytes`
+        "time" - The log is rotated at the interval given by `when` (see logging.handlers.TimedRotatingFileHandler)
+    With rotation, existing logs are appended to and `backup_count` rotated logs are kept. If `compress` is True, rotated
+    logs are gzipped. If `json_format` is True, records are written as JSON lines.
+    """
+    for handler in _get_handlers(logger):
         if handler.name == handler_name:
-            logger.removeHandler(handler)
+            _remove_handler(logger, handler)
+            handler.close()
+
+    if rotation is None:
+        file_handler = logging.FileHandler(log_path, mode='w')
+    elif rotation == "size":
+        file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count)
+    elif rotation == "time":
+        file_handler = logging.handlers.TimedRotatingFileHandler(log_path, when=when, backupCount=backup_count)
+    else:
+        raise ValueError(f"'{rotation}' is not a valid rotation mode")
+
+    if compress and rotation is not None:
+        file_handler.namer = _gzip_namer
+        file_handler.rotator = _gzip_rotator
 
-    file_handler = logging.FileHandler(log_path, mode='w')
     file_handler.set_name(handler_name)
     file_handler.setLevel(log_level)
 
-    if log_level == logging.DEBUG:
+    if json_format:
+        formatter = JSON_FORMATTER
+    elif log_level == logging.DEBUG:
         formatter = DEBUG_FORMATTER
     elif log_level == logging.INFO:
         formatter = INFO_FORMATTER
@@ -34,13 +158,13 @@ def toggle_file_handler(logger, log_path, log_level, handler_name):
         formatter = DEBUG_FORMATTER
 
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    _add_handler(logger, file_handler)
 
 
 def toggle_stream_handler(logger, log_level, handler_name):
-    for handler in logger.handlers:
+    for handler in _get_handlers(logger):
         if handler.name == handler_name:
-            logger.removeHandler(handler)
+            _remove_handler(logger, handler)
             return
 
     stream_handler = logging.StreamHandler(sys.stdout)
@@ -55,4 +179,4 @@ def toggle_stream_handler(logger, log_level, handler_name):
         formatter = DEBUG_FORMATTER
 
     stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
+    _add_handler(logger, stream_handler)
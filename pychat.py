@@ -2,16 +2,23 @@
 Pychat Client
 Written by Joshua Kitchen - 2023
 """
+import time
+STARTED = time.perf_counter() # Before anything else is imported, for --profile-startup
+
 import argparse
 import logging
 
 from client.gui.main_win import MainWin
 import log_util
+from socket_options import PROFILES
+from client.startup_profile import StartupProfile
 
 logger = logging.getLogger()
 logger.handlers = []
 
 def main():
+    profile = StartupProfile(STARTED)
+    profile.mark("imports")
     parser = argparse.ArgumentParser(description="Starts the pychat client")
     parser.add_argument("-ip", type=str,
                         help="The ip address (IPv4) of the chat room to connect to on startup", default="127.0.0.1")
@@ -22,6 +29,27 @@ def main():
                         help="Add debug messages to client logs")
     parser.add_argument("-l", '--enable-console-logging', action="store_true",
                         help="Enables logging to the console")
+    parser.add_argument("-a", '--async-logging', action="store_true",
+                        help="Write log messages from a background thread")
+    parser.add_argument('--log-rotation', choices=["size", "time"],
+                        help="Rotate the client log by size (see --log-max-bytes) or time (see --log-when) instead of "
+                             "truncating it on every start")
+    parser.add_argument('--log-max-bytes', type=int, default=10_485_760,
+                        help="Size in bytes at which the client log is rotated when --log-rotation=size")
+    parser.add_argument('--log-when', type=str, default="midnight",
+                        help="When to rotate the client log when --log-rotation=time (e.g. 'midnight', 'h', 'd')")
+    parser.add_argument('--log-backups', type=int, default=5, help="Number of rotated client logs to keep")
+    parser.add_argument('--log-compress', action="store_true", help="Gzip rotated client logs")
+    parser.add_argument('--log-json', action="store_true", help="Write the client log as JSON lines")
+    parser.add_argument("-t", '--trace', action="store_true",
+                        help="Attach a send timestamp to every message so the server can measure end-to-end latency")
+    parser.add_argument('--no-history', action="store_true",
+                        help="Don't keep a history of the chat rooms you join (see client/backend/history.py)")
+    parser.add_argument('--socket-profile', choices=[*PROFILES, "none"], default="text",
+                        help="TCP options for the connection: 'text' sends short messages without delay, 'bulk' uses "
+                             "large kernel buffers for sending lots of media, and 'none' leaves the OS defaults")
+    parser.add_argument('--profile-startup', action="store_true",
+                        help="Print how long each phase of starting the client took, once the window is shown")
 
     args = vars(parser.parse_args())
 
@@ -31,14 +59,29 @@ def main():
         log_level = logging.INFO
 
     logger.setLevel(log_level)
-    log_util.toggle_file_handler(logger, ".client_log", log_level, "pychat-client-file-handler")
+    log_util.toggle_file_handler(logger, ".client_log", log_level, "pychat-client-file-handler",
+                                 rotation=args['log_rotation'], max_bytes=args['log_max_bytes'],
+                                 when=args['log_when'], backup_count=args['log_backups'],
+                                 compress=args['log_compress'], json_format=args['log_json'])
     if args['enable_console_logging']:
         log_util.toggle_stream_handler(logger, log_level, 'client_console_handler')
+    if args['async_logging']:
+        log_util.start_async_logging(logger)
 
+    socket_options = PROFILES.get(args['socket_profile'])
+    profile.mark("arguments and logging")
     if args['ip'] and args['port'] and args['username']:
-        win = MainWin((args['ip'], args['port'], args['username']))
+        win = MainWin((args['ip'], args['port'], args['username']), trace=args['trace'], socket_options=socket_options,
+                      history=not args['no_history'], startup_profile=profile)
     else:
-        win = MainWin()
+        win = MainWin(trace=args['trace'], socket_options=socket_options, history=not args['no_history'],
+                      startup_profile=profile)
+
+    if args['profile_startup']:
+        def print_profile(): # Once the event loop is idle, the window has been drawn
+            profile.mark("first draw")
+            print(profile.report())
+        win.after_idle(print_profile)
 
     win.mainloop()
 
@@ -0,0 +1,72 @@
+"""
+Pychat Load Tester
+Written by Joshua Kitchen - 2025
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+from loadtest.bot import run_load_test
+
+logger = logging.getLogger()
+logger.handlers = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates many pychat users to load test a server. The server "
+                                                 "should be started with '-mc 0' (or a high enough client limit)")
+    parser.add_argument("ip_addr", type=str, help="The ip address (IPv4) of the chat server", default="127.0.0.1")
+    parser.add_argument("port", type=int, help="The port of the chat server", default=5001)
+    parser.add_argument("-n", '--num_bots', type=int, default=100, help="Number of simulated users")
+    parser.add_argument("-t", '--duration', type=float, default=30, help="Length of the test in seconds")
+    parser.add_argument("-r", '--rate', type=float, default=0.5,
+                        help="Average number of messages each bot sends per second")
+    parser.add_argument("-m", '--mix', type=str, default="100,0,0",
+                        help="Relative weights of text, image, and MP3 messages, e.g. '90,8,2'")
+    parser.add_argument('--text_size', type=int, default=64, help="Size of text messages in bytes")
+    parser.add_argument('--image_size', type=int, default=65536, help="Size of image messages in bytes")
+    parser.add_argument('--mp3_size', type=int, default=262144, help="Size of MP3 messages in bytes")
+    parser.add_argument("-s", '--session_time', type=float, default=None,
+                        help="Average time in seconds a bot stays connected before leaving and rejoining. "
+                             "Disables churn if not given")
+    parser.add_argument("-f", '--fetch_ratio', type=float, default=0.1,
+                        help="Fraction of media announcements each bot downloads (when the server uses lazy media)")
+    parser.add_argument('--spectators', type=int, default=0,
+                        help="Number of receive-only spectators watching the room, in addition to the bots")
+    parser.add_argument('--ramp_up', type=float, default=1.0, help="Seconds over which to connect the bots")
+    parser.add_argument("-j", '--json', action="store_true", help="Print the results as JSON")
+
+    args = vars(parser.parse_args())
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.StreamHandler())
+
+    weights = tuple(float(weight) for weight in args['mix'].split(','))
+    if len(weights) != 3 or sum(weights) <= 0:
+        parser.error("--mix must be three comma separated weights, e.g. '90,8,2'")
+
+    results = asyncio.run(run_load_test((args['ip_addr'], args['port']), args['num_bots'], args['duration'],
+                                        rate=args['rate'], weights=weights,
+                                        sizes=(args['text_size'], args['image_size'], args['mp3_size']),
+                                        session_time=args['session_time'], ramp_up=args['ramp_up'],
+                                        fetch_ratio=args['fetch_ratio'], num_spectators=args['spectators']))
+    if args['json']:
+        print(json.dumps(results, indent=4))
+        return
+
+    print(f"DURATION: {results['elapsed']:.1f}s")
+    print(f"CONNECTS: {results['connects']} ({results['failed_connects']} failed), "
+          f"DISCONNECTS: {results['disconnects']}")
+    print(f"SENT: {sum(results['sent'].values())} ({results['sent_per_sec']:.1f} msg/s, "
+          f"{results['bytes_sent_per_sec'] / 1024:.1f} KiB/s) "
+          f"TEXT={results['sent']['text']} IMAGE={results['sent']['image']} MP3={results['sent']['mp3']}")
+    print(f"RECEIVED: {results['received']} ({results['received_per_sec']:.1f} msg/s, "
+          f"{results['bytes_received_per_sec'] / 1024:.1f} KiB/s), INFO: {results['info_received']}, "
+          f"FETCHED: {results['fetched']}")
+    latency = results['latency']
+    print(f"LATENCY (ms): p50={latency['p50'] * 1000:.2f} p95={latency['p95'] * 1000:.2f} "
+          f"p99={latency['p99'] * 1000:.2f} max={latency['max'] * 1000:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ import logging
 import log_util
 from server.backend.TCP_server import PychatServer
 from server.server_interface import ServerInterface
+from socket_options import SocketOptions, PROFILES
 
 logger = logging.getLogger()
 logger.handlers = []
@@ -19,7 +20,18 @@ def main():
                         default="127.0.0.1")
     parser.add_argument("port", type=int, help="The port for the server", default=5001)
     parser.add_argument("-b", '--buffer_size', type=int, default=4096,
-                        help="The default size of the socket buffer. Must be between 1024 and 65535")
+                        help="How many bytes are read from a client's connection at a time. Must be between 1024 "
+                             "and 65535")
+    parser.add_argument("-sp", '--socket_profile', choices=[*PROFILES, "none"], default="text",
+                        help="TCP options for client connections: 'text' sends short messages without delay, 'bulk' "
+                             "uses large kernel buffers for media-heavy rooms, and 'none' leaves the OS defaults "
+                             "(see socket_options.py)")
+    parser.add_argument('--send_buffer', type=int,
+                        help="Size in bytes of each connection's kernel send buffer (SO_SNDBUF), overriding the "
+                             "socket profile")
+    parser.add_argument('--recv_buffer', type=int,
+                        help="Size in bytes of each connection's kernel receive buffer (SO_RCVBUF), overriding the "
+                             "socket profile")
     parser.add_argument("-mc", '--max_clients', type=int, default=16,
                         help="The maximum number of clients allowed in the server by default. Setting to zero will "
                              "allow infinite client connections")
@@ -27,8 +39,65 @@ def main():
                         help="The maximum length of a client's username by default")
     parser.add_argument("-d", '--debug', action="store_true",
                         help="Add debug messages to the server log")
+    parser.add_argument("-al", '--async_logging', action="store_true",
+                        help="Write log messages from a background thread so logging never blocks message routing")
+    parser.add_argument("-lr", '--log_rotation', choices=["size", "time"],
+                        help="Rotate the server log by size (see --log_max_bytes) or time (see --log_when) instead of "
+                             "truncating it on every start")
+    parser.add_argument('--log_max_bytes', type=int, default=10_485_760,
+                        help="Size in bytes at which the server log is rotated when --log_rotation=size")
+    parser.add_argument('--log_when', type=str, default="midnight",
+                        help="When to rotate the server log when --log_rotation=time (e.g. 'midnight', 'h', 'd')")
+    parser.add_argument('--log_backups', type=int, default=5, help="Number of rotated server logs to keep")
+    parser.add_argument("-lc", '--log_compress', action="store_true", help="Gzip rotated server logs")
+    parser.add_argument("-lj", '--log_json', action="store_true",
+                        help="Write the server log as JSON lines")
     parser.add_argument("-l", '--log_mode', action="store_true",
                         help="Start the server in logging mode")
+    parser.add_argument("-lt", '--latency_tracking', action="store_true",
+                        help="Track how long relayed messages spend in the server. View results with the 'latency' command")
+    parser.add_argument("-ts", '--trace_sample_rate', type=float, default=0.0,
+                        help="Fraction (0 to 1) of relayed messages whose full trace is written to the server log. "
+                             "Requires --latency_tracking")
+    parser.add_argument("-em", '--eager_media', action="store_true",
+                        help="Send images and MP3s to every client in full instead of announcing them and letting "
+                             "clients download them on demand")
+    parser.add_argument('--max_text_size', type=int, default=65_536,
+                        help="Largest text message (in bytes) the server will relay")
+    parser.add_argument('--max_image_size', type=int, default=16_777_216,
+                        help="Largest image (in bytes) the server will relay")
+    parser.add_argument('--max_mp3_size', type=int, default=33_554_432,
+                        help="Largest MP3 (in bytes) the server will relay")
+    parser.add_argument('--max_info_size', type=int, default=4096,
+                        help="Largest info message (in bytes) the server will accept")
+    parser.add_argument('--max_frame_size', type=int, default=67_108_864,
+                        help="Clients that send a message larger than this (in bytes) are disconnected")
+    parser.add_argument('--max_outbox_size', type=int, default=134_217_728,
+                        help="Clients that fall this many bytes behind on the messages sent to them are disconnected")
+    parser.add_argument("-rw", '--routing_workers', type=int, default=2,
+                        help="Number of threads routing messages. Each client's messages are always routed by the same "
+                             "thread, so they stay in order")
+    parser.add_argument('--buffer_pool_size', type=int, default=67_108_864,
+                        help="Most bytes of free receive buffers kept for reuse by large messages. Set to zero to "
+                             "allocate a new buffer for every message")
+    parser.add_argument('--max_spectators', type=int, default=1024,
+                        help="Most receive-only spectators (e.g. dashboards and archivers) that can watch the room. "
+                             "They aren't counted towards the member limit. Set to zero to turn spectators away")
+    parser.add_argument('--presence_interval', type=float, default=0.25,
+                        help="Seconds that joins and leaves are collected for before being broadcast together. Set to "
+                             "zero to broadcast each one straight away")
+    parser.add_argument('--presence_batch', type=int, default=64,
+                        help="Broadcast joins and leaves early once this many members have changed")
+    parser.add_argument('--presence_summary_size', type=int, default=100,
+                        help="Rooms with more members than this are only told how many members joined and left")
+    parser.add_argument("-pi", '--ping_interval', type=float, default=15,
+                        help="Seconds between pings to each client. Set to zero to stop pinging clients")
+    parser.add_argument("-it", '--idle_timeout', type=float, default=45,
+                        help="Clients that send nothing (not even an answer to a ping) for this many seconds are "
+                             "disconnected. Set to zero to never disconnect idle clients")
+    parser.add_argument("-to", '--takeover', type=str, nargs='?', const=".pychat_handoff", default=None,
+                        help="Take over the connections of a running server that is waiting in the 'upgrade' command, "
+                             "using the Unix socket at this path (default: .pychat_handoff)")
     parser.add_argument("-bl", "--ipblacklist_path", type=str, help="Path to a list of ip addresses to blacklist. The file must be in CSV format.")
 
 
@@ -40,12 +109,34 @@ def main():
         log_level = logging.INFO
 
     logger.setLevel(log_level)
-    log_util.toggle_file_handler(logger, ".server_log", log_level, "server-file-handler")
+    log_util.toggle_file_handler(logger, ".server_log", log_level, "server-file-handler",
+                                 rotation=args['log_rotation'], max_bytes=args['log_max_bytes'],
+                                 when=args['log_when'], backup_count=args['log_backups'],
+                                 compress=args['log_compress'], json_format=args['log_json'])
+    if args['async_logging']:
+        log_util.start_async_logging(logger)
+
+    socket_options = None
+    if args['socket_profile'] != "none":
+        socket_options = PROFILES[args['socket_profile']]
+    if args['send_buffer'] is not None or args['recv_buffer'] is not None:
+        socket_options = (socket_options or SocketOptions()).replace(send_buffer=args['send_buffer'],
+                                                                     recv_buffer=args['recv_buffer'])
 
     tcp_server = PychatServer(args['buffer_size'], args['max_clients'],
-                              args['max_userid_len'])
+                              args['max_userid_len'], track_latency=args['latency_tracking'],
+                              trace_sample_rate=args['trace_sample_rate'], lazy_media=not args['eager_media'],
+                              max_frame_size=args['max_frame_size'], max_text_size=args['max_text_size'],
+                              max_image_size=args['max_image_size'], max_mp3_size=args['max_mp3_size'],
+                              max_info_size=args['max_info_size'], ping_interval=args['ping_interval'],
+                              idle_timeout=args['idle_timeout'], socket_options=socket_options,
+                              max_outbox_size=args['max_outbox_size'], routing_workers=args['routing_workers'],
+                              buffer_pool_size=args['buffer_pool_size'],
+                              presence_interval=args['presence_interval'], presence_batch=args['presence_batch'],
+                              presence_summary_size=args['presence_summary_size'],
+                              max_spectators=args['max_spectators'])
 
-    interface = ServerInterface(tcp_server, (args['ip_addr'], args['port']), logger)
+    interface = ServerInterface(tcp_server, (args['ip_addr'], args['port']), logger, takeover_path=args['takeover'])
     interface.mainloop(log_mode=args['log_mode'])
 
 
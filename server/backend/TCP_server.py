@@ -14,47 +14,306 @@ FLAGS:
     2 = Multimedia
     4 = Information
     8 = Disconnect
+    16 = Direct (combined with 1 or 2)
+    32 = Media announcement
+    128 = Trace (may be combined with any other flag)
+
+If the trace flag is set, the first 8 bytes of the data are the client's send timestamp (nanoseconds since the epoch).
+The server strips the timestamp and the trace flag before relaying the message (see latency.py).
+
+If the direct flag is set, an additional header is included at the start of the data. The message is only sent to the
+listed recipients (and echoed back to the sender):
+[Recipients Length (4 bytes)][Comma separated list of recipient usernames]
+
+A media announcement is sent by the server in place of a multimedia message. Clients download the file only when the
+user opens it by sending the info message "FETCH:<SHA-256 hex digest>", and the server replies with the full
+multimedia message. The announcement's data is:
+[Filename Length (4 bytes)][Filename][File Size (8 bytes)][SHA-256 digest (32 bytes)][PNG thumbnail (may be empty)]
 
 If the message is a multimedia message, an additional header is included in the message body (flags should always be 2):
 [Filename Length (4 bytes)][Filename]
 
 The information flag is used when the server and the client need to pass along information.
 Possible info messages are:
-- JOINED:<user id>
-- LEFT:<user id>
+- JOINED:<user id> (only sent when presence batching is off)
+- LEFT:<user id> (only sent when presence batching is off)
+- PRESENCE:<comma separated list of "+<user id>" for members who joined and "-<user id>" for members who left>
+- PRESENCE_SUMMARY:<number of members who joined>:<number who left> (sent instead of PRESENCE in large rooms)
 - MEMBERS:<list of connected users>
-- KICKED:<no message body>
+- KICKED:<no message body> (sent to a client that the server is about to disconnect)
 - SERVERMSG:<message>
+- FETCH:<SHA-256 hex digest> (sent by clients to download an announced file)
+- PING:<token>:<idle timeout in seconds> (sent by the server)
+- PONG:<token> (a client's answer to a PING)
+
+Everything else is described where it is implemented:
+    outbox.py               - Each client's queue of outbound messages, and how text and media take turns
+    routing.py              - The routing threads, which relay each client's messages in the order they were sent
+    presence.py             - Batched joins and leaves (PRESENCE and PRESENCE_SUMMARY)
+    media_store.py          - Files stored by digest and sent on demand (FETCH and media announcements)
+    handoff.py              - Handing every connection to a new server process (see hand_off() and take_over())
+    drain()                 - Shutting down without losing messages that are already on their way
+    latency.py              - Latency tracing (the trace flag)
+    spectators.py           - Read-only connections (b"\xffSPECTATE:")
+    heartbeat.py            - PING/PONG and evicting idle clients
+    socket_options.py       - The TCP options of every connection
+    client_processor.py     - Receive buffers (see buffer_pool.py), and size limits checked before buffering (see
+                              frame_parser.py)
+    PychatServer.__init__() - The copy-on-write client tables
 """
 
 import logging
 import os
 import csv
+import queue
+import selectors
+import socket
 import threading
+import time
+from functools import partial
 
+from TCPLib.tcp_client import TCPClient
 from TCPLib.tcp_server import TCPServer
+from buffer_pool import BufferPool
+from frame_parser import DEFAULT_MAX_FRAME_SIZE, MODIFIER_FLAGS, encode_frame
+from server.backend.client_processor import PychatClientProcessor, POLL_INTERVAL
+from server.backend import handoff
+from server.backend.heartbeat import Heartbeat, DEFAULT_PING_INTERVAL, DEFAULT_IDLE_TIMEOUT
+from server.backend.latency import LatencyTracker
+from server.backend.media_store import MediaStore
+from server.backend.outbox import QueueDelays, classify, CONTROL, DEFAULT_MAX_OUTBOX_SIZE
+from server.backend.presence import Presence, DEFAULT_PRESENCE_INTERVAL, DEFAULT_PRESENCE_BATCH, \
+    DEFAULT_SUMMARY_SIZE
+from server.backend.routing import RoutingQueue, DEFAULT_ROUTING_WORKERS
+from server.backend.spectators import SpectatorTable, SPECTATE_HANDSHAKE, SPECTATOR, DEFAULT_MAX_SPECTATORS, \
+    SPECTATOR_BUFF_SIZE
+from socket_options import SocketOptions
 import utils
 
 logger = logging.getLogger(__name__)
 
+SUBHEADER_ALLOWANCE = 4096 # Room in a multimedia message's data for the filename, recipients, and trace timestamp
+DISCONNECT_SIZE = 8 # A disconnect message has no data, other than the timestamp if it is traced
+MSG_TYPES = {1: "text", 2: "multimedia", 4: "info", 8: "disconnect"}
+DRAIN_TIMEOUT = 10 # Default number of seconds drain() waits for messages to be delivered before giving up
+KICK_TIMEOUT = 1 # Number of seconds kick_client() waits for a client to be sent KICKED before disconnecting it
+DEFAULT_BUFFER_POOL_SIZE = 67_108_864 # 64 MiB
+
 
 class PychatServer(TCPServer):
-    def __init__(self, buff_size=4096, max_clients=16, max_userid_len=16, timeout=None, ip_blacklist_path=".ipblacklist"):
+    def __init__(self, buff_size=4096, max_clients=16, max_userid_len=16, timeout=None, ip_blacklist_path=".ipblacklist",
+                 track_latency=False, trace_sample_rate=0.0, lazy_media=True, media_store_dir=".media_store",
+                 max_frame_size=DEFAULT_MAX_FRAME_SIZE, max_text_size=65_536, max_image_size=16_777_216,
+                 max_mp3_size=33_554_432, max_info_size=4096, ping_interval=DEFAULT_PING_INTERVAL,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, socket_options: SocketOptions | None = None,
+                 max_outbox_size=DEFAULT_MAX_OUTBOX_SIZE, routing_workers=DEFAULT_ROUTING_WORKERS,
+                 buffer_pool_size=DEFAULT_BUFFER_POOL_SIZE, presence_interval=DEFAULT_PRESENCE_INTERVAL,
+                 presence_batch=DEFAULT_PRESENCE_BATCH, presence_summary_size=DEFAULT_SUMMARY_SIZE,
+                 max_spectators=DEFAULT_MAX_SPECTATORS):
         TCPServer.__init__(self, max_clients, timeout)
         self._max_userid_len = max_userid_len
         self._blacklist_path = ip_blacklist_path
         self._ip_blacklist = []
         self._buff_size = buff_size
+        self._socket_options = socket_options
+        self._max_frame_size = max_frame_size
+        self._max_image_size = max_image_size
+        self._max_mp3_size = max_mp3_size
+        # Clients can only send the types of message listed here (see frame_parser.py)
+        self._size_limits = {1: max_text_size,
+                             2: max(max_image_size, max_mp3_size) + SUBHEADER_ALLOWANCE,
+                             4: max_info_size,
+                             8: DISCONNECT_SIZE}
+        # Spectators can't send text or multimedia messages (see spectators.py)
+        self._spectator_size_limits = {1: 0, 2: 0, 4: max_info_size, 8: DISCONNECT_SIZE}
+        self._rejected_msgs = {"text": 0, "multimedia": 0, "info": 0, "disconnect": 0, "image": 0, "mp3": 0}
+        self._rejected_msgs_lock = threading.Lock()
+        # CLIENT TABLES
+        # The tables of connections and usernames are copied whenever a client joins or leaves, and the copy replaces
+        # the old table in one step. A table is never changed once it is in place, so routing, broadcasts, and lookups
+        # use whichever table is current without taking a lock, and a broadcast goes to the members there were when it
+        # started. Only writers take a lock, to keep their copies from overwriting each other.
         self._user_names = {}
+        self._client_ids = {} # Reverse index of self._user_names (username -> client_id)
         self._user_names_lock = threading.Lock()
+        self._spectators = SpectatorTable()
+        self._max_spectators = max_spectators
         self._on_connect = self.on_connect
+        self._accepting = True
+        self._accept_stopped = threading.Event()
+        self._heartbeat = Heartbeat(self, ping_interval, idle_timeout)
+        self._presence = Presence(self, presence_interval, presence_batch, presence_summary_size)
+        self._max_outbox_size = max_outbox_size
+        self._queue_delays = QueueDelays()
+        self._buffer_pool = BufferPool(max_bytes=buffer_pool_size) if buffer_pool_size > 0 else None
+        self._latency = None
+        self._media_store = None
+        if lazy_media:
+            self._media_store = MediaStore(media_store_dir)
+        if track_latency:
+            self._latency = LatencyTracker(trace_sample_rate)
+        if routing_workers <= 0 or not isinstance(routing_workers, int):
+            raise ValueError("routing_workers must be a non-zero, positive integer")
+        self._messages = RoutingQueue(routing_workers, timestamp=track_latency)
 
+        if not 1024 <= self._buff_size <= 65535:
+            raise ValueError("buff_size must be between 1024 and 65535")
+        if self._max_spectators < 0:
+            raise ValueError("max_spectators must not be negative")
         if self._max_userid_len <= 0 or not isinstance(self._max_userid_len, int):
             raise ValueError("max_userid_len must be a non-zero, positive integer")
+        if max(self._size_limits.values()) >= self._max_frame_size:
+            raise ValueError("max_frame_size must be larger than the message size limits")
 
         if not self.load_ip_blacklist(self._blacklist_path):
             logging.warning(f"Could not load {self._blacklist_path}")
 
+    def _generate_client_id(self):
+        """
+        TCPServer's ids combine the time (in ms) with a random number from 0-999, so two clients that connect in the
+        same millisecond can be given the same id. Keep generating ids until one is not in use.
+        """
+        while True:
+            client_id = TCPServer._generate_client_id()
+            if client_id not in self._user_names and client_id not in self._connected_clients and \
+                    client_id not in self._spectators:
+                return client_id
+
+    def _create_client_proc(self, client_id, client_soc, spectator=False):
+        if spectator:
+            buff_size, on_disconnect, size_limits = (min(self._buff_size, SPECTATOR_BUFF_SIZE), self.remove_spectator,
+                                                     self._spectator_size_limits)
+        else:
+            buff_size, on_disconnect, size_limits = self._buff_size, self.disconnect_client, self._size_limits
+        return PychatClientProcessor(client_id=client_id,
+                                     client_soc=client_soc,
+                                     msg_q=self._messages,
+                                     buff_size=buff_size,
+                                     timeout=self._timeout,
+                                     on_disconnect=partial(on_disconnect, client_id),
+                                     max_frame_size=self._max_frame_size,
+                                     size_limits=size_limits,
+                                     on_reject=partial(self.on_reject, client_id),
+                                     on_pong=partial(self._heartbeat.record_pong, client_id),
+                                     queue_delays=self._queue_delays,
+                                     max_outbox_size=self._max_outbox_size,
+                                     buffer_pool=self._buffer_pool)
+
+    def _start_client_proc(self, client_id, client_soc):
+        """
+        Same as TCPServer._start_client_proc(), but connections are read by a PychatClientProcessor
+        """
+        client = TCPClient.from_socket(client_soc)
+        result = self._on_connect(client, client_id)
+        if result is False:
+            client.disconnect()
+            return
+        if result == SPECTATOR:
+            client_proc = self._create_client_proc(client_id, client_soc, spectator=True)
+            self._spectators.add(client_id, client_proc)
+            client_proc.start()
+            self._heartbeat.add(client_id)
+            return
+        client_proc = self._create_client_proc(client_id, client_soc)
+        self._update_connected_clients(client_proc.id, client_proc)
+        # Announce the new member only once it can be sent to (messages sent to it any earlier are dropped), but
+        # before reading from it, so nothing it sends (e.g. a disconnect) can be routed ahead of the announcement.
+        # Batched announcements are still sent late (see presence.py).
+        self._presence.joined(self.get_username(client_id), client_id)
+        client_proc.start()
+        self._heartbeat.add(client_id)
+
+    def _mainloop(self):
+        """
+        Same as TCPServer._mainloop(), but waits for connections with a selector so that accepting can be paused
+        (see hand_off()) without closing the listening socket
+        """
+        logger.debug("Server is listening for connections")
+        self._set_is_running(True)
+        self._accept_stopped.clear()
+        selector = selectors.DefaultSelector()
+        selector.register(self._soc, selectors.EVENT_READ)
+        while self.is_running and self._accepting:
+            if not selector.select(POLL_INTERVAL):
+                continue
+            try:
+                client_soc, client_addr = self._soc.accept()
+            except (BlockingIOError, TimeoutError, ConnectionError):
+                logger.warning("New connection was lost before it could be accepted")
+                continue
+            except (AttributeError, OSError): # Possibly raised if the socket was closed from another thread
+                break
+            # A full server still takes spectators, so on_connect() checks whether there is room
+            if self._socket_options is not None:
+                self._socket_options.apply(client_soc)
+            self._start_client_proc(self._generate_client_id(), client_soc)
+        selector.close()
+        self._accept_stopped.set()
+        logger.debug("Server is no longer listening for connections")
+
+    def start(self, addr):
+        if not self.is_running and self._media_store is not None:
+            self._media_store.clear()
+        self._accepting = True
+        if self._soc is None and self._socket_options is not None:
+            # Buffer sizes have to be set before listen() for accepted connections to inherit them
+            self._soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket_options.apply(self._soc, listening=True)
+        TCPServer.start(self, addr)
+        self._heartbeat.start()
+        self._presence.start()
+
+    def on_reject(self, client_id, flags, data_size, limit):
+        """
+        Called from a client's receive loop when it skips a message that was over the size limit for its type
+        """
+        if client_id in self._spectators: # Their text and multimedia limits are 0 (see spectators.py)
+            try:
+                self.send(client_id, utils.encode_msg(b"SERVER", b"SERVERMSG:Spectators can't send messages", 4))
+            except KeyError:
+                pass
+            return
+        self.reject_msg(client_id, MSG_TYPES[flags & ~MODIFIER_FLAGS], limit)
+
+    def reject_msg(self, client_id, msg_type, limit):
+        with self._rejected_msgs_lock:
+            self._rejected_msgs[msg_type] += 1
+        notice = f"SERVERMSG:Your message was not sent because it is over the {msg_type} size limit of {limit:,} bytes"
+        try:
+            self.send(client_id, utils.encode_msg(b"SERVER", bytes(notice, "utf-8"), 4))
+        except KeyError:
+            pass
+
+    def size_limits(self):
+        """
+        Returns a dictionary of the size limit (in bytes) for each type of message
+        """
+        return {"text": self._size_limits[1], "image": self._max_image_size, "mp3": self._max_mp3_size,
+                "info": self._size_limits[4], "frame": self._max_frame_size}
+
+    def rejected_msg_counts(self):
+        with self._rejected_msgs_lock:
+            return dict(self._rejected_msgs)
+
+    def check_file_size(self, client_id, flags, data):
+        """
+        Checks the file in a multimedia message against the image or MP3 size limit. Returns False (and tells the
+        sender) if it is too large.
+        """
+        if flags & 16:
+            _, data = utils.decode_direct_body(data)
+        filename, file_data = utils.decode_multimedia_body(data)
+        if filename.split('.')[-1].lower() == "mp3":
+            msg_type, limit = "mp3", self._max_mp3_size
+        else:
+            msg_type, limit = "image", self._max_image_size
+        if len(file_data) <= limit:
+            return True
+        logger.info("Rejected %s (%d bytes) from client %s", filename, len(file_data), client_id)
+        self.reject_msg(client_id, msg_type, limit)
+        return False
+
     def on_connect(self, client, client_id):
         """
         Overview of the handshake that takes place between the server and the client:
@@ -67,11 +326,21 @@ class PychatServer(TCPServer):
                           all other checks have passed.
             3.) If the server response is "USERNAME TAKEN", "USERNAME TOO LONG", or "SERVER IS FULL" the connection is
                 immediately closed by the server.
+        A client that sends b"\xffSPECTATE:<name>" instead of a username is a spectator (see spectators.py). It is
+        answered with "MEMBERS:", or "SERVER IS FULL" if `max_spectators` are already connected, and SPECTATOR is
+        returned. A username that isn't valid UTF-8 is turned away without an answer.
 
         This method raises an exception if any of the checks fail or there was a problem. See exceptions.py for a
         list of exceptions specific to this app.
         """
-        username = str(client.receive(), encoding="utf-8")
+        handshake = client.receive()
+        if handshake.startswith(SPECTATE_HANDSHAKE):
+            return self._accept_spectator(client, str(handshake[len(SPECTATE_HANDSHAKE):], "utf-8", "replace"))
+        try:
+            username = str(handshake, encoding="utf-8")
+        except UnicodeDecodeError:
+            logger.debug(f"Connection to {client.peer_addr} was denied because its username was not valid UTF-8")
+            return False
         if self.is_username_taken(username):
             logger.debug(f"Connection to {client.peer_addr} was denied because its username was taken")
             client.send(b"USERNAME TAKEN")
@@ -85,44 +354,47 @@ class PychatServer(TCPServer):
             client.send(b"USERNAME TOO LONG")
             return False
         else:
-            members = ','.join(self.list_usernames())
+            members = ','.join(self._presence.list_members(self.list_usernames))
             self.register_username(username, client_id)
             client.send(bytes(f"MEMBERS:{members}", "utf-8"))
-            self.broadcast_msg(utils.encode_msg(bytes(username, 'utf-8'), bytes(f"JOINED:{username}", "utf-8"), 4))
             return True
 
+    def _accept_spectator(self, client, name):
+        if len(self._spectators) >= self._max_spectators:
+            logger.debug(f"Spectator {client.peer_addr} was denied because {self._max_spectators} are already connected")
+            client.send(b"SERVER IS FULL")
+            return False
+        client.send(bytes(f"MEMBERS:{','.join(self._presence.list_members(self.list_usernames))}", "utf-8"))
+        logger.info("%s @ %d is spectating%s", client.peer_addr[0], client.peer_addr[1], f" as {name}" if name else "")
+        return SPECTATOR
+
     def is_username_taken(self, username):
-        with self._user_names_lock:
-            if username in self._user_names.values() or username == "SERVER":
-                return True
-            else:
-                return False
+        return username in self._client_ids or username == "SERVER"
 
     def register_username(self, username, client_id):
-        with self._user_names_lock:
-            self._user_names.update({client_id: username})
-
+        with self._user_names_lock: # Only taken by writers (see CLIENT TABLES)
+            self._user_names = {**self._user_names, client_id: username}
+            self._client_ids = {**self._client_ids, username: client_id}
 
     def unregister_username(self, client_id):
         with self._user_names_lock:
-            try:
-                del self._user_names[client_id]
-            except KeyError:
+            if client_id not in self._user_names:
                 return False
+            user_names = dict(self._user_names)
+            client_ids = dict(self._client_ids)
+            del client_ids[user_names.pop(client_id)]
+            self._user_names = user_names
+            self._client_ids = client_ids
             return True
 
     def list_usernames(self):
-        with self._user_names_lock:
-            usernames = self._user_names.values()
-            return usernames
+        return self._user_names.values()
 
     def get_username(self, client_id):
-        with self._user_names_lock:
-            try:
-                username = self._user_names[client_id]
-            except KeyError:
-                return
-            return username
+        return self._user_names.get(client_id)
+
+    def get_client_id(self, username):
+        return self._client_ids.get(username)
 
     def save_ip_blacklist(self):
         with open(self._blacklist_path, 'w') as file:
@@ -157,32 +429,633 @@ class PychatServer(TCPServer):
             return True
         return False
 
-    def broadcast_msg(self, msg: bytes, flags: int = 1, is_server_msg: bool = False):
+    def latency_summary(self):
+        """
+        Returns a dictionary of latency percentiles for each stage, or None if latency tracking is disabled
+        """
+        if self._latency is None:
+            return
+        return self._latency.summary()
+
+    def reset_latency(self):
+        if self._latency is not None:
+            self._latency.reset()
+
+    def broadcast_msg(self, msg: bytes, flags: int = 1, is_server_msg: bool = False, trace=None, exclude=None):
         if is_server_msg:
-            for client_id in self.list_clients():
-                self.send(client_id, utils.encode_msg(b"SERVER", msg, flags))
-        else:
-            for client_id in self.list_clients():
-                self.send(client_id, msg)
+            msg = utils.encode_msg(b"SERVER", msg, flags)
+        frame, priority = encode_frame(msg), classify(msg) # Every recipient's outbox shares the one frame
+        for client_id, client in self._connected_clients.items(): # A snapshot, so no lock is needed
+            if client_id == exclude:
+                continue
+            if trace is None:
+                client.send_frame(frame, priority) # False if it disconnected during the broadcast
+                continue
+            on_sent = self._latency.expect_send(trace, client_id) # Called by the outbox once the frame is written
+            if not client.send_frame(frame, priority, on_sent):
+                on_sent(False)
+        for spectator in self._spectators.values(): # Never excluded or traced (see spectators.py)
+            spectator.send_frame(frame, priority)
+
+    def send_direct_msg(self, sender_id, msg: bytes, recipients, trace=None):
+        """
+        Sends a message only to the clients with the given usernames and echoes it back to the sender. If any of the
+        recipients are not in the room, the sender is told with a SERVERMSG.
+        """
+        targets = {sender_id}
+        unknown = []
+        for recipient in recipients:
+            client_id = self.get_client_id(recipient)
+            if client_id is None:
+                unknown.append(recipient)
+            else:
+                targets.add(client_id)
+        frame, priority = encode_frame(msg), classify(msg)
+        for client_id in targets:
+            on_sent = None if trace is None else self._latency.expect_send(trace, client_id)
+            try:
+                sent = self.send_frame(client_id, frame, priority, on_sent)
+            except KeyError: # Client disconnected while the message was being routed
+                sent = False
+            if not sent and on_sent is not None:
+                on_sent(False)
+        if unknown:
+            try:
+                self.send(sender_id, utils.encode_msg(b"SERVER", bytes(f"SERVERMSG:{', '.join(unknown)} "
+                                                                       f"is not in the chat room", "utf-8"), 4))
+            except KeyError:
+                pass
+
+    def announce_media(self, username: str, data: bytes, trace=None):
+        """
+        Stores a multimedia message's file and broadcasts a media announcement in its place
+        """
+        filename, file_data = utils.decode_multimedia_body(data)
+        digest = self._media_store.store(filename, file_data, username)
+        thumbnail = self._media_store.make_thumbnail(filename, file_data)
+        announcement = utils.encode_media_announcement(filename, len(file_data), digest, thumbnail)
+        self.broadcast_msg(utils.encode_msg(bytes(username, 'utf-8'), announcement, 32), trace=trace)
+
+    def _update_connected_clients(self, client_id, client):
+        """
+        Same as TCPServer._update_connected_clients(), but the table is copied rather than changed (see CLIENT TABLES)
+        """
+        with self._connected_clients_lock:
+            self._connected_clients = {**self._connected_clients, client_id: client}
+
+    def _remove_connected_clients(self, client_ids):
+        """
+        Removes clients from the table, and returns the ones that were in it
+        """
+        with self._connected_clients_lock:
+            clients = dict(self._connected_clients)
+            removed = [clients.pop(client_id) for client_id in client_ids if client_id in clients]
+            self._connected_clients = clients
+        return removed
+
+    def _find_client(self, client_id):
+        """
+        Returns the connection of a member or spectator, or None if it isn't connected
+        """
+        client = self._connected_clients.get(client_id)
+        if client is None:
+            return self._spectators.get(client_id)
+        return client
+
+    def _get_client(self, client_id):
+        client = self._find_client(client_id)
+        if client is None:
+            raise KeyError(f"Could not find client with id #{client_id}")
+        return client
+
+    @property
+    def client_count(self):
+        return len(self._connected_clients)
+
+    def list_clients(self):
+        return list(self._connected_clients)
+
+    @property
+    def spectator_count(self):
+        return len(self._spectators)
+
+    def list_spectators(self):
+        return self._spectators.ids()
+
+    def remove_spectator(self, client_id):
+        """
+        Disconnects a spectator. Raises KeyError if it is not connected.
+        """
+        spectator = self._spectators.remove(client_id)
+        if spectator is None:
+            raise KeyError(client_id)
+        self._heartbeat.remove(client_id)
+        if spectator.is_running:
+            spectator.stop(suppress_callback=True)
+        logger.info("Spectator %s has been disconnected.", client_id)
+
+    def disconnect_client(self, client_id):
+        """
+        Same as TCPServer.disconnect_client(), but the table is copied rather than changed. Raises KeyError if the client
+        is not found.
+        """
+        removed = self._remove_connected_clients((client_id,))
+        if not removed:
+            raise KeyError(client_id)
+        if removed[0].is_running:
+            removed[0].stop(suppress_callback=True)
+        logger.info("Client %s has been disconnected.", client_id)
+
+    def kick_client(self, client_id):
+        """
+        Sends a client KICKED and disconnects it once it has been sent (or after KICK_TIMEOUT). If it was a member, the
+        room is told that it left. Raises KeyError if the client is not connected.
+        """
+        client = self._get_client(client_id)
+        if client.send(utils.encode_msg(b"SERVER", b"KICKED:", 4)):
+            client.outbox.flush(KICK_TIMEOUT)
+        if client_id in self._spectators:
+            try:
+                self.remove_spectator(client_id)
+            except KeyError: # Disconnected while KICKED was being sent
+                pass
+            return
+        username = self.get_username(client_id)
+        try:
+            self.disconnect_client(client_id)
+        except KeyError:
+            pass
+        if self.unregister_username(client_id): # False if its disconnection has already been routed
+            self._presence.left(username)
+
+    def send(self, client_id, data: bytes) -> bool:
+        """
+        Queues a message in the client's outbox (see outbox.py). Returns False if the client isn't taking messages.
+        Raises KeyError if the client could not be found.
+        """
+        return self._get_client(client_id).send(data)
+
+    def send_frame(self, client_id, frame: bytes, priority: int, on_sent=None) -> bool:
+        """
+        Like send(), but the message already has its 4 byte header, so the same frame can be queued for many clients.
+        `on_sent` is called once the frame has been written (see Outbox.put()).
+        """
+        return self._get_client(client_id).send_frame(frame, priority, on_sent)
+
+    def send_file(self, client_id, header: bytes, file, size: int):
+        """
+        Like send(), but the message is `header` followed by `size` bytes read from `file`. The file is sent straight
+        to the client's socket instead of being read into memory first, and is closed once it has been. If False is
+        returned (or KeyError raised), the caller still has to close it.
+        """
+        return self._get_client(client_id).send_file(header, file, size)
+
+    def send_media(self, client_id, digest: str):
+        """
+        Sends a stored file to a client as a multimedia message
+        """
+        media = self._media_store.open(digest)
+        try:
+            if media is None:
+                self.send(client_id, utils.encode_msg(b"SERVER", b"SERVERMSG:That file is no longer available", 4))
+                return
+            filename, size, sender, file = media
+            try:
+                sent = self.send_file(client_id, utils.encode_multimedia_header(bytes(sender, 'utf-8'), filename,
+                                                                                size), file, size)
+            except KeyError:
+                sent = False
+            if not sent:
+                file.close()
+        except KeyError:
+            pass
+
+    def send_ping(self, client_id, data: bytes):
+        """
+        Queues a ping (see heartbeat.py) ahead of everything but other info messages. Returns True if it was queued,
+        False if the client isn't taking messages, or None if it is queued behind a message that is still being
+        written, in which case the client can't be blamed for not answering until that has been sent.
+        """
+        frame = encode_frame(utils.encode_msg(b"SERVER", data, 4))
+        client = self._find_client(client_id)
+        if client is None:
+            return False
+        busy = client.outbox.is_writing
+        if not client.send_frame(frame, CONTROL):
+            return False
+        return None if busy else True
+
+    def evict_client(self, client_id):
+        """
+        Shuts down the connection of a client that has stopped responding. Its receive loop then stops and the room is
+        told that it LEFT, the same as if it had closed the connection itself. Shutting the socket down also stops a
+        write to it that is stuck because the client stopped reading.
+        """
+        client = self._find_client(client_id)
+        try:
+            client.socket.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError): # Already gone
+            pass
+
+    def send_stalled(self, client_id):
+        """
+        Returns how many seconds a send to the client has gone without making progress, because it isn't reading what
+        it has been sent, or 0 if nothing is being sent to it
+        """
+        client = self._find_client(client_id)
+        if client is None:
+            return 0
+        return client.outbox.stalled_for
+
+    def queue_delay_summary(self):
+        """
+        Returns a summary (see LatencyHistogram.summary()) of how long messages waited in client outboxes before being
+        written, for each priority class
+        """
+        return self._queue_delays.summary()
+
+    def reset_queue_delays(self):
+        self._queue_delays.reset()
+
+    def presence_stats(self):
+        """
+        Returns a dictionary of how many batches of joins and leaves have been broadcast (see Presence.stats())
+        """
+        return self._presence.stats()
+
+    def outbox_backlog(self):
+        """
+        Returns the total number of bytes waiting in client outboxes
+        """
+        return sum(client.outbox.size for client in self._all_clients())
+
+    def last_received(self, client_id):
+        """
+        Returns the time.monotonic() time that anything was last received from the client, or None if it is not
+        connected
+        """
+        client = self._find_client(client_id)
+        if client is None or not client.is_running:
+            return
+        return client.last_received
+
+    def client_rtt(self, client_id):
+        """
+        Returns the client's smoothed round trip time (in seconds) measured from pings, or None if it isn't known yet
+        """
+        return self._heartbeat.rtt(client_id)
+
+    def _stop_accepting(self, timeout):
+        """
+        Stops the accept loop without closing the listening socket. Returns False (and carries on accepting) if it
+        did not stop within `timeout` seconds.
+        """
+        self._accepting = False
+        if self._accept_stopped.wait(timeout):
+            return True
+        self._accepting = True
+        return False
+
+    def _all_clients(self):
+        """
+        Returns a list of the connections of every member and spectator
+        """
+        return list(self._connected_clients.values()) + list(self._spectators.values())
+
+    @staticmethod
+    def _detach_clients(clients):
+        """
+        Detaches every processor in `clients` and returns their parser states. Every receive loop is told to stop
+        before any of them are waited on, so this takes POLL_INTERVAL at most instead of POLL_INTERVAL per client.
+        """
+        for client in clients:
+            client.stop_reading()
+        return [client.detach() for client in clients]
+
+    def stop(self):
+        """
+        Same as TCPServer.stop(), but every connection is shut down first, which wakes its receive loop straight away
+        instead of waiting up to POLL_INTERVAL for each client in turn. The client table is replaced rather than
+        cleared, since broadcasts may still be going through it.
+        """
+        self._heartbeat.stop()
+        self._presence.stop()
+        if not self.is_running:
+            return
+        self._set_is_running(False)
+        with self._connected_clients_lock:
+            clients = list(self._connected_clients.values())
+            self._connected_clients = {}
+        clients += self._spectators.clear()
+        for client in clients:
+            client.stop_reading()
+            try:
+                client.socket.shutdown(socket.SHUT_RDWR)
+            except (AttributeError, OSError): # Already closed
+                pass
+        for client in clients:
+            client.stop(suppress_callback=True)
+        self._soc.close()
+        self._soc = None
+        self._addr = None
+        logger.info("Server has been stopped")
+
+    @staticmethod
+    def _flush_outboxes(clients, deadline):
+        """
+        Waits until `deadline` (a time.monotonic() time) for everything queued for `clients` to be sent. Every outbox
+        is written by its own thread, so this takes as long as the slowest client rather than all of them in turn.
+        Returns the clients that are still connected but were not sent everything.
+        """
+        return [client for client in clients
+                if not client.outbox.flush(max(deadline - time.monotonic(), 0)) and client.is_running]
+
+    def _route_backlog(self, deadline):
+        """
+        Waits until every message in the queue has been routed, or until `deadline` (a time.monotonic() time). Returns
+        the number of messages that were not routed in time, which are discarded.
+        """
+        with self._messages.all_tasks_done:
+            while self._messages.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._messages.all_tasks_done.wait(remaining)
+        dropped = 0
+        while True:
+            try:
+                self._messages.get_nowait()
+            except queue.Empty:
+                return dropped
+            self._messages.task_done()
+            dropped += 1
+
+    @staticmethod
+    def _close_gracefully(clients, deadline):
+        """
+        Closes the server's side of every connection at once and waits until `deadline` (a time.monotonic() time) for
+        each client to close its side, which it does once it has read everything that was sent to it. Closing a
+        socket with unread data in it resets the connection and can throw away data still on its way to the client,
+        so anything that arrives in the meantime is read and discarded. Returns a tuple of the number of connections
+        that were closed by their client before the deadline and the number that were not.
+        """
+        selector = selectors.DefaultSelector()
+        for client in clients:
+            try:
+                client.socket.shutdown(socket.SHUT_WR)
+                selector.register(client.socket, selectors.EVENT_READ)
+            except (AttributeError, ValueError, OSError): # Already closed
+                continue
+        closed = 0
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                try:
+                    data = key.fileobj.recv(65536)
+                except OSError:
+                    data = b""
+                if not data:
+                    selector.unregister(key.fileobj)
+                    closed += 1
+        cut_off = len(selector.get_map())
+        selector.close()
+        return closed, cut_off
+
+    def drain(self, timeout=DRAIN_TIMEOUT, notice="The server is shutting down"):
+        """
+        Stops the server without losing messages that are already on their way:
+            1.) Stops accepting connections and stops reading from clients
+            2.) Sends every client `notice` as a SERVERMSG and routes every message that was already read
+            3.) Waits for everything queued for each client to be written, then closes every connection at once, and
+                waits for each client to read everything that was sent to it
+        Anything left when `timeout` seconds have passed is dropped. Returns a dictionary with the number of messages
+        that were routed ("flushed") and dropped ("dropped"), and the number of connections that were closed cleanly
+        ("closed") or cut off at the deadline ("cut_off").
+        """
+        report = {"flushed": 0, "dropped": 0, "closed": 0, "cut_off": 0}
+        if not self.is_running:
+            return report
+        deadline = time.monotonic() + timeout
+        self._heartbeat.stop()
+        # Tell the accept loop and every receive loop to stop before waiting on any of them
+        self._accepting = False
+        for client in self._all_clients():
+            client.stop_reading()
+        self._accept_stopped.wait(timeout)
+        if notice:
+            self.broadcast_msg(bytes(f"SERVERMSG:{notice}", "utf-8"), flags=4, is_server_msg=True)
+        clients = self._all_clients()
+        self._detach_clients(clients)
+        pending = self._messages.unfinished_tasks
+        dropped = self._route_backlog(deadline)
+        report["flushed"] = pending - dropped
+        report["dropped"] = dropped + sum(1 for client in clients if client.has_partial_msg)
+        clients = self._all_clients() # Some may have disconnected while the backlog was routed
+        self._presence.flush() # Whoever left while the backlog was routed
+        self._flush_outboxes(clients, deadline)
+        report["closed"], report["cut_off"] = self._close_gracefully(clients, deadline)
+        self.stop()
+        logger.info("Drained the server: routed %d message(s) and dropped %d, %d connection(s) closed cleanly and %d "
+                    "cut off", report["flushed"], report["dropped"], report["closed"], report["cut_off"])
+        return report
+
+    def hand_off(self, path=handoff.DEFAULT_HANDOFF_PATH, timeout=handoff.HANDOFF_TIMEOUT):
+        """
+        Hands the listening socket, every client connection, and the username table over to a new server process that
+        calls take_over() with the same path (see handoff.py). Clients stay connected throughout, and everything
+        already read from them is routed by this server first. Returns True if the new server took over, after which
+        this server is stopped. Otherwise this server carries on as before.
+        """
+        if not self.is_running:
+            return False
+        conn = handoff.wait_for_takeover(path, timeout)
+        if conn is None:
+            logger.warning("No server connected to %s to take over", path)
+            return False
+        with conn:
+            if not self._stop_accepting(timeout):
+                logger.error("Could not stop accepting connections for the handoff")
+                return False
+            self._heartbeat.stop() # Detached clients can't answer pings
+            clients = self._all_clients()
+            parser_states = self._detach_clients(clients)
+            self._messages.join()
+            self._presence.flush() # Joins and leaves still waiting to be batched would otherwise be lost
+            # Everything routed so far has to be written before the sockets change hands. Clients that can't take it
+            # in time are left behind (and disconnected), and the new server tells the room they LEFT.
+            left_behind = {client.id for client in self._flush_outboxes(clients, time.monotonic() + timeout)}
+            # Clients that disconnected during the handoff have been routed and removed by now
+            handed_over = [(client, parser_state) for client, parser_state in zip(clients, parser_states)
+                           if client.is_running and client.socket is not None and client.id not in left_behind]
+            state = {
+                "addr": list(self._addr),
+                "clients": [{"id": client.id, "username": self.get_username(client.id), "parser": parser_state,
+                             "spectator": client.id in self._spectators} for client, parser_state in handed_over],
+                "left": [username for username in map(self.get_username, left_behind) if username is not None],
+                "media": self._media_store.list_entries() if self._media_store is not None else []
+            }
+            fds = [self._soc.fileno()] + [client.socket.fileno() for client, _ in handed_over]
+            try:
+                taken_over = handoff.send_state(conn, state, fds)
+            except OSError:
+                taken_over = False
+        if not taken_over:
+            logger.error("The new server did not take over. Resuming")
+            for client in clients:
+                client.resume()
+                self._heartbeat.add(client.id)
+            self._heartbeat.start()
+            self._accepting = True
+            threading.Thread(target=self._mainloop, daemon=True, name="TCPServerMainLoop").start()
+            return False
+        self._remove_connected_clients([client.id for client, _ in handed_over])
+        for client, _ in handed_over:
+            self._spectators.remove(client.id)
+            client.release()
+        if left_behind:
+            logger.warning("%d client(s) could not be sent everything in time and were not handed over",
+                           len(left_behind))
+        logger.info("Handed %d connection(s) over to the new server", len(handed_over))
+        self.stop()
+        return True
+
+    def take_over(self, path=handoff.DEFAULT_HANDOFF_PATH, timeout=handoff.HANDOFF_TIMEOUT):
+        """
+        Starts the server with the listening socket and client connections of a running server that is waiting in
+        hand_off(), instead of binding a new socket. Raises ConnectionError if the handoff failed.
+        """
+        state, listener, client_socs, conn = handoff.receive_state(path, timeout)
+        self._soc = listener
+        self._addr = tuple(state["addr"])
+        if self._media_store is not None:
+            self._media_store.restore_entries(state["media"])
+        for client, client_soc in zip(state["clients"], client_socs):
+            spectator = client.get("spectator", False) # Not sent by servers from before spectators
+            if client["username"] is not None:
+                self.register_username(client["username"], client["id"])
+            client_proc = self._create_client_proc(client["id"], client_soc, spectator)
+            client_proc.restore_parser(client["parser"])
+            client_proc.start()
+            if spectator:
+                self._spectators.add(client_proc.id, client_proc)
+            else:
+                self._update_connected_clients(client_proc.id, client_proc)
+            self._heartbeat.add(client_proc.id)
+        self._accepting = True
+        self._set_is_running(True)
+        threading.Thread(target=self._mainloop, daemon=True, name="TCPServerMainLoop").start()
+        self._heartbeat.start()
+        self._presence.start()
+        for username in state["left"]:
+            self._presence.left(username)
+        handoff.confirm(conn)
+        logger.info("Took over %d connection(s) from the old server", len(client_socs))
 
     def process_msg_queue(self):
+        """
+        Routes messages while the server is running, with one thread per partition of the message queue (see
+        routing.py). The calling thread routes the first partition.
+        """
+        for partition in range(1, self._messages.num_partitions):
+            threading.Thread(target=self._route_partition, args=(partition,), daemon=True,
+                             name=f"PychatRouter#{partition}").start()
+        self._route_partition(0)
+
+    def _route_partition(self, partition):
         while self.is_running:
-            msg = self.pop_msg(block=True)
-            if msg is None: # Queue was empty
-                continue
-            username = self.get_username(msg.client_id)
-            if msg.size == 0: # Connection was closed
-                self.unregister_username(msg.client_id)
-                self.broadcast_msg(utils.encode_msg(b"", bytes(f"LEFT:{username}", "utf-8"), 4))
-                continue
-            msg_info = utils.decode_msg(msg.data)
-            client_info = self.get_client_attributes(msg.client_id)
-            logger.debug(f"MESSAGE FROM {username}@({client_info['addr'][0]}, {client_info['addr'][1]}):\n"
-                         f"    DATA SIZE: {msg_info['data_size']}\n"
-                         f"        FLAGS: {msg_info['flags']}\n")
-            if msg_info["flags"] == 8:
-                self.unregister_username(msg.client_id)
+            msg = self._messages.get_from(partition)
+            data = msg.data # route_msg() may replace it
+            try:
+                self.route_msg(msg)
+            except Exception: # One message that can't be routed mustn't stop the rest of the partition
+                logger.exception("Could not route a message from client %s", msg.client_id)
+            finally:
+                self._messages.task_done() # Lets hand_off() wait for the queue to be drained
+            if type(data) is memoryview: # Received into a pooled buffer
+                self._buffer_pool.release(data)
+
+    def route_spectator_msg(self, msg):
+        """
+        Spectators can only fetch media and disconnect (see spectators.py). Anything else they send is dropped.
+        """
+        if msg.size == 0: # Connection was closed. The spectator was removed when its processor stopped.
+            return
+        msg_info = utils.decode_msg(msg.data)
+        flags = msg_info["flags"]
+        if flags & 128:
+            _, msg_info["data"] = utils.strip_trace_timestamp(msg_info["data"])
+            flags &= ~128
+        if flags == 8:
+            try:
+                self.remove_spectator(msg.client_id)
+            except KeyError:
+                pass
+        elif flags == 4 and msg_info["data"][0:6] == b"FETCH:" and self._media_store is not None:
+            try:
+                self.send_media(msg.client_id, str(msg_info["data"][6:], 'utf-8'))
+            except UnicodeDecodeError:
+                logger.info("Dropped a FETCH with an invalid digest from spectator %s", msg.client_id)
+
+    def route_msg(self, msg):
+        username = self.get_username(msg.client_id)
+        if username is None: # A spectator, or a member that has already left
+            self.route_spectator_msg(msg)
+            return
+        if msg.size == 0: # Connection was closed
+            if self.unregister_username(msg.client_id): # False if the client already sent a disconnect message
+                self._presence.left(username)
+            return
+        msg_info = utils.decode_msg(msg.data)
+        trace = None
+        if msg_info["flags"] & 128:
+            client_send_time, msg_info["data"] = utils.strip_trace_timestamp(msg_info["data"])
+            msg_info["flags"] &= ~128
+            msg.data = utils.encode_msg(bytes(msg_info["username"], "utf-8"), msg_info["data"], msg_info["flags"])
+            if self._latency is not None:
+                trace = self._latency.start_trace(msg, client_send_time)
+        elif self._latency is not None:
+            trace = self._latency.start_trace(msg)
+        if logger.isEnabledFor(logging.DEBUG): # Skip the attribute lookups entirely unless they will be logged
+            try:
+                addr = self.get_client_attributes(msg.client_id)['addr']
+            except KeyError:
+                addr = (None, None)
+            logger.debug("MESSAGE FROM %s@(%s, %s):\n    DATA SIZE: %d\n        FLAGS: %d\n",
+                         username, addr[0], addr[1], msg_info['data_size'], msg_info['flags'])
+        try:
+            self._dispatch_msg(msg, username, msg_info, trace)
+        except ValueError as e: # e.g. recipients, a filename, or a digest that isn't valid UTF-8
+            logger.info("Dropped a malformed message (flags %d) from client %s: %s", msg_info["flags"], msg.client_id,
+                        e)
+
+    def _dispatch_msg(self, msg, username, msg_info, trace):
+        """
+        Routes a member's message by its flags. Raises ValueError if a part of the message that has to be decoded
+        (direct recipients, a multimedia filename, or a FETCH digest) is malformed.
+        """
+        if msg_info["flags"] == 8:
+            self.unregister_username(msg.client_id)
+            try:
                 self.disconnect_client(msg.client_id)
-                self.broadcast_msg(utils.encode_msg(b"", bytes(f"LEFT:{username}", "utf-8"), 4))
-            else:
-                self.broadcast_msg(msg.data)
+            except KeyError: # The connection may have already been closed by the client
+                pass
+            self._presence.left(username)
+        elif msg_info["flags"] & 2 and not self.check_file_size(msg.client_id, msg_info["flags"], msg_info["data"]):
+            pass # Dropped, the sender has been told why
+        elif msg_info["flags"] == 4 and msg_info["data"][0:6] == b"FETCH:" and self._media_store is not None:
+            self.send_media(msg.client_id, str(msg_info["data"][6:], 'utf-8'))
+        elif msg_info["flags"] == 2 and self._media_store is not None:
+            self.announce_media(username, msg_info["data"], trace=trace)
+            if trace is not None:
+                self._latency.finish_trace(trace)
+        elif msg_info["flags"] & 16:
+            recipients, _ = utils.decode_direct_body(msg_info["data"])
+            self.send_direct_msg(msg.client_id, msg.data, recipients, trace=trace)
+            if trace is not None:
+                self._latency.finish_trace(trace)
+        else:
+            self.broadcast_msg(msg.data, trace=trace)
+            if trace is not None:
+                self._latency.finish_trace(trace)
@@ -0,0 +1,276 @@
+"""
+Client processor (for pychat)
+Written by Joshua Kitchen - 2025
+
+Replaces TCPLib's ClientProcessor for pychat connections. Instead of reading one whole frame at a time with
+TCPClient.receive(), the receive loop reads whatever bytes are available and passes them to a FrameParser (see
+frame_parser.py), so oversized or malformed frames are rejected before their payload is buffered.
+
+Messages over the size limit for their type are skipped and `on_reject` is called with the flags, data size, and limit
+so the server can tell the sender. Replies to the server's pings ("PONG:<token>") are passed to `on_pong` as soon as
+they are read instead of going through the message queue, so that queueing doesn't count towards the round trip time
+(see heartbeat.py).
+
+Messages to the client are queued in an Outbox (see outbox.py) and written by a thread of its own, so send() never
+waits on the connection.
+
+Bytes are read with recv_into() into a buffer that belongs to the connection and is reused for every read. Given a
+BufferPool (see buffer_pool.py), large messages are put on the message queue as memoryviews of pooled buffers, which the
+server releases once they have been routed.
+"""
+
+import logging
+import selectors
+import socket
+import threading
+import time
+
+from TCPLib.client_processor import ClientProcessor
+from TCPLib.message import Message
+
+from frame_parser import FrameParser, MessageRejected, ProtocolError, DEFAULT_MAX_FRAME_SIZE, encode_frame
+from server.backend.outbox import Outbox, classify, DEFAULT_MAX_OUTBOX_SIZE
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.5 # How often (in seconds) receive loops check whether they should stop
+
+
+class PychatClientProcessor(ClientProcessor):
+    def __init__(self, *args, max_frame_size=DEFAULT_MAX_FRAME_SIZE, size_limits=None, on_reject=None, on_pong=None,
+                 queue_delays=None, max_outbox_size=DEFAULT_MAX_OUTBOX_SIZE, buffer_pool=None, **kwargs):
+        ClientProcessor.__init__(self, *args, **kwargs)
+        self._outbox = Outbox(self.socket, self._client_id, queue_delays, max_outbox_size)
+        self._parser = FrameParser(max_frame_size, size_limits=size_limits, pool=buffer_pool)
+        self._buffer_pool = buffer_pool
+        self._recv_buffer = bytearray(self._buff_size)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._on_reject = on_reject
+        self._on_pong = on_pong
+        self._detached = False
+        self._last_received = time.monotonic()
+
+    def _count_timeout(self):
+        """
+        Returns True if the client has timed out too many times and was disconnected
+        """
+        logger.warning("Timed out while receiving from %s @ %d", self.remote_addr[0], self.remote_addr[1])
+        with self._total_timeouts_lock:
+            self._total_timeouts += 1
+            if self._max_timeouts is None or self._total_timeouts < self._max_timeouts:
+                return False
+        logger.warning("Client %s timed out too many times. Disconnecting.", self._client_id)
+        self.stop()
+        return True
+
+    def _receive_loop(self):
+        """
+        Waits for data with a selector instead of blocking in recv() so that the loop can be paused by detach()
+        without losing any bytes. The socket's timeout is applied to the wait instead.
+        """
+        logger.debug("Client %s has started _receive_loop() and is listening for new messages from %s @ %d",
+                     self._client_id, self.remote_addr[0], self.remote_addr[1])
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(self.socket, selectors.EVENT_READ)
+        except (ValueError, OSError): # Closed by a failed send before the loop started
+            selector.close()
+            self.stop()
+            return
+        try:
+            while self.is_running and not self._detached:
+                if not selector.select(POLL_INTERVAL):
+                    # A failed send closes the socket, which a blocking recv() would have noticed but the selector
+                    # never will
+                    if self.socket is None:
+                        logger.debug("Connection to %s @ %d was closed", self.remote_addr[0], self.remote_addr[1])
+                        self.stop()
+                        return
+                    timeout = self._tcp_client.timeout
+                    if timeout is not None and time.monotonic() - self._last_received >= timeout:
+                        self._last_received = time.monotonic()
+                        if self._count_timeout():
+                            return
+                    continue
+                if self._detached:
+                    return
+                try:
+                    count = self.socket.recv_into(self._recv_buffer)
+                except AttributeError: # Socket was closed from another thread
+                    count = 0
+                except TimeoutError:
+                    if self._count_timeout():
+                        return
+                    continue
+                except ConnectionError:
+                    logger.debug("Receive loop for client #%s on %s @ %d was interrupted", self._client_id,
+                                 self.remote_addr[0], self.remote_addr[1])
+                    self.stop()
+                    return
+                except OSError:
+                    logger.exception("OS error while receiving from %s @ %d", self.remote_addr[0],
+                                     self.remote_addr[1])
+                    self.stop()
+                    return
+
+                if count == 0:
+                    logger.debug("Connection to %s @ %d was closed", self.remote_addr[0], self.remote_addr[1])
+                    self.stop()
+                    return
+
+                self._last_received = time.monotonic()
+                with self._total_timeouts_lock:
+                    self._total_timeouts = 0
+                try:
+                    events = self._parser.feed(self._recv_view[:count])
+                except ProtocolError as e:
+                    logger.warning("Disconnecting %s @ %d: %s", self.remote_addr[0], self.remote_addr[1], e)
+                    self.stop()
+                    return
+                self._handle_events(events)
+        finally:
+            selector.close()
+
+    def _start_thread(self):
+        self._thread = threading.Thread(target=self._receive_loop, daemon=True,
+                                        name=f"TCPServerClientProc#{self._client_id}")
+        self._thread.start()
+
+    def start(self):
+        """
+        Same as ClientProcessor.start(), but the processor counts as running as soon as this returns. ClientProcessor
+        only sets is_running once its thread gets going, and messages sent to the client before then were dropped.
+        """
+        if self.is_running:
+            return
+        self._set_is_running(True)
+        self._outbox.start()
+        self._start_thread()
+        logger.info("Processing connection to %s @ %d as client #%s", self.remote_addr[0], self.remote_addr[1],
+                    self._client_id)
+
+    def _handle_events(self, events):
+        for event in events:
+            if isinstance(event, MessageRejected):
+                logger.info("Rejected a %d byte message (flags %d) from %s @ %d", event.data_size, event.flags,
+                            self.remote_addr[0], self.remote_addr[1])
+                if self._on_reject is not None:
+                    self._on_reject(event.flags, event.data_size, event.limit)
+                continue
+            if self._on_pong is not None and event.flags == 4 and event.data[0:5] == b"PONG:":
+                self._on_pong(str(event.data[5:], 'utf-8', 'replace'))
+                continue
+            self._msg_q.put(Message(len(event.payload), event.payload, self._client_id))
+
+    def send(self, data: bytes) -> bool:
+        """
+        Queues a message for the client with a 4 byte header attached. Returns False if the client isn't taking
+        messages.
+        """
+        return self.send_frame(encode_frame(data), classify(data))
+
+    def send_frame(self, frame: bytes, priority: int, on_sent=None) -> bool:
+        """
+        Queues a message that already has its 4 byte header, so that one frame can be queued for many clients. The
+        outbox is closed when the processor stops, so is_running (which takes a lock) isn't checked. `on_sent` is
+        called once the frame has been written, if it was queued (see Outbox.put()).
+        """
+        if self._outbox.put(frame, priority, on_sent):
+            return True
+        self._outbox_refused()
+        return False
+
+    def send_file(self, header: bytes, file, size: int) -> bool:
+        """
+        Queues a media message made of `header` followed by `size` bytes of `file`, which is sent straight from the file
+        and closed once it has been. If False is returned, the caller still has to close the file.
+        """
+        if not self.is_running:
+            return False
+        if self._outbox.put_file((len(header) + size).to_bytes(4, "big") + header, file, size):
+            return True
+        self._outbox_refused()
+        return False
+
+    def _outbox_refused(self):
+        if self._outbox.is_closed:
+            return
+        logger.warning("Client %s has %d bytes waiting to be sent and is too far behind. Disconnecting.",
+                       self._client_id, self._outbox.size)
+        self._outbox.close()
+        try: # The receive loop then stops and the client is removed
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+    def stop(self, suppress_callback=False):
+        self._outbox.close()
+        if self.is_running and self._thread is not threading.current_thread():
+            try: # Wakes the receive loop, so ClientProcessor.stop() doesn't wait up to POLL_INTERVAL to join it
+                self.socket.shutdown(socket.SHUT_RD)
+            except (AttributeError, OSError): # Already closed
+                pass
+        ClientProcessor.stop(self, suppress_callback)
+
+    @property
+    def socket(self):
+        return self._tcp_client._soc
+
+    @property
+    def outbox(self):
+        return self._outbox
+
+    @property
+    def last_received(self):
+        """
+        The time.monotonic() time that anything was last received from the client
+        """
+        return self._last_received
+
+    @property
+    def has_partial_msg(self):
+        """
+        True if part of a message has been received but not the rest of it
+        """
+        return not self._parser.is_idle
+
+    def stop_reading(self):
+        """
+        Tells the receive loop to stop (within POLL_INTERVAL) without waiting for it or closing the connection. Lets
+        many processors be stopped at once before waiting on any of them with detach().
+        """
+        self._detached = True
+
+    def detach(self):
+        """
+        Stops reading from the client without closing the connection and returns the parser's state (see
+        FrameParser.save_state()). Used to hand the connection over to another process (see handoff.py).
+        """
+        self.stop_reading()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self._parser.save_state()
+
+    def resume(self):
+        """
+        Starts reading from the client again after detach()
+        """
+        if not self._detached or not self.is_running:
+            return
+        self._detached = False
+        self._start_thread()
+
+    def restore_parser(self, state):
+        """
+        Carries on parsing from the state of another processor's parser (see detach()). Must be called before start().
+        """
+        self._handle_events(self._parser.restore_state(state))
+
+    def release(self):
+        """
+        Closes this process's copy of the socket after detach(). The connection stays open in the process it was
+        handed to.
+        """
+        self._set_is_running(False)
+        self._outbox.close()
+        self._tcp_client.disconnect()
@@ -0,0 +1,105 @@
+"""
+Connection handoff (for pychat)
+Written by Joshua Kitchen - 2025
+
+Moves a running server's sockets to a new server process so the server can be upgraded or restarted without
+disconnecting anyone. The old server listens on a Unix socket and the new server (started with --takeover) connects to
+it. The old server then sends:
+    1.) The server's state as JSON, framed with a 4 byte size header
+    2.) The listening socket, followed by every client's socket (in the order of the state's client list), passed as
+        file descriptors (SCM_RIGHTS) at most MAX_FDS_PER_MSG at a time, each batch attached to a single byte
+
+The new server replies with b"OK" once it has taken over. Until then the old server can carry on if anything goes wrong.
+
+File descriptor passing needs Unix sockets, so this only works on Unix-like systems.
+"""
+
+import json
+import os
+import socket
+
+DEFAULT_HANDOFF_PATH = ".pychat_handoff"
+HANDOFF_TIMEOUT = 60
+MAX_FDS_PER_MSG = 200 # Linux allows at most 253 per message
+
+
+def is_supported():
+    return hasattr(socket, "send_fds") and hasattr(socket, "AF_UNIX")
+
+
+def _recv_exactly(conn, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The other server closed the handoff connection")
+        data.extend(chunk)
+    return data
+
+
+def wait_for_takeover(path, timeout=HANDOFF_TIMEOUT):
+    """
+    Listens on the Unix socket at `path` until a new server connects. Returns the connection, or None if no server
+    connected within `timeout` seconds.
+    """
+    if os.path.exists(path): # Left over from a handoff that didn't finish
+        os.remove(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.bind(path)
+        listener.listen(1)
+        listener.settimeout(timeout)
+        try:
+            conn, _ = listener.accept()
+        except TimeoutError:
+            return
+    finally:
+        listener.close()
+        if os.path.exists(path):
+            os.remove(path)
+    conn.settimeout(timeout)
+    return conn
+
+
+def send_state(conn, state: dict, fds):
+    """
+    Sends the server's state and sockets to the new server and waits for it to confirm. Returns True if it did.
+    """
+    state = bytes(json.dumps(state), "utf-8")
+    conn.sendall(len(state).to_bytes(4, "big") + state)
+    for i in range(0, len(fds), MAX_FDS_PER_MSG):
+        socket.send_fds(conn, [b"F"], fds[i:i + MAX_FDS_PER_MSG])
+    try:
+        return _recv_exactly(conn, 2) == b"OK"
+    except (ConnectionError, TimeoutError):
+        return False
+
+
+def receive_state(path, timeout=HANDOFF_TIMEOUT):
+    """
+    Connects to the old server at `path` and returns a tuple of its state, its listening socket, its client sockets,
+    and the connection (to confirm the takeover on with confirm()). Raises ConnectionError if the handoff failed.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        conn.connect(path)
+        size = int.from_bytes(_recv_exactly(conn, 4), "big")
+        state = json.loads(str(_recv_exactly(conn, size), "utf-8"))
+        fds = []
+        while len(fds) < len(state["clients"]) + 1:
+            msg, new_fds, _, _ = socket.recv_fds(conn, 1, MAX_FDS_PER_MSG)
+            if not msg:
+                raise ConnectionError("The old server closed the handoff connection")
+            fds.extend(new_fds)
+    except (OSError, ValueError) as e:
+        conn.close()
+        raise ConnectionError(f"Could not take over from the server at {path}: {e}")
+    listener = socket.socket(fileno=fds[0])
+    clients = [socket.socket(fileno=fd) for fd in fds[1:]]
+    return state, listener, clients, conn
+
+
+def confirm(conn):
+    with conn:
+        conn.sendall(b"OK")
@@ -0,0 +1,191 @@
+"""
+Heartbeat (for pychat)
+Written by Joshua Kitchen - 2025
+
+Pings every client and evicts clients that have gone quiet, so that half-open connections (e.g. a laptop that went to
+sleep) don't hold a slot, a username, and a thread until the OS gives up on them.
+
+Every `ping_interval` seconds each client is sent the info message "PING:<token>:<idle timeout>", and replies with
+"PONG:<token>". The time between the two is the client's round trip time. A client that sends nothing at all (not even
+a PONG) for `idle_timeout` seconds is evicted, and the rest of the room is told it LEFT. So is a client that has
+stopped reading, once a send to it has been stuck for `idle_timeout` seconds.
+
+A ping can be queued behind a large message that the client is still reading (see outbox.py). Time that a client
+couldn't be sent a ping for that reason doesn't count towards its idle time.
+
+Rather than a timer per connection, every client is kept in a single timer wheel (see TimerWheel) that one thread
+advances once per tick. When a client's slot comes round, its state is checked and it is put back into the wheel for
+whenever it is next due, so traffic on a connection never has to touch the wheel.
+"""
+
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PING_INTERVAL = 15
+DEFAULT_IDLE_TIMEOUT = 45
+TICK = 0.5 # Seconds between turns of the timer wheel. Pings and evictions are late by up to this much.
+RTT_GAIN = 0.125 # Weight of each new sample in the smoothed round trip time (the same as TCP's)
+
+
+class TimerWheel:
+    """
+    A hashed timer wheel. Keys are put into the slot `delay` ticks ahead of the current one, and advance() moves on
+    one slot and returns every key in it. Delays are capped at one turn of the wheel.
+    """
+    def __init__(self, num_slots):
+        self._slots = [set() for _ in range(num_slots)]
+        self._current = 0
+        self._lock = threading.Lock()
+
+    def schedule(self, key, ticks):
+        ticks = min(max(ticks, 1), len(self._slots) - 1)
+        with self._lock:
+            self._slots[(self._current + ticks) % len(self._slots)].add(key)
+
+    def advance(self):
+        with self._lock:
+            self._current = (self._current + 1) % len(self._slots)
+            expired = self._slots[self._current]
+            self._slots[self._current] = set()
+        return expired
+
+
+class Heartbeat:
+    """
+    `server` must have:
+        - send_ping(client_id, data), which returns True if the ping was sent, False if the client wasn't taking it,
+          or None if it won't be sent until something else has been
+        - evict_client(client_id)
+        - last_received(client_id), which returns the time.monotonic() time that anything was last received from the
+          client, or None once the client is gone
+        - send_stalled(client_id), which returns how many seconds a send to the client has been blocked for
+    Either `ping_interval` or `idle_timeout` may be 0 to turn it off.
+    """
+    def __init__(self, server, ping_interval=DEFAULT_PING_INTERVAL, idle_timeout=DEFAULT_IDLE_TIMEOUT, tick=TICK):
+        if ping_interval and idle_timeout and idle_timeout <= ping_interval:
+            raise ValueError("idle_timeout must be longer than ping_interval")
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self._server = server
+        self._tick = tick
+        self._wheel = TimerWheel(math.ceil(max(ping_interval, idle_timeout) / tick) + 2)
+        # client_id -> [last ping time, token of the unanswered ping, smoothed RTT, last time a ping was held up]
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def is_enabled(self):
+        return bool(self.ping_interval or self.idle_timeout)
+
+    def start(self):
+        if not self.is_enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="PychatHeartbeat")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        with self._clients_lock:
+            self._clients.clear()
+
+    def add(self, client_id):
+        if not self.is_enabled:
+            return
+        with self._clients_lock:
+            self._clients[client_id] = [time.monotonic(), None, None, 0]
+        self._wheel.schedule(client_id, self._ticks_until_due(0, 0))
+
+    def remove(self, client_id):
+        """
+        Forgets a client. Its slot in the wheel is dropped the next time it comes round.
+        """
+        with self._clients_lock:
+            self._clients.pop(client_id, None)
+
+    def rtt(self, client_id):
+        """
+        Returns the client's smoothed round trip time in seconds, or None if it hasn't answered a ping yet
+        """
+        with self._clients_lock:
+            try:
+                return self._clients[client_id][2]
+            except KeyError:
+                return
+
+    def record_pong(self, client_id, token: str):
+        """
+        Called when a client answers a ping. Answers that don't match the last ping sent to the client are ignored.
+        """
+        now = time.monotonic_ns()
+        with self._clients_lock:
+            try:
+                state = self._clients[client_id]
+            except KeyError:
+                return
+            if state[1] is None or token != state[1]:
+                return
+            state[1] = None
+            sample = (now - int(token)) / 1e9
+            state[2] = sample if state[2] is None else state[2] + RTT_GAIN * (sample - state[2])
+
+    def _ticks_until_due(self, since_ping, idle):
+        due = math.inf
+        if self.ping_interval:
+            due = self.ping_interval - since_ping
+        if self.idle_timeout:
+            due = min(due, self.idle_timeout - idle)
+        return math.ceil(due / self._tick)
+
+    def _check(self, client_id):
+        """
+        Evicts or pings the client if either is due, and puts it back in the wheel for when the next one is
+        """
+        last_received = self._server.last_received(client_id)
+        with self._clients_lock:
+            state = self._clients.get(client_id)
+        if state is None or last_received is None:
+            self.remove(client_id)
+            return
+        now = time.monotonic()
+        idle = now - max(last_received, state[3])
+        if self.idle_timeout:
+            stalled = self._server.send_stalled(client_id)
+            if idle >= self.idle_timeout or stalled >= self.idle_timeout:
+                if stalled >= self.idle_timeout:
+                    logger.warning("Client %s has read nothing for %.0f seconds. Evicting it.", client_id, stalled)
+                else:
+                    logger.warning("Client %s has sent nothing for %.0f seconds. Evicting it.", client_id, idle)
+                self.remove(client_id)
+                self._server.evict_client(client_id)
+                return
+        if self.ping_interval and now - state[0] >= self.ping_interval:
+            token = str(time.monotonic_ns())
+            held_up = self._server.send_ping(client_id, bytes(f"PING:{token}:{self.idle_timeout:g}", "utf-8")) is None
+            with self._clients_lock:
+                state[0] = now
+                state[1] = token
+                if held_up: # Not the client's fault, so its idle time starts again
+                    state[3] = now
+            if held_up:
+                idle = 0
+        self._wheel.schedule(client_id, self._ticks_until_due(now - state[0], idle))
+
+    def _run(self):
+        next_tick = time.monotonic() + self._tick
+        while not self._stop.wait(max(next_tick - time.monotonic(), 0)):
+            next_tick += self._tick
+            for client_id in self._wheel.advance():
+                try:
+                    self._check(client_id)
+                except Exception:
+                    logger.exception("Heartbeat check failed for client %s", client_id)
@@ -0,0 +1,171 @@
+"""
+Latency tracking (for pychat)
+Written by Joshua Kitchen - 2025
+
+Tracks how long relayed messages spend in each stage of the server:
+
+    client_send ---> server_recv ---> dequeue ---> recipient send complete
+         |  'network'     |   'queue'     |     'fanout'     |
+         |                |------------------ 'server' ------|
+         |------------------------ 'end_to_end' -------------|
+
+A send is complete once the recipient's outbox has written the whole message to its socket (see outbox.py), so
+'fanout' includes the time the message waited in the outbox. Sends that were never completed (the recipient
+disconnected or fell too far behind) are left out of the histograms.
+
+The 'network' and 'end_to_end' stages are only available for messages sent with the trace flag (128), since the
+client's send timestamp is carried in the message body. Comparing it against the server's clock only makes sense when
+the clocks of the client and server are synchronized (or they are on the same host).
+"""
+
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+
+trace_logger = logging.getLogger("pychat.trace")
+
+STAGES = ("network", "queue", "fanout", "server", "end_to_end")
+
+
+class LatencyHistogram:
+    """
+    Fixed-size histogram of latencies with logarithmically spaced buckets between 1 microsecond and ~17 seconds.
+    Percentiles are approximated by the upper bound of the bucket they fall in (error is at most ~19%).
+    """
+    BUCKETS = [1e-6 * (1.1892 ** i) for i in range(97)]  # Four buckets per doubling
+
+    def __init__(self):
+        self._counts = [0] * (len(self.BUCKETS) + 1)
+        self._total = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def record(self, seconds: float, count: int = 1):
+        if seconds < 0:  # Clocks may be slightly out of sync
+            seconds = 0.0
+        self._counts[bisect.bisect_left(self.BUCKETS, seconds)] += count
+        self._total += count
+        self._sum += seconds * count
+        if seconds > self._max:
+            self._max = seconds
+
+    @property
+    def count(self):
+        return self._total
+
+    def percentile(self, p: float):
+        if self._total == 0:
+            return 0.0
+        rank = p / 100 * self._total
+        seen = 0
+        for i, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank and count > 0:
+                if i == len(self.BUCKETS):
+                    return self._max
+                return min(self.BUCKETS[i], self._max)
+        return self._max
+
+    def summary(self):
+        return {
+            "count": self._total,
+            "mean": self._sum / self._total if self._total else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self._max
+        }
+
+
+class LatencyTracker:
+    """
+    Aggregates per-stage latencies of relayed messages into histograms. A fraction of messages (`sample_rate`) also
+    have their full trace written as a JSON object to the 'pychat.trace' logger.
+    """
+    def __init__(self, sample_rate: float = 0.0):
+        if sample_rate < 0 or sample_rate > 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+        self._histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def start_trace(self, msg, client_send_time=None):
+        """
+        Called when a message is popped off of the message queue. Returns a trace dictionary that should be passed to
+        expect_send() for each recipient, and to finish_trace() once the message has been routed.
+        """
+        now = time.time()
+        recv_time = getattr(msg, "recv_time", now)
+        return {
+            "client_id": msg.client_id,
+            "size": msg.size,
+            "client_send": client_send_time,
+            "server_recv": recv_time,
+            "dequeue": now,
+            "sends": [],
+            "pending": 0, # Sends that haven't been reported yet
+            "routed": False,
+            "sampled": self.sample_rate > 0 and random.random() < self.sample_rate
+        }
+
+    def expect_send(self, trace, client_id):
+        """
+        Called for each recipient the message is queued for. Returns a function for the recipient's outbox to call with
+        True once the message has been written to the socket, or False if it never will be.
+        """
+        with self._lock:
+            trace["pending"] += 1
+
+        def on_sent(success):
+            send_time = time.time()
+            with self._lock:
+                trace["sends"].append((client_id, send_time, success))
+                trace["pending"] -= 1
+                done = trace["routed"] and not trace["pending"]
+            if done:
+                self._record(trace)
+        return on_sent
+
+    def finish_trace(self, trace):
+        """
+        Called once the message has been routed. The trace is recorded once every send has been reported as well.
+        """
+        with self._lock:
+            trace["routed"] = True
+            done = not trace["pending"]
+        if done:
+            self._record(trace)
+
+    def _record(self, trace):
+        with self._lock:
+            if trace["client_send"] is not None:
+                self._histograms["network"].record(trace["server_recv"] - trace["client_send"])
+            self._histograms["queue"].record(trace["dequeue"] - trace["server_recv"])
+            for _, send_time, success in trace["sends"]:
+                if not success:
+                    continue
+                self._histograms["fanout"].record(send_time - trace["dequeue"])
+                self._histograms["server"].record(send_time - trace["server_recv"])
+                if trace["client_send"] is not None:
+                    self._histograms["end_to_end"].record(send_time - trace["client_send"])
+        if trace["sampled"] and trace_logger.isEnabledFor(logging.INFO):
+            trace_logger.info(json.dumps({
+                "client_id": trace["client_id"],
+                "size": trace["size"],
+                "client_send": trace["client_send"],
+                "server_recv": trace["server_recv"],
+                "dequeue": trace["dequeue"],
+                "sends": [{"client_id": c, "done": t, "ok": ok} for c, t, ok in trace["sends"]]
+            }))
+
+    def summary(self):
+        with self._lock:
+            return {stage: hist.summary() for stage, hist in self._histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {stage: LatencyHistogram() for stage in STAGES}
+
@@ -0,0 +1,164 @@
+"""
+Media store (for pychat)
+Written by Joshua Kitchen - 2025
+
+Holds the images and MP3s that clients have shared so they can be downloaded on demand instead of being pushed to
+every member of the room. Files are stored on disk under their SHA-256 hash, so identical uploads are only stored once.
+When the store grows past `max_size` bytes, the least recently used files are removed.
+
+Stored files are sent to clients straight from disk by their outboxes (see send_file_chunks() and outbox.py), so
+serving a download never reads the file into memory.
+"""
+
+import hashlib
+import io
+import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError: # Thumbnails are optional
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "gif"]
+
+
+class MediaStore:
+    def __init__(self, store_dir=".media_store", max_size=1_073_741_824, thumbnail_size=(160, 120)):
+        self._store_dir = store_dir
+        self._max_size = max_size
+        self._thumbnail_size = thumbnail_size
+        self._entries = OrderedDict() # SHA-256 hex digest -> (filename, size, sender)
+        self._total_size = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(self._store_dir):
+            os.mkdir(self._store_dir)
+
+    def clear(self):
+        """
+        Removes every file from the store, including any left over from a previous run
+        """
+        with self._lock:
+            self._entries.clear()
+            self._total_size = 0
+            for filename in os.listdir(self._store_dir):
+                os.remove(os.path.join(self._store_dir, filename))
+
+    def list_entries(self):
+        """
+        Returns a list of [digest, filename, size, sender] for every file, least recently used first
+        """
+        with self._lock:
+            return [[digest, *entry] for digest, entry in self._entries.items()]
+
+    def restore_entries(self, entries):
+        """
+        Takes over files that are already in the store directory, e.g. from a server that handed over to this one
+        (see list_entries())
+        """
+        with self._lock:
+            for digest, filename, size, sender in entries:
+                if os.path.exists(self._path(digest)):
+                    self._entries[digest] = (filename, size, sender)
+                    self._total_size += size
+
+    def _path(self, digest):
+        return os.path.join(self._store_dir, digest)
+
+    def _evict(self):
+        while self._total_size > self._max_size and len(self._entries) > 1:
+            digest, (_, size, _) = self._entries.popitem(last=False)
+            self._total_size -= size
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                logger.warning("Could not remove %s from the media store", digest)
+
+    def store(self, filename: str, data: bytes, sender: str):
+        """
+        Stores the file and returns its SHA-256 digest (as bytes)
+        """
+        digest = hashlib.sha256(data).digest()
+        with self._lock:
+            if digest.hex() in self._entries:
+                self._entries.move_to_end(digest.hex())
+                return digest
+        # Messages from different clients are stored in parallel (see routing.py), so the same file can be stored
+        # twice at once. Each copy is written under its own name and moved into place, so the file is never seen half
+        # written.
+        path = self._path(digest.hex())
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            if digest.hex() not in self._entries:
+                self._entries[digest.hex()] = (filename, len(data), sender)
+                self._total_size += len(data)
+                self._evict()
+        return digest
+
+    def open(self, digest: str):
+        """
+        Returns a tuple of the filename, the file size, the username of the original sender, and the file opened for
+        reading (the caller must close it), or None if the file is not in the store
+        """
+        with self._lock:
+            try:
+                filename, size, sender = self._entries[digest]
+            except KeyError:
+                return
+            self._entries.move_to_end(digest)
+        try:
+            return filename, size, sender, open(self._path(digest), 'rb')
+        except OSError:
+            return
+
+    def make_thumbnail(self, filename: str, data: bytes):
+        """
+        Returns a small PNG of the image, or an empty bytes object if the file is not an image or a thumbnail could
+        not be made
+        """
+        if Image is None or filename.split('.')[-1].lower() not in IMAGE_EXTENSIONS:
+            return b""
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.thumbnail(self._thumbnail_size)
+            thumbnail = io.BytesIO()
+            img.save(thumbnail, "png")
+        except (OSError, ValueError):
+            logger.debug("Could not make a thumbnail for %s", filename)
+            return b""
+        return thumbnail.getvalue()
+
+
+def send_file_chunks(soc, file, size: int, chunk_size: int):
+    """
+    Sends the first `size` bytes of `file` to a blocking socket, `chunk_size` bytes at a time, and yields how many bytes
+    have been sent after each chunk, so the caller can track progress and stop by closing the generator. Where
+    os.sendfile() is available the kernel copies the file to the socket directly. Elsewhere the file is memory mapped
+    and sent from a memoryview, which still avoids copying it into a bytes object. Raises OSError if the file is
+    shorter than `size`.
+    """
+    if size == 0:
+        return
+    if hasattr(os, "sendfile"):
+        offset = 0
+        while offset < size:
+            sent = soc.sendfile(file, offset, min(chunk_size, size - offset))
+            if sent == 0:
+                raise OSError(f"Stored file ended {size - offset} bytes early")
+            offset += sent
+            yield offset
+        return
+    if os.fstat(file.fileno()).st_size < size:
+        raise OSError(f"Stored file is shorter than {size} bytes")
+    with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+        for start in range(0, size, chunk_size):
+            soc.sendall(view[start:start + chunk_size])
+            yield min(start + chunk_size, size)
@@ -0,0 +1,406 @@
+"""
+Outbox (for pychat)
+Written by Joshua Kitchen - 2025
+
+Queues the frames waiting to be sent to one client and writes them from a thread of their own, so routing a message
+never waits on a client's connection, and a client that reads slowly only holds up its own messages.
+
+Frames are queued by priority class, worked out from their flags (see classify()):
+    CONTROL - Info and disconnect messages (JOINED, LEFT, SERVERMSG, PING, ...)
+    TEXT    - Text messages and media announcements
+    MEDIA   - Multimedia messages, including stored files sent with sendfile
+Control frames always go first. Text and media share the rest of the connection by deficit round robin: each turn a
+class is given its quantum of bytes and sends frames while it has enough, so text keeps flowing while a file transfer
+is under way instead of waiting behind every media message queued before it.
+
+A frame that has started being written has to be finished before anything else can be sent, since the protocol has no
+way of splitting a message. Frames are written CHUNK_SIZE bytes at a time, which is how progress (see stalled_for) is
+measured, so a slow reader can be told apart from one that has stopped reading.
+
+Most of the time nothing is waiting, and handing every frame to the writer thread would cost a thread switch per
+message per client. So when the outbox is empty, put() tries to send the frame straight away without blocking, and only
+queues whatever the socket wouldn't take. Small frames that did have to wait are written together, up to CHUNK_SIZE
+bytes at a time.
+
+How long each frame waited in the queue is recorded by priority class (see QueueDelays). A frame can also be given a
+callback, which is told once the whole frame has been written to the socket, or that it never will be. The latency
+tracker uses it to time traced messages up to when they were actually sent (see latency.py).
+"""
+
+import collections
+import contextlib
+import logging
+import socket
+import threading
+import time
+
+from frame_parser import MODIFIER_FLAGS
+from server.backend.latency import LatencyHistogram
+from server.backend.media_store import send_file_chunks
+
+logger = logging.getLogger(__name__)
+
+CONTROL = 0
+TEXT = 1
+MEDIA = 2
+CLASS_NAMES = ("control", "text", "media")
+CHUNK_SIZE = 65536
+QUANTA = {TEXT: 4 * CHUNK_SIZE, MEDIA: CHUNK_SIZE} # Text gets 4 times the bandwidth of media when both are waiting
+DEFAULT_MAX_OUTBOX_SIZE = 134_217_728 # 128 MiB
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", None) # Not available on Windows, where every frame goes through the queue
+
+
+def classify(payload) -> int:
+    """
+    Returns the priority class of a pychat message (without its frame header). Raises ValueError if the payload is too
+    short to be one.
+    """
+    if len(payload) < 9:
+        raise ValueError(f"A pychat message has a 9 byte header, but the payload is only {len(payload)} bytes")
+    flags = payload[8] & ~MODIFIER_FLAGS
+    if flags & (4 | 8):
+        return CONTROL
+    if flags & 2:
+        return MEDIA
+    return TEXT
+
+
+class QueueDelays:
+    """
+    Histograms of how long frames waited in outboxes before being written, by priority class. Shared by every outbox
+    of a server.
+    """
+    def __init__(self):
+        self._histograms = [LatencyHistogram() for _ in CLASS_NAMES]
+        self._immediate = [0] * len(CLASS_NAMES) # Frames sent without waiting, added to the histograms in summary()
+        self._lock = threading.Lock()
+
+    def record_immediate(self, priority):
+        with self._lock:
+            self._immediate[priority] += 1
+
+    def record_many(self, samples):
+        """
+        Records a list of (priority, seconds) tuples
+        """
+        with self._lock:
+            for priority, seconds in samples:
+                self._histograms[priority].record(seconds)
+
+    def summary(self):
+        with self._lock:
+            for priority, count in enumerate(self._immediate):
+                if count:
+                    self._histograms[priority].record(0.0, count)
+            self._immediate = [0] * len(CLASS_NAMES)
+            return {name: histogram.summary() for name, histogram in zip(CLASS_NAMES, self._histograms)}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = [LatencyHistogram() for _ in CLASS_NAMES]
+            self._immediate = [0] * len(CLASS_NAMES)
+
+
+class _Frame:
+    """
+    `queued_at` is None for the rest of a frame that put() started sending, whose wait has already been recorded
+    """
+    __slots__ = ("data", "size", "queued_at", "on_sent")
+
+    def __init__(self, data, queued_at=0.0, on_sent=None):
+        self.data = data
+        self.size = len(data)
+        self.queued_at = queued_at
+        self.on_sent = on_sent
+
+
+class _FileFrame:
+    """
+    A frame made of `header` followed by `size` bytes of `file`, which is closed once it has been sent or discarded
+    """
+    __slots__ = ("header", "file", "size", "queued_at", "on_sent")
+
+    def __init__(self, header, file, size):
+        self.header = header
+        self.file = file
+        self.size = len(header) + size
+        self.queued_at = 0.0
+        self.on_sent = None
+
+
+class Outbox:
+    """
+    `max_size` is the most bytes that can be waiting for the client. put() refuses anything more, since a client that
+    far behind is not going to catch up.
+    """
+    def __init__(self, soc: socket.socket, name, delays: QueueDelays | None = None,
+                 max_size=DEFAULT_MAX_OUTBOX_SIZE):
+        self._soc = soc
+        self._name = name
+        self._delays = delays
+        self.max_size = max_size
+        self._queues = [collections.deque() for _ in CLASS_NAMES]
+        self._deficits = {TEXT: 0, MEDIA: 0}
+        self._turn = TEXT
+        self._held = None # (frame, priority) that has to be written next
+        self._size = 0
+        self._writing = False
+        self._progress_at = 0.0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._thread = None
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues) + (self._held is not None)
+
+    @property
+    def size(self):
+        """
+        How many bytes are waiting to be sent, not counting the frame being written
+        """
+        return self._size
+
+    @property
+    def is_closed(self):
+        return self._closed
+
+    @property
+    def is_writing(self):
+        return self._writing
+
+    @property
+    def stalled_for(self):
+        """
+        How many seconds the frame being written has gone without any of it being sent, or 0 if nothing is being
+        written
+        """
+        if not self._writing:
+            return 0
+        return time.monotonic() - self._progress_at
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._write_loop, daemon=True, name=f"PychatOutbox#{self._name}")
+        self._thread.start()
+
+    def _put(self, frame, priority):
+        with self._lock:
+            if self._closed or self._size + frame.size > self.max_size:
+                return False
+            frame.queued_at = time.monotonic()
+            self._queues[priority].append(frame)
+            self._size += frame.size
+            self._cond.notify()
+        return True
+
+    def _send_now(self, frame: bytes, priority: int, on_sent) -> bool:
+        """
+        Sends as much of a frame as the socket will take without blocking, and holds on to the rest for the writer to
+        send next. Must be called with the lock held, and only while nothing is queued or being written.
+        """
+        try:
+            sent = self._soc.send(frame, _DONTWAIT)
+        except BlockingIOError:
+            sent = 0
+        except OSError: # Left for the writer to find
+            return False
+        if self._delays is not None:
+            self._delays.record_immediate(priority)
+        if sent < len(frame):
+            rest = _Frame(memoryview(frame)[sent:], None, on_sent)
+            self._held = (rest, priority)
+            self._size += rest.size
+            self._cond.notify()
+        elif on_sent is not None:
+            on_sent(True)
+        return True
+
+    def put(self, frame: bytes, priority: int, on_sent=None) -> bool:
+        """
+        Queues a whole frame (size header included), or sends it straight away if nothing is waiting. Returns False if
+        the outbox is closed or full. If the frame was queued, `on_sent` (if given) is called with True once all of it
+        has been written, or with False if it is discarded. It may be called with the outbox's lock held, so it must
+        not use the outbox.
+        """
+        if _DONTWAIT is not None:
+            with self._lock:
+                if self._closed:
+                    return False
+                if not self._size and not self._writing and self._thread is not None and \
+                        self._send_now(frame, priority, on_sent):
+                    return True
+        return self._put(_Frame(frame, on_sent=on_sent), priority)
+
+    def put_file(self, header: bytes, file, size: int) -> bool:
+        """
+        Queues a media frame of `header` (frame size header included) followed by `size` bytes of `file`, which is
+        sent straight from the file (see _write_file()). The outbox closes the file. Returns False if the outbox is
+        closed or full, in which case the caller still has to close it.
+        """
+        return self._put(_FileFrame(header, file, size), MEDIA)
+
+    def flush(self, timeout):
+        """
+        Waits until everything queued has been sent. Returns False if it was not within `timeout` seconds, or if the
+        outbox was closed first.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._size or self._writing) and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return not self._closed and not self._size and not self._writing
+
+    def close(self):
+        """
+        Stops the writer and discards anything still queued. A frame that is being written is given up on once its
+        current chunk has been sent, so the connection should be closed afterwards.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            discarded = self._discard()
+            self._cond.notify_all()
+        if discarded:
+            logger.debug("Discarded %d unsent frame(s) for client #%s", discarded, self._name)
+
+    def _discard(self):
+        frames = [frame for q in self._queues for frame in q]
+        if self._held is not None:
+            frames.append(self._held[0])
+            self._held = None
+        for q in self._queues:
+            q.clear()
+        self._size = 0
+        self._give_up(frames)
+        return len(frames)
+
+    @staticmethod
+    def _give_up(frames):
+        """
+        Closes the files of frames that will never be sent, and tells their callbacks
+        """
+        for frame in frames:
+            if isinstance(frame, _FileFrame):
+                frame.file.close()
+            elif frame.on_sent is not None:
+                frame.on_sent(False)
+
+    def _next(self):
+        """
+        Pops the next frame to send. Control frames go first, then text and media take turns by deficit round robin.
+        Must be called with the lock held, and with at least one frame queued.
+        """
+        if self._held is not None:
+            held = self._held
+            self._held = None
+            return held
+        if self._queues[CONTROL]:
+            return self._queues[CONTROL].popleft(), CONTROL
+        while True:
+            q = self._queues[self._turn]
+            if q and self._deficits[self._turn] >= q[0].size:
+                self._deficits[self._turn] -= q[0].size
+                return q.popleft(), self._turn
+            if not q: # A class that has nothing to send doesn't save up its turns
+                self._deficits[self._turn] = 0
+            self._turn = MEDIA if self._turn == TEXT else TEXT
+            if self._queues[self._turn]:
+                self._deficits[self._turn] += QUANTA[self._turn]
+
+    def _take_batch(self):
+        """
+        Pops the next frame, along with the small frames after it, up to CHUNK_SIZE bytes in all. Returns a list of
+        (frame, priority) tuples. Must be called with the lock held, and with at least one frame queued.
+        """
+        frame, priority = self._next()
+        self._size -= frame.size
+        batch = [(frame, priority)]
+        if isinstance(frame, _FileFrame):
+            return batch
+        total = frame.size
+        while self._size and total < CHUNK_SIZE:
+            frame, priority = self._next()
+            if isinstance(frame, _FileFrame) or total + frame.size > CHUNK_SIZE:
+                self._held = (frame, priority)
+                break
+            self._size -= frame.size
+            total += frame.size
+            batch.append((frame, priority))
+        return batch
+
+    def _write(self, data):
+        """
+        Returns False if the outbox was closed before all of `data` was written
+        """
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            if self._closed:
+                return False
+            self._soc.sendall(view[start:start + CHUNK_SIZE])
+            self._progress_at = time.monotonic()
+        return True
+
+    def _write_file(self, frame: _FileFrame):
+        """
+        The file is sent with media_store.send_file_chunks(), so the kernel copies it to the socket directly where
+        os.sendfile() is available, and it is sent from a memory map elsewhere. Raises OSError if the file is shorter
+        than it should be.
+        """
+        if not self._write(frame.header):
+            return
+        chunks = send_file_chunks(self._soc, frame.file, frame.size - len(frame.header), CHUNK_SIZE)
+        with contextlib.closing(chunks): # Unmaps the file if the outbox is closed part of the way through
+            for _ in chunks:
+                self._progress_at = time.monotonic()
+                if self._closed:
+                    return
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._size:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                batch = self._take_batch()
+                self._writing = True
+                self._progress_at = time.monotonic()
+            if self._delays is not None:
+                self._delays.record_many([(priority, self._progress_at - frame.queued_at) for frame, priority in batch
+                                          if frame.queued_at is not None])
+            frame = batch[0][0]
+            written = True
+            try:
+                if isinstance(frame, _FileFrame):
+                    with frame.file:
+                        self._write_file(frame)
+                elif len(batch) == 1:
+                    written = self._write(frame.data)
+                else:
+                    written = self._write(b"".join(frame.data for frame, _ in batch))
+            except (ConnectionError, OSError) as e:
+                logger.debug("Could not send to client #%s: %s", self._name, e)
+                self._give_up(frame for frame, _ in batch if not isinstance(frame, _FileFrame))
+                with self._cond:
+                    self._closed = True
+                    self._writing = False
+                    self._discard()
+                    self._cond.notify_all()
+                try: # Make sure the receive loop notices, so the client is removed
+                    self._soc.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+            for frame, _ in batch:
+                if frame.on_sent is not None:
+                    frame.on_sent(written)
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
@@ -0,0 +1,192 @@
+"""
+Presence (for pychat)
+Written by Joshua Kitchen - 2025
+
+Tells the room who joined and left in batches instead of one message per member. Every join and leave used to be
+broadcast on its own, so when a room of N members reconnected at once (after a network blip, or a server restart) each
+of them was sent N JOINED messages, N² in all, and every client redrew its chat box N times.
+
+Changes are collected for `interval` seconds from the first one, or until `max_batch` members have changed, and then
+broadcast as one info message:
+    PRESENCE:<comma separated changes>
+where each change is "+<username>" for a member who joined or "-<username>" for one who left. Only a member's latest
+change is sent, and a member who joined and left again (or dropped out and reconnected) within the interval isn't sent
+at all, since nobody needs to hear about it. Every change is safe to apply more than once (clients keep members in a
+set), so a client that was sent the list of MEMBERS while a change was waiting can apply it again without harm. Such
+a client may have seen either side of a pair of changes, so nothing waiting while MEMBERS is read (see list_members())
+is cancelled out. A list read in the moment between a member being registered (or unregistered) and announced isn't
+noticed, so a pair cancelled out after one can leave that client a change behind on the member.
+
+In rooms of more than `summary_size` members, only the number of members who joined and left is sent:
+    PRESENCE_SUMMARY:<number joined>:<number left>
+so the message stays the same size however many members changed. Clients in a room that large only know who was there
+when they joined (see MEMBERS), since a list of everyone who comes and goes isn't worth sending to everyone.
+
+A batch is sent up to `interval` seconds late, so a new member's first messages can reach the room before it is told
+they joined. An `interval` of 0 turns batching off, and every join and leave is broadcast straight away as JOINED:
+and LEFT:, the same as before.
+"""
+
+import logging
+import threading
+import time
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRESENCE_INTERVAL = 0.25
+DEFAULT_PRESENCE_BATCH = 64
+DEFAULT_SUMMARY_SIZE = 100
+
+
+class Presence:
+    """
+    `server` must have:
+        - broadcast_msg(msg, exclude=None)
+        - client_count, the number of members in the room
+    """
+    def __init__(self, server, interval=DEFAULT_PRESENCE_INTERVAL, max_batch=DEFAULT_PRESENCE_BATCH,
+                 summary_size=DEFAULT_SUMMARY_SIZE):
+        if interval < 0:
+            raise ValueError("interval must not be negative")
+        if max_batch <= 0 or not isinstance(max_batch, int):
+            raise ValueError("max_batch must be a non-zero, positive integer")
+        self.interval = interval
+        self.max_batch = max_batch
+        self.summary_size = summary_size
+        self._server = server
+        self._changes = {} # Username -> True if they joined, False if they left. Kept in the order they first changed.
+        self._cancellable = set() # Usernames whose waiting change can be cancelled out by the opposite one
+        self._listings = 0 # Member lists being read (see list_members())
+        self._first_change = 0 # time.monotonic() time of the first change waiting to be sent
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock() # Keeps batches in order when flush() is called from another thread
+        self._stopping = False
+        self._thread = None
+        self._batches = 0
+        self._summaries = 0
+        self._cancelled = 0
+
+    @property
+    def is_enabled(self):
+        return self.interval > 0
+
+    def start(self):
+        if not self.is_enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._cond:
+            self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="PychatPresence")
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sending batches. Changes that haven't been sent are kept until the next flush().
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def joined(self, username: str, client_id=None):
+        """
+        `client_id` is the new member's, which isn't sent its own JOINED when batching is off
+        """
+        if not self.is_enabled:
+            username = bytes(username, 'utf-8')
+            self._server.broadcast_msg(utils.encode_msg(username, b"JOINED:" + username, 4), exclude=client_id)
+            return
+        self._change(username, True)
+
+    def left(self, username: str):
+        if not self.is_enabled:
+            self._server.broadcast_msg(utils.encode_msg(b"", bytes(f"LEFT:{username}", "utf-8"), 4))
+            return
+        self._change(username, False)
+
+    def list_members(self, list_usernames):
+        """
+        Returns list_usernames(), read for the MEMBERS list of a new member or spectator. Whoever is sent it may have
+        seen either side of any change waiting now, so none of them are cancelled out.
+        """
+        with self._cond:
+            self._listings += 1
+            self._cancellable.clear()
+        try:
+            return list_usernames()
+        finally:
+            with self._cond:
+                self._listings -= 1
+                self._cancellable.clear()
+
+    def _change(self, username, joined):
+        with self._cond:
+            if username in self._cancellable and self._changes[username] != joined: # Nobody has seen either change
+                del self._changes[username]
+                self._cancellable.discard(username)
+                self._cancelled += 1
+                return
+            if not self._changes:
+                self._first_change = time.monotonic()
+                self._cond.notify()
+            self._changes[username] = joined
+            if self._listings:
+                self._cancellable.discard(username)
+            else:
+                self._cancellable.add(username)
+            if len(self._changes) == self.max_batch:
+                self._cond.notify()
+
+    def flush(self):
+        """
+        Broadcasts every change that is waiting straight away. Returns the number of members that changed.
+        """
+        with self._flush_lock:
+            with self._cond:
+                changes = self._changes
+                self._changes = {}
+                self._cancellable.clear()
+            if not changes:
+                return 0
+            if self._server.client_count > self.summary_size:
+                num_joined = sum(changes.values())
+                data = bytes(f"PRESENCE_SUMMARY:{num_joined}:{len(changes) - num_joined}", "utf-8")
+                self._summaries += 1
+            else:
+                data = utils.encode_presence(changes)
+            self._batches += 1
+            self._server.broadcast_msg(utils.encode_msg(b"", data, 4))
+            return len(changes)
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of batches broadcast ("batches"), how many of them were summaries
+        ("summaries"), the number of pairs of changes that cancelled out ("cancelled"), and the number of changes
+        waiting to be sent ("pending")
+        """
+        with self._cond:
+            return {"batches": self._batches, "summaries": self._summaries, "cancelled": self._cancelled,
+                    "pending": len(self._changes)}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._changes and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                deadline = self._first_change + self.interval
+                while not self._stopping and len(self._changes) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not broadcast presence changes")
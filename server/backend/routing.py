@@ -0,0 +1,114 @@
+"""
+Routing queue (for pychat)
+Written by Joshua Kitchen - 2025
+
+The server's message queue, split into partitions so that messages can be routed by several threads at once without
+any client's messages being reordered. Every message is put into the partition picked by its sender's client id, and
+each partition is routed by exactly one thread (see PychatServer.process_msg_queue()), so a client's messages (and the
+empty message that marks its disconnection) are always routed in the order they were received. Messages from different
+clients may be routed in any order, as they could already arrive in any order.
+
+Routing holds the GIL for most of its work, but hashing and storing media, building thumbnails, and writing to sockets
+release it, so a large file being stored no longer holds up everyone else's text. On a free-threaded build of Python
+every step runs in parallel.
+
+RoutingQueue keeps the parts of queue.Queue's interface that the server uses to wait for the queue to be drained
+(unfinished_tasks, all_tasks_done, task_done() and join()), counted across every partition.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+DEFAULT_ROUTING_WORKERS = 2
+
+
+class RoutingQueue:
+    """
+    If `timestamp` is True, each message is stamped with the time it was received (`recv_time`) for the latency
+    tracker (see latency.py)
+    """
+    def __init__(self, num_partitions=1, timestamp=False):
+        if num_partitions <= 0 or not isinstance(num_partitions, int):
+            raise ValueError("num_partitions must be a non-zero, positive integer")
+        self._timestamp = timestamp
+        self._partitions = [collections.deque() for _ in range(num_partitions)]
+        self.mutex = threading.Lock()
+        self._not_empty = [threading.Condition(self.mutex) for _ in range(num_partitions)]
+        self._any_not_empty = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        self.unfinished_tasks = 0
+
+    @property
+    def num_partitions(self):
+        return len(self._partitions)
+
+    def partition_of(self, client_id):
+        return hash(client_id) % len(self._partitions)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Puts a TCPLib Message into its sender's partition. Never blocks, since the queue is unbounded (`block` and
+        `timeout` are accepted for compatibility with queue.Queue).
+        """
+        if self._timestamp:
+            item.recv_time = time.time()
+        partition = self.partition_of(item.client_id)
+        with self.mutex:
+            self._partitions[partition].append(item)
+            self.unfinished_tasks += 1
+            self._not_empty[partition].notify()
+            self._any_not_empty.notify()
+
+    def get_from(self, partition, timeout=None):
+        """
+        Pops the next message from one partition, waiting up to `timeout` seconds (forever if None) for one to arrive.
+        Raises queue.Empty if none did.
+        """
+        items = self._partitions[partition]
+        with self.mutex:
+            if not items:
+                self._not_empty[partition].wait_for(lambda: items, timeout)
+                if not items:
+                    raise queue.Empty
+            return items.popleft()
+
+    def _pop_any(self):
+        for items in self._partitions:
+            if items:
+                return items.popleft()
+        raise queue.Empty
+
+    def get(self, block=True, timeout=None):
+        """
+        Pops the next message from any partition. Messages taken this way can be routed out of order, so this is only
+        meant for TCPServer.pop_msg() and for discarding whatever is left in the queue.
+        """
+        with self.mutex:
+            if block and not any(self._partitions):
+                self._any_not_empty.wait_for(lambda: any(self._partitions), timeout)
+            return self._pop_any()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        with self.mutex:
+            if self.unfinished_tasks <= 0:
+                raise ValueError("task_done() called too many times")
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    def qsize(self):
+        with self.mutex:
+            return sum(len(items) for items in self._partitions)
+
+    def empty(self):
+        return not self.qsize()
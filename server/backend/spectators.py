@@ -0,0 +1,95 @@
+"""
+Spectators (for pychat)
+Written by Joshua Kitchen - 2025
+
+Lets dashboards, archivers and read-only viewers follow a chat room without joining it, so one server can stream a
+room to a large audience. A spectator connects with the handshake b"\xffSPECTATE:<name>" in place of a username (the
+name is optional and only logged), and is answered with the MEMBERS of the room like anyone else, or "SERVER IS FULL"
+once `max_spectators` are watching. Spectators are not counted towards `max_clients`. The handshake starts with a byte
+that never appears in UTF-8, so no username can be mistaken for it, and a member can be called anything, "SPECTATE:"
+included.
+
+A spectator:
+    - has no username, so it isn't in the MEMBERS list, can't be sent direct messages, and the room is never told that
+      it joined or left (see presence.py)
+    - is sent everything broadcast to the room, including media announcements and presence changes
+    - can only send PONGs (it is pinged and evicted like any other client, see heartbeat.py), FETCHes for announced
+      media, and a disconnect. Text and multimedia messages from a spectator are rejected before they are buffered,
+      and any other info message is dropped.
+
+Members are kept in tables that are copied whenever a client joins or leaves (see CLIENT TABLES in
+PychatServer.__init__()). With a large audience, copying the whole table for every spectator would make each join cost
+as much as the audience is large, so spectators are kept in a SpectatorTable instead, which is split into buckets that
+are copied one at a time. Broadcasts go to spectators after members, in a loop of their own that skips the exclusion and
+latency checks that only apply to members.
+"""
+
+import threading
+
+SPECTATE_HANDSHAKE = b"\xffSPECTATE:" # Followed by the spectator's name
+SPECTATOR = "spectator" # Returned by PychatServer.on_connect() for a spectator
+DEFAULT_MAX_SPECTATORS = 1024
+SPECTATOR_BUFF_SIZE = 1024 # Spectators only send short info messages, so their receive buffers are kept small
+NUM_BUCKETS = 64
+
+
+class SpectatorTable:
+    """
+    Spectator id -> connection. Each bucket is a dictionary that is never changed once it is in place, the same as the
+    member tables, so values() can be iterated without a lock while spectators come and go. Adding or removing a
+    spectator only copies its bucket.
+    """
+    def __init__(self, num_buckets=NUM_BUCKETS):
+        self._buckets = [{} for _ in range(num_buckets)]
+        self._count = 0
+        self._lock = threading.Lock() # Only taken by writers
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, spectator_id):
+        return spectator_id in self._buckets[hash(spectator_id) % len(self._buckets)]
+
+    def get(self, spectator_id):
+        return self._buckets[hash(spectator_id) % len(self._buckets)].get(spectator_id)
+
+    def add(self, spectator_id, spectator):
+        index = hash(spectator_id) % len(self._buckets)
+        with self._lock:
+            bucket = self._buckets[index]
+            if spectator_id not in bucket:
+                self._count += 1
+            self._buckets[index] = {**bucket, spectator_id: spectator}
+
+    def remove(self, spectator_id):
+        """
+        Removes a spectator and returns its connection, or None if it wasn't in the table
+        """
+        index = hash(spectator_id) % len(self._buckets)
+        with self._lock:
+            bucket = dict(self._buckets[index])
+            spectator = bucket.pop(spectator_id, None)
+            if spectator is not None:
+                self._buckets[index] = bucket
+                self._count -= 1
+        return spectator
+
+    def clear(self):
+        """
+        Empties the table and returns a list of every connection that was in it
+        """
+        with self._lock:
+            buckets = self._buckets
+            self._buckets = [{} for _ in buckets]
+            self._count = 0
+        return [spectator for bucket in buckets for spectator in bucket.values()]
+
+    def ids(self):
+        return [spectator_id for bucket in self._buckets for spectator_id in bucket]
+
+    def values(self):
+        """
+        Yields every spectator's connection. Each bucket is read as it was when the loop reached it.
+        """
+        for bucket in self._buckets:
+            yield from bucket.values()
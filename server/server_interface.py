@@ -10,14 +10,17 @@ import threading
 import logging
 
 import log_util
+from server.backend import handoff
+from server.backend.TCP_server import DRAIN_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
 
 class ServerInterface:
-    def __init__(self, server_obj, addr, logger=None):
+    def __init__(self, server_obj, addr, logger=None, takeover_path=None):
         self.server_obj = server_obj
         self.addr = addr
+        self.takeover_path = takeover_path
         self.messages = []
         self.logger = logger # Even though we have the global 'logger' variable, I can't add any handlers to it unless
                              # it's referenced in an instance variable for reasons that I do not understand.
@@ -25,11 +28,18 @@ class ServerInterface:
             "help": (self.list_commands, "Show all available commands"),
             "logmode": (self.toggle_console_logging, "Continually prints logged messages to the console. Press 'enter' to exit log mode"),
             "info": (self.info, "Lists general information about the server"),
-            "shutdown": (self.shutdown_server, "Shuts down the server and exits"),
+            "shutdown": (self.shutdown_server, "[timeout] - Stops accepting connections, delivers the messages already "
+                                               "received (giving up after timeout seconds, 10 by default), then exits"),
             "restart": (self.restart_server, "Restarts the server"),
-            "clients": (self.view_clients, "View all clients currently connected"),
+            "upgrade": (self.upgrade_server, "[path] - Hand every connection over to a new server started with "
+                                             "--takeover, then exit. Clients stay connected"),
+            "clients": (self.view_clients, "View all clients currently connected and their round trip times"),
             "broadcast": (self.broadcast_server_message, "[message] - Broadcast a message to all clients"),
-            "kick": (self.kick, "[client_id] - Disconnect a client")
+            "kick": (self.kick, "[client_id] - Disconnect a client"),
+            "latency": (self.view_latency, "Show latency percentiles of relayed messages. Pass 'reset' to clear them"),
+            "limits": (self.view_limits, "Show the message size limits and how many messages were rejected for each"),
+            "queues": (self.view_queues, "Show how long messages waited to be sent to clients, by priority. Pass "
+                                         "'reset' to clear them")
         }
 
     def list_commands(self, args):
@@ -108,9 +118,17 @@ class ServerInterface:
 
     def shutdown_server(self, args):
         if self.server_obj.is_running:
+            try:
+                timeout = float(args[0]) if args else DRAIN_TIMEOUT
+            except ValueError:
+                print(f"Invalid timeout: {args[0]}")
+                return
             confirm = input("Are you sure you want to shut down the server? y/n: ")
             if confirm == 'y':
-                self.server_obj.stop()
+                print(f"Delivering messages that are still on their way (up to {timeout:g} seconds)...")
+                report = self.server_obj.drain(timeout)
+                print(f"Delivered {report['flushed']} queued message(s) and dropped {report['dropped']}")
+                print(f"{report['closed']} connection(s) closed cleanly and {report['cut_off']} cut off")
                 sys.exit()
             else:
                 return
@@ -127,9 +145,32 @@ class ServerInterface:
         else:
             print("The server is not running")
 
+    def upgrade_server(self, args):
+        if not handoff.is_supported():
+            print("Upgrading without disconnecting clients is not supported on this platform")
+            return
+        if not self.server_obj.is_running:
+            print("The server is not running")
+            return
+        path = args[0] if args else handoff.DEFAULT_HANDOFF_PATH
+        print(f"Waiting up to {handoff.HANDOFF_TIMEOUT} seconds for the new server. Start it with:\n"
+              f"    python pychat_server.py {self.addr[0]} {self.addr[1]} --takeover {path}")
+        if self.server_obj.hand_off(path):
+            print("The new server has taken over")
+            sys.exit()
+        print("The upgrade failed. This server is still running")
+
     def start(self, args):
         if not self.server_obj.is_running:
-            self.server_obj.start(self.addr)
+            if self.takeover_path is not None:
+                try:
+                    self.server_obj.take_over(self.takeover_path)
+                except ConnectionError as e:
+                    print(e)
+                    sys.exit(1)
+                self.takeover_path = None
+            else:
+                self.server_obj.start(self.addr)
             threading.Thread(target=self.server_obj.process_msg_queue, daemon=True).start()
             print("Server has been started")
         else:
@@ -138,20 +179,62 @@ class ServerInterface:
     def view_clients(self, args):
         client_list = self.server_obj.list_clients()
         for client_id in client_list:
-            client_info = self.server_obj.get_client_attributes(client_id)
-            print(f"{client_id} @ {client_info['addr'][0]} on port {client_info['addr'][1]}")
+            try:
+                client_info = self.server_obj.get_client_attributes(client_id)
+            except KeyError: # Disconnected since the list was made
+                continue
+            rtt = self.server_obj.client_rtt(client_id)
+            rtt = "-" if rtt is None else f"{rtt * 1000:.1f} ms"
+            print(f"{client_id} @ {client_info['addr'][0]} on port {client_info['addr'][1]} (RTT: {rtt})")
+        if self.server_obj.spectator_count:
+            print(f"\n{self.server_obj.spectator_count} spectator(s)")
+
+    def view_latency(self, args):
+        summary = self.server_obj.latency_summary()
+        if summary is None:
+            print("Latency tracking is disabled. Restart the server with --latency_tracking to enable it")
+            return
+        if args and args[0] == "reset":
+            self.server_obj.reset_latency()
+            print("Latency statistics have been reset")
+            return
+        print(f"{'STAGE':<12}{'COUNT':>10}{'P50 (ms)':>12}{'P95 (ms)':>12}{'P99 (ms)':>12}{'MAX (ms)':>12}")
+        for stage, stats in summary.items():
+            print(f"{stage:<12}{stats['count']:>10}{stats['p50'] * 1000:>12.3f}{stats['p95'] * 1000:>12.3f}"
+                  f"{stats['p99'] * 1000:>12.3f}{stats['max'] * 1000:>12.3f}")
+
+    def view_queues(self, args):
+        if args and args[0] == "reset":
+            self.server_obj.reset_queue_delays()
+            print("Queueing statistics have been reset")
+            return
+        print(f"{'PRIORITY':<12}{'COUNT':>10}{'P50 (ms)':>12}{'P95 (ms)':>12}{'P99 (ms)':>12}{'MAX (ms)':>12}")
+        for priority, stats in self.server_obj.queue_delay_summary().items():
+            print(f"{priority:<12}{stats['count']:>10}{stats['p50'] * 1000:>12.3f}{stats['p95'] * 1000:>12.3f}"
+                  f"{stats['p99'] * 1000:>12.3f}{stats['max'] * 1000:>12.3f}")
+        print(f"\n{self.server_obj.outbox_backlog():,} bytes waiting to be sent")
+        presence = self.server_obj.presence_stats()
+        print(f"{presence['batches']:,} batches of joins and leaves broadcast ({presence['summaries']:,} summaries), "
+              f"{presence['cancelled']:,} cancelled out, {presence['pending']} change(s) waiting")
+
+    def view_limits(self, args):
+        limits = self.server_obj.size_limits()
+        rejected = self.server_obj.rejected_msg_counts()
+        print(f"{'TYPE':<12}{'LIMIT (bytes)':>16}{'REJECTED':>10}")
+        for msg_type, limit in limits.items():
+            print(f"{msg_type:<12}{limit:>16,}{rejected.get(msg_type, '-'):>10}")
+        if rejected["multimedia"]:
+            print(f"\n{rejected['multimedia']} multimedia message(s) were rejected before their filename arrived")
 
     def kick(self, args):
         try:
-            self.server_obj.disconnect_client(args[0])
+            self.server_obj.kick_client(args[0])
         except IndexError:
             print("No user provided")
             return
         except KeyError:
             print(f"User {args[0]} is not connected")
-
-        self.server_obj.unregister_username(args[0])
-        self.server_obj.broadcast_msg(b"KICKED:", flags=4)
+            return
         print(f"User {args[0]} was kicked")
 
     def mainloop(self, log_mode=False):
@@ -0,0 +1,94 @@
+"""
+Socket options (for pychat)
+Written by Joshua Kitchen - 2025
+
+Sets the TCP options of pychat's connections: Nagle's algorithm (TCP_NODELAY), the size of the kernel's send and
+receive buffers (SO_SNDBUF/SO_RCVBUF), and keepalive probes (SO_KEEPALIVE). The server sets them on its listening socket
+and on every connection it accepts, and the client sets them once it has connected.
+
+PROFILES
+    text - For rooms that mostly send text. Nagle's algorithm is turned off, so a short message is sent at once instead
+           of waiting for the previous one to be acknowledged. The kernel buffers are left at the OS defaults.
+    bulk - For rooms that share a lot of media. Nagle's algorithm is left on so large messages go out in full segments,
+           and both kernel buffers are raised to BULK_BUFFER_SIZE so more data can be in flight on fast links.
+Both profiles turn keepalive on, so the OS also notices peers that vanished without closing the connection.
+
+The receive buffer limits the TCP window, and the window scale is agreed during the handshake, so buffer sizes are best
+set before connecting. Connections accepted by the server inherit the listening socket's buffers on most systems,
+which is why they are set on it as well. The OS may round the sizes or cap them (e.g. Linux doubles them and caps them
+at net.core.wmem_max and net.core.rmem_max).
+"""
+
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+BULK_BUFFER_SIZE = 1_048_576 # 1 MiB
+
+
+class SocketOptions:
+    """
+    `send_buffer` and `recv_buffer` are sizes in bytes, or None to leave the OS default. With keepalive on, the first
+    probe is sent after `keepalive_idle` seconds without traffic, then every `keepalive_interval` seconds, and the
+    connection is dropped after `keepalive_count` unanswered probes. Options the platform doesn't have are skipped.
+    """
+    def __init__(self, nodelay=False, send_buffer=None, recv_buffer=None, keepalive=False, keepalive_idle=60,
+                 keepalive_interval=10, keepalive_count=5):
+        for name, size in (("send_buffer", send_buffer), ("recv_buffer", recv_buffer)):
+            if size is not None and size <= 0:
+                raise ValueError(f"{name} must be a positive number of bytes")
+        self.nodelay = nodelay
+        self.send_buffer = send_buffer
+        self.recv_buffer = recv_buffer
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+
+    def __repr__(self):
+        return (f"<SocketOptions nodelay={self.nodelay} send_buffer={self.send_buffer} "
+                f"recv_buffer={self.recv_buffer} keepalive={self.keepalive}>")
+
+    def replace(self, **changes):
+        """
+        Returns a copy with some of the options changed. Options given as None are left as they are.
+        """
+        options = dict(vars(self))
+        options.update({name: value for name, value in changes.items() if value is not None})
+        return SocketOptions(**options)
+
+    def _set(self, soc, level, option, value):
+        try:
+            soc.setsockopt(level, option, value)
+        except OSError as e:
+            logger.warning("Could not set socket option %s to %s: %s", option, value, e)
+
+    def apply(self, soc: socket.socket, listening=False):
+        """
+        Sets the options on `soc`. Only the buffer sizes are set on a listening socket, for the connections it accepts
+        to inherit. Options that can't be set are logged and skipped, since the connection still works without them.
+        """
+        if self.send_buffer is not None:
+            self._set(soc, socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        if self.recv_buffer is not None:
+            self._set(soc, socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+        if listening:
+            return
+        if self.nodelay:
+            self._set(soc, socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            self._set(soc, socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # TCP_KEEPIDLE is TCP_KEEPALIVE on macOS
+            idle_option = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+            for option, value in ((idle_option, self.keepalive_idle),
+                                  (getattr(socket, "TCP_KEEPINTVL", None), self.keepalive_interval),
+                                  (getattr(socket, "TCP_KEEPCNT", None), self.keepalive_count)):
+                if option is not None:
+                    self._set(soc, socket.IPPROTO_TCP, option, value)
+
+
+PROFILES = {
+    "text": SocketOptions(nodelay=True, keepalive=True),
+    "bulk": SocketOptions(nodelay=False, send_buffer=BULK_BUFFER_SIZE, recv_buffer=BULK_BUFFER_SIZE, keepalive=True)
+}
@@ -0,0 +1,94 @@
+"""
+Chat archive export tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import os
+import tempfile
+import unittest
+import zipfile
+
+from client.backend.archive import ArchiveExport, MEDIA
+from client.backend.history import ChatHistory
+
+
+class ArchiveExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "chat.zip")
+        self.media_dir = os.path.join(self.tmp_dir.name, "media")
+        os.mkdir(self.media_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def save_media(self, name, data):
+        path = os.path.join(self.media_dir, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def export(self, records, total):
+        export = ArchiveExport(self.path, records, total)
+        export.start()
+        self.assertTrue(export.wait(10))
+        return export
+
+    def test_export_history(self):
+        cat = self.save_media("ab" * 32, b"\x89PNG cat")
+        song = self.save_media("cd" * 32, b"ID3 song")
+        history = ChatHistory(os.path.join(self.tmp_dir.name, "history.sqlite3"))
+        history.record_text("alice", "hello")
+        history.record_media("alice", "cat.png", "ab" * 32, 8)
+        history.record_media("bob", "song.mp3", "cd" * 32, 8)
+        history.record_media("bob", "cat.png", "ab" * 32, 8) # The same file again
+        history.record_media("carol", "lost.png", "ef" * 32, 8) # Never downloaded
+        history.commit()
+        records = ((f"{entry.sender}: {entry.body}",
+                    os.path.join(self.media_dir, entry.digest) if entry.digest else None)
+                   for entry in history.iter_messages())
+        export = self.export(records, history.count())
+        history.close()
+        self.assertIsNone(export.error)
+        self.assertEqual((export.phase, export.done, export.total), (MEDIA, 2, 2))
+        self.assertFalse(os.path.exists(f"{self.path}.part"))
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertEqual(sorted(archive.namelist()), ["chat.txt", f"media/{'ab' * 32}", f"media/{'cd' * 32}"])
+            self.assertEqual(str(archive.read("chat.txt"), "utf-8").splitlines(), [
+                "alice: hello",
+                f"alice: cat.png [media/{'ab' * 32}]",
+                f"bob: song.mp3 [media/{'cd' * 32}]",
+                f"bob: cat.png [media/{'ab' * 32}]",
+                "carol: lost.png"
+            ])
+            self.assertEqual(archive.read(f"media/{'ab' * 32}"), b"\x89PNG cat")
+            self.assertEqual(archive.read(f"media/{'cd' * 32}"), b"ID3 song")
+            self.assertEqual(archive.getinfo(f"media/{'cd' * 32}").compress_type, zipfile.ZIP_STORED)
+        self.assertTrue(os.path.exists(cat) and os.path.exists(song)) # Copied, not moved
+
+    def test_cancelled(self):
+        def records():
+            for i in range(5000):
+                if i == 2500:
+                    export.cancel()
+                yield f"line {i}", None
+        export = ArchiveExport(self.path, records(), 5000)
+        export.start()
+        self.assertTrue(export.wait(10))
+        self.assertTrue(export.was_cancelled)
+        self.assertIsNone(export.error)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["media"]) # Nothing left behind
+
+    def test_failed(self):
+        def records():
+            yield "line", None
+            raise OSError("history is unreadable")
+        with self.assertLogs("client.backend.archive", "ERROR"):
+            export = self.export(records(), 2)
+        self.assertIsInstance(export.error, OSError)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(f"{self.path}.part"))
+
+
+if __name__ == '__main__':
+    unittest.main()
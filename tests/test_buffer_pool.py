@@ -0,0 +1,50 @@
+"""
+Buffer pool tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import unittest
+
+from buffer_pool import BufferPool
+
+
+class BufferPoolTest(unittest.TestCase):
+    def test_size_classes(self):
+        pool = BufferPool(min_size=65536)
+        self.assertIsNone(pool.size_class(65535))
+        self.assertEqual(pool.size_class(65536), 65536)
+        self.assertEqual(pool.size_class(65537), 131072)
+        self.assertEqual(pool.size_class(1_000_000), 1_048_576)
+        with self.assertRaises(ValueError):
+            BufferPool(min_size=1000)
+
+    def test_released_buffer_reused(self):
+        pool = BufferPool()
+        buffer = pool.acquire(100_000)
+        self.assertEqual(len(buffer), 131072)
+        pool.release(memoryview(buffer)[:100_000]) # As the server releases a message
+        self.assertIs(pool.acquire(70_000), buffer) # Same size class
+        self.assertIsNot(pool.acquire(70_000), buffer) # Only released once
+        self.assertEqual(pool.stats(), {"hits": 1, "misses": 2, "free_bytes": 0})
+
+    def test_small_buffers_not_pooled(self):
+        pool = BufferPool()
+        buffer = pool.acquire(100)
+        self.assertEqual(len(buffer), 100)
+        pool.release(buffer)
+        pool.release(bytearray(100_000)) # Not from the pool, so not a size class
+        pool.release(b"x" * 65536)
+        self.assertEqual(pool.stats(), {"hits": 0, "misses": 0, "free_bytes": 0})
+
+    def test_limits(self):
+        pool = BufferPool(max_free=2, max_bytes=65536 * 3)
+        buffers = [pool.acquire(65536) for _ in range(3)]
+        for buffer in buffers:
+            pool.release(buffer)
+        self.assertEqual(pool.stats()["free_bytes"], 65536 * 2) # At most max_free of each class
+        pool.release(pool.acquire(131072))
+        self.assertEqual(pool.stats()["free_bytes"], 65536 * 2) # A 128 KiB buffer would go over max_bytes
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+"""
+Frame parser tests (for pychat)
+Written by Joshua Kitchen - 2025
+
+Feeds streams of messages to FrameParser in chunks of random sizes and checks that it finds the same messages as
+decoding the whole stream at once, and that malformed streams raise ProtocolError and nothing else. The random
+generator is seeded, so a failure can be reproduced.
+"""
+
+import random
+import unittest
+
+from buffer_pool import BufferPool
+from frame_parser import FrameParser, ChatMessage, MessageStart, MessageData, MessageEnd, MessageRejected, \
+    ProtocolError, MODIFIER_FLAGS, encode_frame
+import utils
+
+SEED = 20250601
+USERNAMES = ["alice", "bob", "", "zoë", "名前", "a" * 16]
+FLAGS = [1, 2, 4, 8, 1 | 16, 2 | 16, 1 | 128, 2 | 16 | 128, 4 | 128]
+MAX_FRAME_SIZE = 1_048_576
+
+
+def random_msgs(rng, count, max_data_size=4096):
+    msgs = []
+    for _ in range(count):
+        size = rng.choice([0, 1, rng.randrange(max_data_size), max_data_size])
+        msgs.append(utils.encode_msg(bytes(rng.choice(USERNAMES), 'utf-8'), rng.randbytes(size), rng.choice(FLAGS)))
+    return msgs
+
+
+def decode_whole(msgs):
+    """
+    What the parser should find in a stream of `msgs`: a list of (username, flags, data) tuples
+    """
+    decoded = [utils.decode_msg(msg) for msg in msgs]
+    return [(msg["username"], msg["flags"], bytes(msg["data"])) for msg in decoded]
+
+
+def split(rng, data):
+    """
+    Yields `data` in chunks of random sizes, mostly small enough to split headers
+    """
+    pos = 0
+    while pos < len(data):
+        size = rng.choice([1, 2, 3, 5, 8, 13, rng.randrange(1, 512), rng.randrange(1, 16384)])
+        yield data[pos:pos + size]
+        pos += size
+
+
+def feed_all(rng, parser, stream, save_restore=False):
+    """
+    Feeds `stream` to the parser in random chunks and returns every event. With `save_restore`, the parser is
+    sometimes swapped for a new one carrying on from its saved state, as when a connection is handed off.
+    """
+    events = []
+    for chunk in split(rng, stream):
+        if save_restore and rng.random() < 0.1:
+            state = parser.save_state()
+            parser = FrameParser(parser.max_frame_size, pool=parser.pool)
+            events.extend(parser.restore_state(state))
+        events.extend(parser.feed(chunk))
+    return events, parser
+
+
+def collect_streamed(events):
+    msgs = []
+    current = None
+    for event in events:
+        if isinstance(event, MessageStart):
+            current = (event.username, event.flags, bytearray())
+        elif isinstance(event, MessageData):
+            current[2].extend(event.data)
+        elif isinstance(event, MessageEnd):
+            msgs.append((current[0], current[1], bytes(current[2])))
+            current = None
+    return msgs
+
+
+class SplitStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(SEED)
+
+    def test_buffered(self):
+        for _ in range(50):
+            msgs = random_msgs(self.rng, self.rng.randrange(1, 40))
+            stream = b"".join(encode_frame(msg) for msg in msgs)
+            events, parser = feed_all(self.rng, FrameParser(MAX_FRAME_SIZE), stream, save_restore=True)
+            self.assertTrue(all(isinstance(event, ChatMessage) for event in events))
+            self.assertEqual([(e.username, e.flags, bytes(e.data)) for e in events], decode_whole(msgs))
+            self.assertEqual([bytes(e.payload) for e in events], [bytes(msg) for msg in msgs])
+            self.assertTrue(parser.is_idle)
+
+    def test_pooled(self):
+        pool = BufferPool(min_size=1024)
+        for _ in range(20):
+            msgs = random_msgs(self.rng, self.rng.randrange(1, 20), max_data_size=8192)
+            stream = b"".join(encode_frame(msg) for msg in msgs)
+            events, _ = feed_all(self.rng, FrameParser(MAX_FRAME_SIZE, pool=pool), stream, save_restore=True)
+            self.assertEqual([(e.username, e.flags, bytes(e.data)) for e in events], decode_whole(msgs))
+            for event in events:
+                if type(event.payload) is memoryview:
+                    pool.release(event.payload)
+
+    def test_streamed(self):
+        for _ in range(50):
+            msgs = random_msgs(self.rng, self.rng.randrange(1, 40))
+            stream = b"".join(encode_frame(msg) for msg in msgs)
+            events, _ = feed_all(self.rng, FrameParser(MAX_FRAME_SIZE, stream=True), stream)
+            self.assertEqual(collect_streamed(events), decode_whole(msgs))
+
+    def test_size_limits(self):
+        limits = {1: 100, 2: 1000, 4: 50, 8: 0}
+        for _ in range(50):
+            msgs = random_msgs(self.rng, self.rng.randrange(1, 40), max_data_size=2000)
+            stream = b"".join(encode_frame(msg) for msg in msgs)
+            events, _ = feed_all(self.rng, FrameParser(MAX_FRAME_SIZE, size_limits=limits), stream)
+            expected = [("rejected", flags, len(data)) if len(data) > limits[flags & ~MODIFIER_FLAGS] else (username, flags, data)
+                        for username, flags, data in decode_whole(msgs)]
+            self.assertEqual([("rejected", e.flags, e.data_size) if isinstance(e, MessageRejected)
+                              else (e.username, e.flags, bytes(e.data)) for e in events], expected)
+
+
+class MalformedStreamTest(unittest.TestCase):
+    """
+    Whatever the parser is fed, it either returns events or raises ProtocolError
+    """
+    def setUp(self):
+        self.rng = random.Random(SEED)
+
+    def feed_malformed(self, good, bad, **kwargs):
+        """
+        Checks that a stream of the `good` messages followed by the `bad` bytes raises ProtocolError
+        """
+        parser = FrameParser(MAX_FRAME_SIZE, **kwargs)
+        with self.assertRaises(ProtocolError):
+            for chunk in split(self.rng, b"".join(encode_frame(msg) for msg in good) + bad):
+                parser.feed(chunk)
+
+    def test_header_does_not_match_frame_size(self):
+        for _ in range(100):
+            msg = random_msgs(self.rng, 1)[0]
+            header = bytearray(msg)
+            field = self.rng.choice([0, 4])
+            size = int.from_bytes(header[field:field + 4], "big")
+            header[field:field + 4] = ((size + self.rng.choice([-1, 1, 1000, 2 ** 31])) % 2 ** 32).to_bytes(4, "big")
+            for stream in (False, True):
+                self.feed_malformed(random_msgs(self.rng, 3), encode_frame(header), stream=stream)
+
+    def test_type_without_a_limit(self):
+        limits = {1: 100, 2: 1000, 4: 50, 8: 8}
+        for flags in (0, 3, 5, 32, 64, 65, 4 | 16, 8 | 16, 32 | 128, 255):
+            self.feed_malformed(random_msgs(self.rng, 3), encode_frame(utils.encode_msg(b"alice", b"hi", flags)),
+                                size_limits=limits)
+
+    def test_frame_too_small_for_header(self):
+        for size in range(9):
+            self.feed_malformed(random_msgs(self.rng, 3), size.to_bytes(4, "big") + bytes(size))
+
+    def test_frame_too_large(self):
+        self.feed_malformed(random_msgs(self.rng, 3), (MAX_FRAME_SIZE + 1).to_bytes(4, "big"))
+
+    def test_username_not_utf8(self):
+        for stream in (False, True):
+            self.feed_malformed([], encode_frame(utils.encode_msg(b"\xff\xfe", b"hi", 1)), stream=stream)
+
+    def test_random_bytes(self):
+        for _ in range(500):
+            data = self.rng.randbytes(self.rng.randrange(1, 256))
+            for kwargs in ({}, {"stream": True}, {"size_limits": {1: 10, 2: 100, 4: 10, 8: 0}}):
+                parser = FrameParser(4096, **kwargs)
+                try:
+                    for chunk in split(self.rng, data):
+                        parser.feed(chunk)
+                except ProtocolError:
+                    pass
+
+    def test_random_corruption(self):
+        for _ in range(200):
+            stream = bytearray(b"".join(encode_frame(msg) for msg in random_msgs(self.rng, 5, max_data_size=64)))
+            for _ in range(self.rng.randrange(1, 4)):
+                stream[self.rng.randrange(len(stream))] = self.rng.randrange(256)
+            parser = FrameParser(4096)
+            try:
+                for chunk in split(self.rng, bytes(stream)):
+                    parser.feed(chunk)
+            except ProtocolError:
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
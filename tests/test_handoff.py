@@ -0,0 +1,150 @@
+"""
+Handoff tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from frame_parser import FrameParser, ChatMessage, MessageRejected, encode_frame
+from server.backend import handoff
+import utils
+
+
+@unittest.skipUnless(handoff.is_supported(), "Passing file descriptors needs Unix sockets")
+class HandoffTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "handoff")
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.pairs = [socket.socketpair() for _ in range(5)]
+        self.result = None
+
+    def tearDown(self):
+        self.listener.close()
+        for pair in self.pairs:
+            for soc in pair:
+                soc.close()
+        self.tmp_dir.cleanup()
+
+    def start_old_server(self, state):
+        """
+        Hands off the listener and one end of each socketpair, as the old server would, from another thread
+        """
+        def hand_off():
+            conn = handoff.wait_for_takeover(self.path, timeout=5)
+            with conn:
+                fds = [self.listener.fileno()] + [soc.fileno() for soc, _ in self.pairs]
+                self.result = handoff.send_state(conn, state, fds)
+        thread = threading.Thread(target=hand_off, daemon=True)
+        thread.start()
+        while not os.path.exists(self.path) and thread.is_alive(): # Wait until the old server is listening
+            thread.join(0.01)
+        return thread
+
+    def test_round_trip(self):
+        state = {"clients": [[str(i), f"user{i}"] for i in range(len(self.pairs))], "left": ["carol"]}
+        thread = self.start_old_server(state)
+        received_state, listener, clients, conn = handoff.receive_state(self.path, timeout=5)
+        handoff.confirm(conn)
+        thread.join(5)
+        self.assertTrue(self.result)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(received_state, state)
+        with listener:
+            with socket.create_connection(listener.getsockname(), timeout=5):
+                accepted, _ = listener.accept()
+                accepted.close()
+        self.assertEqual(len(clients), len(self.pairs))
+        for client, (_, peer) in zip(clients, self.pairs): # Each socket still reaches the same client, in order
+            with client:
+                client.sendall(bytes(str(client.fileno()), "utf-8"))
+                peer.settimeout(5)
+                self.assertEqual(peer.recv(100), bytes(str(client.fileno()), "utf-8"))
+
+    def test_sockets_sent_in_batches(self):
+        max_fds = handoff.MAX_FDS_PER_MSG
+        handoff.MAX_FDS_PER_MSG = 2
+        try:
+            self.test_round_trip()
+        finally:
+            handoff.MAX_FDS_PER_MSG = max_fds
+
+    def test_not_confirmed(self):
+        thread = self.start_old_server({"clients": [[str(i), f"user{i}"] for i in range(len(self.pairs))]})
+        _, listener, clients, conn = handoff.receive_state(self.path, timeout=5)
+        for soc in [listener, conn] + clients: # The new server gave up, so the old one carries on
+            soc.close()
+        thread.join(5)
+        self.assertFalse(self.result)
+
+    def test_no_old_server(self):
+        with self.assertRaises(ConnectionError):
+            handoff.receive_state(self.path, timeout=5)
+
+
+class ParserHandoffTest(unittest.TestCase):
+    """
+    A parser's state is handed to a new server as JSON, and the new parser carries on from the same place in the stream
+    """
+    def hand_off(self, parser, **kwargs):
+        restored = FrameParser(**kwargs)
+        return restored, restored.restore_state(json.loads(json.dumps(parser.save_state())))
+
+    def test_split_mid_header(self):
+        first = utils.encode_msg(b"alice", b"hello", 1)
+        second = utils.encode_msg(b"bob", b"world", 1)
+        stream = bytes(encode_frame(first) + encode_frame(second))
+        split = len(encode_frame(first)) + 4 + 6 # In the middle of the second message's header
+        parser = FrameParser()
+        events = parser.feed(stream[:split])
+        parser, restored_events = self.hand_off(parser)
+        events += restored_events + parser.feed(stream[split:])
+        self.assertEqual([(event.username, bytes(event.data)) for event in events], [("alice", b"hello"),
+                                                                                       ("bob", b"world")])
+
+    def test_split_mid_size(self):
+        msg = utils.encode_msg(b"alice", b"hello", 1)
+        stream = bytes(encode_frame(msg))
+        parser = FrameParser()
+        self.assertEqual(parser.feed(stream[:2]), [])
+        parser, events = self.hand_off(parser)
+        events += parser.feed(stream[2:])
+        self.assertEqual([bytes(event.payload) for event in events], [bytes(msg)])
+
+    def test_split_mid_payload(self):
+        msg = utils.encode_msg(b"alice", os.urandom(100_000), 2)
+        stream = bytes(encode_frame(msg))
+        parser = FrameParser()
+        self.assertEqual(parser.feed(stream[:50_000]), [])
+        parser, events = self.hand_off(parser)
+        events += parser.feed(stream[50_000:])
+        self.assertEqual([bytes(event.payload) for event in events], [bytes(msg)])
+
+    def test_skipping_rejected_message(self):
+        rejected = utils.encode_msg(b"alice", b"x" * 1000, 1)
+        accepted = utils.encode_msg(b"alice", b"hello", 1)
+        stream = bytes(encode_frame(rejected) + encode_frame(accepted))
+        parser = FrameParser(size_limits={1: 100})
+        events = parser.feed(stream[:500])
+        self.assertEqual([type(event) for event in events], [MessageRejected])
+        self.assertEqual(parser.save_state()["skip"], len(rejected) - 500 + 4)
+        parser, restored_events = self.hand_off(parser, size_limits={1: 100})
+        self.assertEqual(restored_events, [])
+        events = parser.feed(stream[500:])
+        self.assertEqual([type(event) for event in events], [ChatMessage])
+        self.assertEqual(bytes(events[0].data), b"hello")
+
+    def test_streamed_message_not_saved(self):
+        parser = FrameParser(stream=True)
+        parser.feed(bytes(encode_frame(utils.encode_msg(b"alice", b"hello", 1)))[:16])
+        with self.assertRaises(ValueError):
+            parser.save_state()
+
+
+if __name__ == '__main__':
+    unittest.main()
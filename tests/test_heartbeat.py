@@ -0,0 +1,130 @@
+"""
+Heartbeat tests (for pychat)
+Written by Joshua Kitchen - 2025
+
+The heartbeat is driven by hand here, one tick at a time against a fake clock, instead of by its thread.
+"""
+
+import unittest
+from unittest import mock
+
+from server.backend import heartbeat
+from server.backend.heartbeat import Heartbeat, TimerWheel
+
+
+START = 1000.0 # time.monotonic() is some arbitrary time, which is never close to 0
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = START
+
+    def monotonic(self):
+        return self.now
+
+    def monotonic_ns(self):
+        return int(self.now * 1e9)
+
+
+class FakeServer:
+    """
+    Has the methods Heartbeat needs, and records the pings and evictions. The client is never heard from.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.pings = [] # (time, data)
+        self.evicted = [] # (time, client_id)
+        self.ping_result = True
+
+    def send_ping(self, client_id, data):
+        self.pings.append((self.clock.now - START, data))
+        return self.ping_result
+
+    def evict_client(self, client_id):
+        self.evicted.append((self.clock.now - START, client_id))
+
+    def last_received(self, client_id):
+        return START
+
+    def send_stalled(self, client_id):
+        return 0
+
+
+class TimerWheelTest(unittest.TestCase):
+    def test_key_expires_after_its_ticks(self):
+        wheel = TimerWheel(8)
+        wheel.schedule("a", 3)
+        wheel.schedule("b", 1)
+        self.assertEqual(wheel.advance(), {"b"})
+        self.assertEqual(wheel.advance(), set())
+        self.assertEqual(wheel.advance(), {"a"})
+        self.assertEqual(wheel.advance(), set())
+
+    def test_delays_are_clamped(self):
+        wheel = TimerWheel(4)
+        wheel.schedule("now", 0)
+        wheel.schedule("later", 100)
+        self.assertEqual(wheel.advance(), {"now"})
+        self.assertEqual(wheel.advance(), set())
+        self.assertEqual(wheel.advance(), {"later"}) # Capped at one turn of the wheel less one slot
+
+
+class HeartbeatTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeTime()
+        patcher = mock.patch.object(heartbeat, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = FakeServer(self.clock)
+        self.heartbeat = Heartbeat(self.server, ping_interval=10, idle_timeout=30, tick=1)
+        self.checks = []
+        self.heartbeat.add("client")
+
+    def run_for(self, seconds):
+        """
+        Turns the wheel once a second, the same as Heartbeat._run() does, and records when the client was checked
+        """
+        for _ in range(seconds):
+            self.clock.now += 1
+            for client_id in self.heartbeat._wheel.advance():
+                self.checks.append(self.clock.now - START)
+                self.heartbeat._check(client_id)
+
+    def test_evicted_after_idle_timeout(self):
+        self.run_for(40)
+        self.assertEqual([when for when, _ in self.server.pings], [10, 20])
+        self.assertTrue(all(data.startswith(b"PING:") and data.endswith(b":30") for _, data in self.server.pings))
+        self.assertEqual(self.server.evicted, [(30, "client")])
+        self.assertIsNone(self.heartbeat.rtt("client"))
+
+    def test_checked_only_when_due(self):
+        self.run_for(30)
+        self.assertEqual(self.checks, [10, 20, 30])
+
+    def test_pong_records_rtt(self):
+        self.run_for(10)
+        token = self.server.pings[0][1].split(b":")[1].decode()
+        self.clock.now += 0.25
+        self.heartbeat.record_pong("client", token)
+        self.assertAlmostEqual(self.heartbeat.rtt("client"), 0.25)
+        self.heartbeat.record_pong("client", token) # Answered already, so ignored
+        self.assertAlmostEqual(self.heartbeat.rtt("client"), 0.25)
+
+    def test_held_up_ping_resets_idle_clock(self):
+        self.server.ping_result = None # Queued behind a message the client is still reading
+        self.run_for(10)
+        self.server.ping_result = True
+        self.run_for(30)
+        # Next checks are at the real deadlines, not every tick, and idle time counts from the held up ping
+        self.assertEqual(self.checks, [10, 20, 30, 40])
+        self.assertEqual(self.server.evicted, [(40, "client")])
+
+    def test_removed_client_is_forgotten(self):
+        self.heartbeat.remove("client")
+        self.run_for(40)
+        self.assertEqual(self.server.pings, [])
+        self.assertEqual(self.server.evicted, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Chat history tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import os
+import tempfile
+import unittest
+
+from client.backend.history import ChatHistory, room_filename
+
+
+class ChatHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addr = ("chat.example.com", 5000)
+        self.history = ChatHistory.open_room(self.tmp_dir.name, self.addr)
+
+    def tearDown(self):
+        self.history.close()
+        self.tmp_dir.cleanup()
+
+    def test_record(self):
+        self.history.record_text("alice", "hello")
+        self.history.record_text("bob", "psst", recipients=["alice", "carol"])
+        self.history.record_media("alice", "cat.png", "ab" * 32, 1234)
+        self.history.record_info("JOINED:carol")
+        self.history.record_info("PING:1:30") # Not worth keeping
+        self.assertEqual(self.history.count(), 0) # Nothing is written until commit()
+        self.history.commit()
+        entries = self.history.page(1_000_000, 10)
+        self.assertEqual([(e.sender, e.flags, e.recipients, e.body, e.digest, e.size) for e in entries], [
+            ("alice", 1, [], "hello", None, None),
+            ("bob", 1 | 16, ["alice", "carol"], "psst", None, None),
+            ("alice", 2, [], "cat.png", "ab" * 32, 1234),
+            ("SERVER", 4, [], "JOINED:carol", None, None)
+        ])
+        self.assertEqual([e.body for e in self.history.page(entries[2].id, 10)], ["hello", "psst"])
+        self.assertEqual([e.body for e in self.history.iter_messages(batch_size=3)], [e.body for e in entries])
+
+    def test_search(self):
+        for i in range(5):
+            self.history.record_text("alice", f"message {i} about pythons")
+        self.history.record_text("bob", "nothing to see")
+        self.history.record_media("carol", "python_logo.png", "cd" * 32, 10)
+        self.history.commit()
+        self.assertEqual([e.body for e in self.history.search("about pythons", limit=2)],
+                         ["message 4 about pythons", "message 3 about pythons"]) # Newest first
+        self.assertEqual(len(self.history.search("pyth")), 6) # The last term matches the start of a word
+        self.assertEqual([e.body for e in self.history.search("bob")], ["nothing to see"]) # Senders are indexed too
+        self.assertEqual(self.history.search("pythons bob"), [])
+        self.assertEqual(self.history.search('"quoted'), [])
+        self.assertEqual(self.history.search("   "), [])
+
+    def test_reopen(self):
+        self.history.record_text("alice", "before")
+        self.history.close()
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, room_filename(self.addr))))
+        self.history = ChatHistory.open_room(self.tmp_dir.name, self.addr)
+        self.assertEqual(self.history.session_start, 2)
+        self.history.record_text("alice", "after")
+        self.history.commit()
+        self.assertEqual([e.body for e in self.history.page(1_000_000, 10)], ["before", "after"])
+        self.assertEqual([e.body for e in self.history.search("before")], ["before"])
+
+    def test_rooms_kept_apart(self):
+        self.assertEqual(room_filename(("chat.example.com", 5000)), "chat.example.com_5000.sqlite3")
+        self.assertEqual(room_filename(("fe80::1", 5000)), "fe80__1_5000.sqlite3")
+        other = ChatHistory.open_room(self.tmp_dir.name, ("chat.example.com", 5001))
+        try:
+            other.record_text("alice", "elsewhere")
+            other.commit()
+            self.assertEqual(self.history.count(), 0)
+        finally:
+            other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
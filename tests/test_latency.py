@@ -0,0 +1,131 @@
+"""
+Latency tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import json
+import random
+import time
+import unittest
+
+from server.backend.latency import LatencyHistogram, LatencyTracker, STAGES
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_bucket_bounds(self):
+        buckets = LatencyHistogram.BUCKETS
+        self.assertEqual(buckets[0], 1e-6)
+        self.assertAlmostEqual(buckets[4] / buckets[0], 2, places=3) # Four buckets per doubling
+        self.assertTrue(16 < buckets[-1] < 17.5)
+        self.assertTrue(all(1.189 < upper / lower < 1.19 for lower, upper in zip(buckets, buckets[1:])))
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().summary(), {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0,
+                                                        "max": 0.0})
+
+    def test_known_samples(self):
+        hist = LatencyHistogram()
+        hist.record(0.001, 98)
+        hist.record(0.05)
+        hist.record(1.0)
+        bucket = next(bound for bound in LatencyHistogram.BUCKETS if bound >= 0.001) # Upper bound of the 1ms bucket
+        self.assertTrue(0.001 <= bucket < 0.001 * 1.1892)
+        summary = hist.summary()
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["mean"], (0.098 + 0.05 + 1.0) / 100)
+        self.assertEqual(summary["p50"], bucket)
+        self.assertEqual(summary["p95"], bucket)
+        self.assertTrue(0.05 <= hist.percentile(99) < 0.05 * 1.1892)
+        self.assertEqual(hist.percentile(100), 1.0) # Never more than the largest sample
+        self.assertEqual(summary["max"], 1.0)
+
+    def test_outside_buckets(self):
+        hist = LatencyHistogram()
+        hist.record(-0.5) # Clocks out of sync
+        hist.record(30.0)
+        self.assertEqual(hist.percentile(50), LatencyHistogram.BUCKETS[0])
+        self.assertEqual(hist.percentile(100), 30.0)
+
+    def test_error_bound(self):
+        rng = random.Random(20250601)
+        samples = sorted(rng.lognormvariate(-7, 2) for _ in range(10_000))
+        hist = LatencyHistogram()
+        for sample in samples:
+            hist.record(sample)
+        for p in (50, 90, 95, 99):
+            exact = samples[int(p / 100 * len(samples)) - 1]
+            self.assertTrue(exact <= hist.percentile(p) <= exact * 1.1892, p)
+
+
+class Msg:
+    def __init__(self, client_id, size, recv_time):
+        self.client_id = client_id
+        self.size = size
+        self.recv_time = recv_time
+
+
+class LatencyTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = LatencyTracker()
+
+    def counts(self):
+        return {stage: stats["count"] for stage, stats in self.tracker.summary().items()}
+
+    def test_recorded_once_every_send_is_reported(self):
+        trace = self.tracker.start_trace(Msg("1", 100, time.time() - 0.01))
+        on_sent = [self.tracker.expect_send(trace, client_id) for client_id in ("2", "3")]
+        on_sent[0](True)
+        self.tracker.finish_trace(trace)
+        self.assertEqual(self.counts(), dict.fromkeys(STAGES, 0)) # Still waiting for client 3
+        on_sent[1](True)
+        self.assertEqual(self.counts(), {"network": 0, "queue": 1, "fanout": 2, "server": 2, "end_to_end": 0})
+        self.assertGreaterEqual(self.tracker.summary()["queue"]["max"], 0.01)
+
+    def test_sends_reported_before_routing_finished(self):
+        trace = self.tracker.start_trace(Msg("1", 100, time.time()))
+        self.tracker.expect_send(trace, "2")(True)
+        self.assertEqual(self.counts()["fanout"], 0) # More recipients may still be queued
+        self.tracker.finish_trace(trace)
+        self.assertEqual(self.counts()["fanout"], 1)
+
+    def test_failed_sends_left_out(self):
+        trace = self.tracker.start_trace(Msg("1", 100, time.time()))
+        self.tracker.expect_send(trace, "2")(False)
+        self.tracker.expect_send(trace, "3")(True)
+        self.tracker.finish_trace(trace)
+        self.assertEqual(self.counts(), {"network": 0, "queue": 1, "fanout": 1, "server": 1, "end_to_end": 0})
+
+    def test_traced_by_client(self):
+        now = time.time()
+        trace = self.tracker.start_trace(Msg("1", 100, now), client_send_time=now - 0.05)
+        self.tracker.expect_send(trace, "2")(True)
+        self.tracker.finish_trace(trace)
+        summary = self.tracker.summary()
+        self.assertEqual((summary["network"]["count"], summary["end_to_end"]["count"]), (1, 1))
+        self.assertAlmostEqual(summary["network"]["max"], 0.05, places=3)
+        self.assertGreaterEqual(summary["end_to_end"]["max"], summary["network"]["max"])
+
+    def test_no_recipients(self):
+        self.tracker.finish_trace(self.tracker.start_trace(Msg("1", 100, time.time())))
+        self.assertEqual(self.counts(), {"network": 0, "queue": 1, "fanout": 0, "server": 0, "end_to_end": 0})
+
+    def test_sampled_trace_logged(self):
+        tracker = LatencyTracker(sample_rate=1.0)
+        trace = tracker.start_trace(Msg("1", 100, time.time()))
+        tracker.expect_send(trace, "2")(True)
+        with self.assertLogs("pychat.trace", "INFO") as logs:
+            tracker.finish_trace(trace)
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual((logged["client_id"], logged["size"]), ("1", 100))
+        self.assertEqual([(send["client_id"], send["ok"]) for send in logged["sends"]], [("2", True)])
+
+    def test_reset(self):
+        self.tracker.finish_trace(self.tracker.start_trace(Msg("1", 100, time.time())))
+        self.tracker.reset()
+        self.assertEqual(self.counts(), dict.fromkeys(STAGES, 0))
+        with self.assertRaises(ValueError):
+            LatencyTracker(sample_rate=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Logging utility tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+
+import log_util
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.threads = set() # Threads the records were written from
+
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.add(threading.current_thread())
+
+
+class LogUtilTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.logger = logging.getLogger(f"pychat.test.{self.id()}")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        log_util.stop_async_logging(self.logger)
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        self.tmp_dir.cleanup()
+
+    def test_json_format(self):
+        log_path = os.path.join(self.tmp_dir.name, "log.jsonl")
+        log_util.toggle_file_handler(self.logger, log_path, logging.INFO, "file", json_format=True)
+        self.logger.info("hello %s", "world")
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            self.logger.exception("failed")
+        with open(log_path) as file:
+            entries = [json.loads(line) for line in file]
+        self.assertEqual(set(entries[0]), {"time", "created", "level", "logger", "module", "function", "thread",
+                                           "message"})
+        self.assertEqual((entries[0]["level"], entries[0]["logger"], entries[0]["message"]),
+                         ("INFO", self.logger.name, "hello world"))
+        self.assertEqual((entries[0]["module"], entries[0]["function"]), ("test_log_util", "test_json_format"))
+        self.assertEqual(entries[1]["level"], "ERROR")
+        self.assertIn("ValueError: broken", entries[1]["exception"])
+
+    def test_gzip_rotation(self):
+        log_path = os.path.join(self.tmp_dir.name, "server.log")
+        log_util.toggle_file_handler(self.logger, log_path, logging.INFO, "file", rotation="size", max_bytes=1000,
+                                     backup_count=2, compress=True)
+        for i in range(100):
+            self.logger.info("message %d", i)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ["server.log", "server.log.1.gz", "server.log.2.gz"])
+        with gzip.open(f"{log_path}.1.gz", "rt") as file:
+            self.assertIn("message", file.read())
+
+    def test_replaces_handler_with_same_name(self):
+        log_path = os.path.join(self.tmp_dir.name, "server.log")
+        log_util.toggle_file_handler(self.logger, log_path, logging.INFO, "file")
+        log_util.toggle_file_handler(self.logger, log_path, logging.DEBUG, "file", rotation="size")
+        self.assertEqual([handler.name for handler in self.logger.handlers], ["file"])
+        with self.assertRaises(ValueError):
+            log_util.toggle_file_handler(self.logger, log_path, logging.INFO, "file", rotation="weekly")
+
+    def test_async_logging(self):
+        handler = RecordingHandler()
+        self.logger.addHandler(handler)
+        log_util.start_async_logging(self.logger)
+        self.assertEqual([type(h) for h in self.logger.handlers], [logging.handlers.QueueHandler])
+        added = RecordingHandler()
+        added.set_name("added")
+        log_util._add_handler(self.logger, added) # Runs on the background thread as well
+        for i in range(10):
+            self.logger.info("message %d", i)
+        log_util.stop_async_logging(self.logger) # Flushes the queue
+        self.assertEqual([record.getMessage() for record in handler.records], [f"message {i}" for i in range(10)])
+        self.assertEqual(len(added.records), 10)
+        self.assertNotIn(threading.current_thread(), handler.threads | added.threads)
+        self.assertEqual(self.logger.handlers, [handler, added]) # Moved back onto the logging thread
+
+
+if __name__ == '__main__':
+    unittest.main()
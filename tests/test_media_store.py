@@ -0,0 +1,107 @@
+"""
+Media store tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from server.backend.media_store import MediaStore, send_file_chunks
+
+
+class MediaStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store_dir = os.path.join(self.tmp_dir.name, "media")
+        self.store = MediaStore(self.store_dir, max_size=2500)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read(self, digest):
+        filename, size, sender, file = self.store.open(digest.hex())
+        with file:
+            return filename, size, sender, file.read()
+
+    def test_store_and_open(self):
+        digest = self.store.store("cat.png", b"meow" * 100, "alice")
+        self.assertEqual(digest, hashlib.sha256(b"meow" * 100).digest())
+        self.assertEqual(self.read(digest), ("cat.png", 400, "alice", b"meow" * 100))
+        self.assertIsNone(self.store.open("00" * 32))
+
+    def test_duplicate_stored_once(self):
+        first = self.store.store("cat.png", b"meow" * 100, "alice")
+        second = self.store.store("copy.png", b"meow" * 100, "bob")
+        self.assertEqual(first, second)
+        self.assertEqual(os.listdir(self.store_dir), [first.hex()])
+        self.assertEqual(self.store.list_entries(), [[first.hex(), "cat.png", 400, "alice"]]) # The original is kept
+
+    def test_least_recently_used_evicted(self):
+        first = self.store.store("1.mp3", b"1" * 1000, "alice")
+        second = self.store.store("2.mp3", b"2" * 1000, "alice")
+        self.store.open(first.hex())[3].close() # first is now the most recently used
+        third = self.store.store("3.mp3", b"3" * 1000, "alice")
+        self.assertEqual([entry[0] for entry in self.store.list_entries()], [first.hex(), third.hex()])
+        self.assertEqual(sorted(os.listdir(self.store_dir)), sorted([first.hex(), third.hex()]))
+        self.assertIsNone(self.store.open(second.hex()))
+
+    def test_file_larger_than_store_kept(self):
+        self.store.store("1.mp3", b"1" * 1000, "alice")
+        large = self.store.store("large.mp3", b"L" * 5000, "alice")
+        self.assertEqual([entry[0] for entry in self.store.list_entries()], [large.hex()])
+
+    def test_clear(self):
+        self.store.store("1.mp3", b"1" * 1000, "alice")
+        with open(os.path.join(self.store_dir, "left_over"), "wb") as file: # From a previous run
+            file.write(b"old")
+        self.store.clear()
+        self.assertEqual(self.store.list_entries(), [])
+        self.assertEqual(os.listdir(self.store_dir), [])
+        self.store.store("2.mp3", b"2" * 2000, "alice") # Cleared files no longer count towards max_size
+        self.assertEqual(len(self.store.list_entries()), 1)
+
+    def test_restore_entries(self):
+        digest = self.store.store("cat.png", b"meow" * 100, "alice")
+        restored = MediaStore(self.store_dir, max_size=2500)
+        restored.restore_entries(self.store.list_entries() + [["00" * 32, "gone.png", 10, "bob"]])
+        self.assertEqual(restored.list_entries(), [[digest.hex(), "cat.png", 400, "alice"]])
+
+
+class SendFileChunksTest(unittest.TestCase):
+    def test_sends_whole_file(self):
+        data = os.urandom(300_000)
+        with tempfile.TemporaryFile() as file:
+            file.write(data)
+            file.flush()
+            soc, peer = socket.socketpair()
+            received = bytearray()
+            reader = threading.Thread(target=receive_all, args=(peer, received))
+            reader.start()
+            with soc:
+                progress = list(send_file_chunks(soc, file, len(data), 65536))
+            reader.join(5)
+            peer.close()
+        self.assertEqual(bytes(received), data)
+        self.assertEqual(progress[-1], len(data))
+        self.assertEqual(progress, sorted(progress))
+
+    def test_file_shorter_than_size(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(b"short")
+            file.flush()
+            soc, peer = socket.socketpair()
+            with soc, peer, self.assertRaises(OSError):
+                list(send_file_chunks(soc, file, 100, 65536))
+
+
+def receive_all(soc, received):
+    while data := soc.recv(65536):
+        received.extend(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Member colour tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+try:
+    from client.gui.main_win import MainWin, MEMBER_COLORS
+except ImportError: # No Tk or Pillow
+    MainWin = None
+
+
+class ChatBoxFrame:
+    def __init__(self):
+        self.tags = []
+
+    def add_color_tag(self, color):
+        self.tags.append(color)
+
+
+class Window:
+    """
+    Just the parts of MainWin that member_color() uses, so no Tk window has to be opened
+    """
+    def __init__(self):
+        self.member_colors = {}
+        self.chat_box_frame = ChatBoxFrame()
+
+    def member_color(self, user_id):
+        return MainWin.member_color(self, user_id)
+
+
+@unittest.skipIf(MainWin is None, "The client needs Tk and Pillow")
+class MemberColorTest(unittest.TestCase):
+    def test_crc32_of_username(self):
+        window = Window()
+        self.assertEqual(window.member_color("alice"), "#8A2BE2") # CRC-32 663665735
+        self.assertEqual(window.member_color("bob"), "#E6BEFF") # CRC-32 4123767104
+
+    def test_same_in_every_process(self):
+        # hash() is salted differently in every process, so this would fail if colours were picked with it
+        code = "from tests.test_member_colors import Window; print(Window().member_color('alice'))"
+        for seed in ("1", "2"):
+            result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    env={**os.environ, "PYTHONHASHSEED": seed})
+            self.assertEqual(result.stdout.strip(), "#8A2BE2")
+
+    def test_tag_added_once(self):
+        window = Window()
+        for _ in range(3):
+            window.member_color("alice")
+        window.member_color("bob")
+        self.assertEqual(window.chat_box_frame.tags, ["#8A2BE2", "#E6BEFF"])
+
+    def test_spread(self):
+        window = Window()
+        colors = {window.member_color(f"user{i}") for i in range(1000)}
+        self.assertGreater(len(colors), len(MEMBER_COLORS) * 0.9)
+        self.assertTrue(colors <= set(MEMBER_COLORS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Outbox tests (for pychat)
+Written by Joshua Kitchen - 2025
+
+Each outbox writes to one end of a socketpair, and the other end is read to see what was actually sent.
+"""
+
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from frame_parser import FrameParser, encode_frame
+from server.backend.outbox import Outbox, CONTROL, TEXT, MEDIA, classify
+import utils
+
+
+def frame_of(data, flags):
+    msg = utils.encode_msg(b"sender", data, flags)
+    return bytes(encode_frame(msg)), classify(msg)
+
+
+def read_exactly(soc, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = soc.recv(min(size - len(data), 1048576))
+        if not chunk:
+            break
+        data.extend(chunk)
+    return bytes(data)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.soc, self.peer = socket.socketpair()
+        self.soc.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384) # So that large frames can't be sent at once
+        self.peer.settimeout(5)
+        self.outbox = Outbox(self.soc, "test")
+
+    def tearDown(self):
+        self.outbox.close()
+        self.soc.close()
+        self.peer.close()
+
+    def test_control_goes_ahead_of_media(self):
+        media = [frame_of(bytes(1000), 2) for _ in range(3)]
+        control = frame_of(b"SERVERMSG:hello", 4)
+        for frame, priority in media:
+            self.outbox.put(frame, priority)
+        self.outbox.put(*control) # Queued, since the writer hasn't started
+        self.assertEqual([priority for _, priority in media + [control]], [MEDIA] * 3 + [CONTROL])
+        self.outbox.start()
+        expected = control[0] + b"".join(frame for frame, _ in media)
+        self.assertEqual(read_exactly(self.peer, len(expected)), expected)
+
+    def test_text_interleaves_with_media(self):
+        media = [frame_of(bytes(200_000), 2) for _ in range(3)]
+        text = frame_of(b"hi", 1)
+        for frame, priority in media:
+            self.outbox.put(frame, priority)
+        self.outbox.put(*text)
+        self.outbox.start()
+        events = []
+        parser = FrameParser()
+        while len(events) < 4:
+            events.extend(parser.feed(self.peer.recv(1048576)))
+        self.assertEqual(events[0].flags, 1) # Text gets its turn before the media queued ahead of it
+
+    def test_partial_send_is_resumed(self):
+        self.outbox.start()
+        large = frame_of(os.urandom(1_000_000), 2)
+        small = frame_of(b"after", 1)
+        self.assertTrue(self.outbox.put(*large)) # Only part of it fits in the socket buffer
+        self.assertTrue(self.outbox.put(*small))
+        self.assertGreater(self.outbox.size, 0)
+        expected = large[0] + small[0]
+        self.assertEqual(read_exactly(self.peer, len(expected)), expected)
+        self.assertTrue(self.outbox.flush(5))
+
+    def test_put_refused_once_full(self):
+        outbox = Outbox(self.soc, "full", max_size=1000) # Not started, so everything is queued
+        frame, priority = frame_of(bytes(400), 1)
+        self.assertTrue(outbox.put(frame, priority))
+        self.assertTrue(outbox.put(frame, priority))
+        self.assertFalse(outbox.put(frame, priority))
+        self.assertEqual(outbox.size, 2 * len(frame))
+        outbox.close()
+        self.assertFalse(outbox.put(*frame_of(b"x", 1)))
+
+    def test_on_sent_after_bytes_are_written(self):
+        self.outbox.start()
+        results = []
+        large = frame_of(os.urandom(1_000_000), 2)
+        self.assertTrue(self.outbox.put(*large, on_sent=results.append))
+        time.sleep(0.1)
+        self.assertEqual(results, []) # Most of it is still waiting for the peer to read
+        read_exactly(self.peer, len(large[0]) // 2)
+        self.assertEqual(results, [])
+        read_exactly(self.peer, len(large[0]) - len(large[0]) // 2)
+        self.assertTrue(wait_until(lambda: results == [True]))
+
+    def test_on_sent_false_when_discarded(self):
+        results = []
+        self.outbox.put(*frame_of(b"never sent", 1), on_sent=results.append) # Not started, so it is queued
+        self.outbox.close()
+        self.assertEqual(results, [False])
+
+    def test_close_releases_queued_files(self):
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(bytes(1000))
+        self.addCleanup(os.remove, tmp.name)
+        files = [open(tmp.name, 'rb') for _ in range(2)]
+        header = utils.encode_multimedia_header(b"sender", "file.png", 1000)
+        for file in files:
+            self.assertTrue(self.outbox.put_file((len(header) + 1000).to_bytes(4, "big") + header, file, 1000))
+        self.assertEqual(len(self.outbox), 2)
+        self.outbox.close()
+        self.assertTrue(all(file.closed for file in files))
+        self.assertEqual(len(self.outbox), 0)
+
+    def test_file_is_sent_whole(self):
+        data = os.urandom(300_000)
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(data)
+        self.addCleanup(os.remove, tmp.name)
+        header = utils.encode_multimedia_header(b"sender", "file.png", len(data))
+        file = open(tmp.name, 'rb')
+        self.outbox.start()
+        self.outbox.put_file((len(header) + len(data)).to_bytes(4, "big") + header, file, len(data))
+        events = []
+        parser = FrameParser()
+        while not events:
+            events = parser.feed(self.peer.recv(1048576))
+        self.assertEqual(utils.decode_multimedia_body(events[0].data), ("file.png", data))
+        self.assertTrue(wait_until(lambda: file.closed))
+
+    def test_flush_waits_for_everything(self):
+        self.outbox.start()
+        frames = [frame_of(os.urandom(100_000), 1) for _ in range(5)]
+        for frame, priority in frames:
+            self.outbox.put(frame, priority)
+        self.assertFalse(self.outbox.flush(0.1)) # Nobody is reading
+        reader = threading.Thread(target=read_exactly, args=(self.peer, sum(len(frame) for frame, _ in frames)))
+        reader.start()
+        self.assertTrue(self.outbox.flush(5))
+        reader.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
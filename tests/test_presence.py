@@ -0,0 +1,121 @@
+"""
+Presence tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import threading
+import unittest
+
+from server.backend.presence import Presence
+import utils
+
+
+class FakeServer:
+    def __init__(self, client_count=10):
+        self.client_count = client_count
+        self.msgs = []
+        self.sent = threading.Event()
+
+    def broadcast_msg(self, msg, exclude=None):
+        self.msgs.append((str(utils.decode_msg(msg)["data"], "utf-8"), exclude))
+        self.sent.set()
+
+
+class PresenceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer()
+        self.presence = Presence(self.server, interval=60, max_batch=4, summary_size=50)
+
+    def tearDown(self):
+        self.presence.stop()
+
+    def sent(self):
+        return [data for data, _ in self.server.msgs]
+
+    def test_batched(self):
+        self.presence.joined("alice", "1")
+        self.presence.joined("bob", "2")
+        self.presence.left("carol")
+        self.assertEqual(self.server.msgs, [])
+        self.assertEqual(self.presence.flush(), 3)
+        self.assertEqual(self.sent(), ["PRESENCE:+alice,+bob,-carol"])
+        self.assertEqual(self.presence.flush(), 0)
+        self.assertEqual(self.presence.stats(), {"batches": 1, "summaries": 0, "cancelled": 0, "pending": 0})
+
+    def test_join_then_leave_cancels_out(self):
+        self.presence.joined("alice", "1")
+        self.presence.joined("bob", "2")
+        self.presence.left("alice")
+        self.presence.flush()
+        self.assertEqual(self.sent(), ["PRESENCE:+bob"])
+        self.assertEqual(self.presence.stats()["cancelled"], 1)
+
+    def test_reconnect_cancels_out(self):
+        self.presence.left("alice")
+        self.presence.joined("alice", "3")
+        self.assertEqual(self.presence.flush(), 0)
+        self.assertEqual(self.server.msgs, [])
+
+    def test_not_cancelled_once_listed(self):
+        self.presence.joined("alice", "1")
+        self.assertEqual(self.presence.list_members(lambda: ["alice"]), ["alice"]) # A new client now knows of alice
+        self.presence.left("alice")
+        self.presence.flush()
+        self.assertEqual(self.sent(), ["PRESENCE:-alice"])
+
+    def test_not_cancelled_while_listing(self):
+        def list_usernames():
+            self.presence.joined("alice", "1")
+            return ["alice"]
+        self.presence.list_members(list_usernames)
+        self.presence.left("alice")
+        self.presence.flush()
+        self.assertEqual(self.sent(), ["PRESENCE:-alice"])
+
+    def test_not_cancelled_across_batches(self):
+        self.presence.joined("alice", "1")
+        self.presence.flush()
+        self.presence.left("alice")
+        self.presence.flush()
+        self.assertEqual(self.sent(), ["PRESENCE:+alice", "PRESENCE:-alice"])
+
+    def test_max_batch_flushes_early(self):
+        self.presence.start()
+        for i in range(3):
+            self.presence.joined(f"user{i}", str(i))
+        self.assertFalse(self.server.sent.wait(0.2)) # Still waiting for the interval to end
+        self.presence.joined("user3", "3")
+        self.assertTrue(self.server.sent.wait(5))
+        self.assertEqual(self.sent(), ["PRESENCE:+user0,+user1,+user2,+user3"])
+
+    def test_interval_flushes(self):
+        self.presence.interval = 0.05
+        self.presence.start()
+        self.presence.joined("alice", "1")
+        self.assertTrue(self.server.sent.wait(5))
+        self.assertEqual(self.sent(), ["PRESENCE:+alice"])
+
+    def test_summary_above_summary_size(self):
+        self.server.client_count = 51
+        self.presence.joined("alice", "1")
+        self.presence.joined("bob", "2")
+        self.presence.left("carol")
+        self.presence.flush()
+        self.assertEqual(self.sent(), ["PRESENCE_SUMMARY:2:1"])
+        self.assertEqual(self.presence.stats()["summaries"], 1)
+
+    def test_list_at_summary_size(self):
+        self.server.client_count = 50
+        self.presence.joined("alice", "1")
+        self.presence.flush()
+        self.assertEqual(self.sent(), ["PRESENCE:+alice"])
+
+    def test_unbatched(self):
+        presence = Presence(self.server, interval=0)
+        presence.joined("alice", "1")
+        presence.left("bob")
+        self.assertEqual(self.server.msgs, [("JOINED:alice", "1"), ("LEFT:bob", None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
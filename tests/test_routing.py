@@ -0,0 +1,171 @@
+"""
+Routing tests (for pychat)
+Written by Joshua Kitchen - 2025
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+from TCPLib.message import Message
+
+from server.backend.TCP_server import PychatServer
+import utils
+
+
+class RecordingClient:
+    """
+    Stands in for a PychatClientProcessor, and keeps every message it is sent
+    """
+    def __init__(self):
+        self.msgs = []
+
+    def send_frame(self, frame, priority):
+        self.msgs.append(bytes(frame[4:]))
+        return True
+
+
+class RoutingTestCase(unittest.TestCase):
+    """
+    Routes messages from `senders` with `workers` routing threads, as PychatServer.process_msg_queue() would
+    """
+    workers = 1
+    senders = ("alice",)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.server = PychatServer(ip_blacklist_path=os.path.join(self.tmp_dir.name, "blacklist"),
+                                   media_store_dir=os.path.join(self.tmp_dir.name, "media"),
+                                   routing_workers=self.workers)
+        self.receiver = RecordingClient()
+        self.clients = {}
+        for i, username in enumerate(self.senders + ("bob",)):
+            client_id = str(i + 1)
+            self.clients[client_id] = self.receiver if username == "bob" else RecordingClient()
+            self.server._update_connected_clients(client_id, self.clients[client_id])
+            self.server.register_username(username, client_id)
+        self.server._set_is_running(True)
+        self.routers = [threading.Thread(target=self.server._route_partition, args=(partition,), daemon=True)
+                        for partition in range(self.workers)]
+        for router in self.routers:
+            router.start()
+
+    def tearDown(self):
+        self.server._set_is_running(False)
+        messages = self.server._messages
+        woken = set()
+        i = 0
+        while len(woken) < self.workers: # Wakes every router so that it sees the server has stopped
+            client_id = f"wake{i}"
+            if messages.partition_of(client_id) not in woken:
+                woken.add(messages.partition_of(client_id))
+                messages.put(Message(0, b"", client_id))
+            i += 1
+        for router in self.routers:
+            router.join(5)
+        self.tmp_dir.cleanup()
+
+    def put(self, msg, client_id="1"):
+        self.server._messages.put(Message(len(msg), msg, client_id))
+
+    def wait_until_routed(self):
+        """
+        Returns False if the queue wasn't drained within a few seconds
+        """
+        messages = self.server._messages
+        with messages.all_tasks_done:
+            return messages.all_tasks_done.wait_for(lambda: not messages.unfinished_tasks, 5)
+
+    def route(self, msg):
+        """
+        Returns False if the message wasn't routed within a few seconds
+        """
+        self.put(msg)
+        return self.wait_until_routed()
+
+
+class MalformedMessageTest(RoutingTestCase):
+    """
+    A message that can't be decoded is dropped, and the messages after it are still routed
+    """
+    def assert_still_routing(self, bad_msg):
+        self.assertTrue(self.route(bad_msg))
+        good_msg = utils.encode_msg(b"alice", b"hello", 1)
+        self.assertTrue(self.route(good_msg))
+        self.assertTrue(self.routers[0].is_alive())
+        self.assertEqual(self.receiver.msgs, [bytes(good_msg)])
+
+    def test_direct_recipients_not_utf8(self):
+        data = (4).to_bytes(4, "big") + b"\xff\xfe\xfd\xfc" + b"hi"
+        self.assert_still_routing(utils.encode_msg(b"alice", data, 1 | 16))
+
+    def test_filename_not_utf8(self):
+        data = (4).to_bytes(4, "big") + b"\xff\xfe\xfd\xfc" + b"\x89PNG"
+        self.assert_still_routing(utils.encode_msg(b"alice", data, 2))
+
+    def test_fetch_digest_not_utf8(self):
+        self.assert_still_routing(utils.encode_msg(b"alice", b"FETCH:\xff\xfe", 4))
+
+
+class RoutingOrderTest(RoutingTestCase):
+    """
+    Each client's messages are routed in the order they were received, however many routing threads there are
+    """
+    workers = 4
+    senders = tuple(f"user{i}" for i in range(16))
+
+    def test_each_client_in_order(self):
+        for n in range(200):
+            for i, username in enumerate(self.senders):
+                self.put(utils.encode_msg(bytes(username, "utf-8"), bytes(str(n), "utf-8"), 1), str(i + 1))
+        self.assertTrue(self.wait_until_routed())
+        received = {}
+        for msg in self.receiver.msgs:
+            msg_info = utils.decode_msg(msg)
+            received.setdefault(msg_info["username"], []).append(int(msg_info["data"]))
+        self.assertEqual(received, {username: list(range(200)) for username in self.senders})
+
+    def test_disconnection_after_last_message(self):
+        for n in range(50):
+            self.put(utils.encode_msg(b"user0", bytes(str(n), "utf-8"), 1))
+        self.put(b"") # user0 disconnects
+        self.assertTrue(self.wait_until_routed())
+        self.assertEqual(len(self.receiver.msgs), 50) # Every message was routed before user0 was unregistered
+        self.assertIsNone(self.server.get_username("1"))
+
+
+class PooledBufferTest(RoutingTestCase):
+    """
+    A message received into a pooled buffer gives the buffer back once it has been routed
+    """
+    def pooled_msg(self, msg):
+        buffer = self.server._buffer_pool.acquire(len(msg))
+        buffer[:len(msg)] = msg
+        return memoryview(buffer)[:len(msg)]
+
+    def assert_released(self, size):
+        pool = self.server._buffer_pool
+        self.assertEqual(pool.stats()["free_bytes"], pool.size_class(size))
+
+    def test_released_after_routing(self):
+        msg = utils.encode_msg(b"alice", b"x" * 100_000, 1)
+        self.assertTrue(self.route(self.pooled_msg(msg)))
+        self.assertEqual(self.receiver.msgs, [bytes(msg)]) # Queued as a copy of the buffer
+        self.assert_released(len(msg))
+
+    def test_released_when_routing_fails(self):
+        def fail(msg):
+            raise RuntimeError("could not route")
+        self.server.route_msg = fail
+        with self.assertLogs("server.backend.TCP_server", "ERROR"):
+            self.assertTrue(self.route(self.pooled_msg(utils.encode_msg(b"alice", b"x" * 100_000, 1))))
+        self.assertTrue(self.routers[0].is_alive())
+        self.assert_released(100_000 + 14)
+
+
+if __name__ == '__main__':
+    unittest.main()
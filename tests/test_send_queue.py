@@ -0,0 +1,138 @@
+"""
+Send queue tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import os
+import socket
+import time
+import unittest
+
+from client.backend.send_queue import SendQueue, Upload, QUEUED, SENDING, SENT, CANCELLED
+from frame_parser import FrameParser, encode_frame
+import utils
+
+
+def make_upload(filename, size):
+    """
+    Builds an upload the way PychatBackend.send_file() does
+    """
+    data = os.urandom(size)
+    prefix = utils.encode_multimedia_body(filename, b"")
+    header = utils.encode_msg(b"me", prefix, 2)
+    header[4:8] = (len(prefix) + size).to_bytes(4, "big")
+    return Upload(filename, (len(header) + size).to_bytes(4, "big") + header, data)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.soc, self.peer = socket.socketpair()
+        self.soc.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+        self.peer.settimeout(5)
+        self.progress = []
+        self.finished = []
+        self.queue = SendQueue(self.soc, lambda upload: self.progress.append(upload.progress), self.finished.append)
+
+    def tearDown(self):
+        self.queue.close()
+        self.soc.close()
+        self.peer.close()
+
+    def receive(self, count):
+        """
+        Returns the next `count` messages the peer is sent, or as many as arrive before the connection is closed
+        """
+        parser = FrameParser()
+        msgs = []
+        while len(msgs) < count:
+            try:
+                data = self.peer.recv(1048576)
+            except OSError:
+                break
+            if not data:
+                break
+            msgs.extend(parser.feed(data))
+        return msgs
+
+    def test_text_goes_ahead_of_uploads(self):
+        upload = make_upload("song.mp3", 1000)
+        self.queue.put_upload(upload)
+        self.queue.put(bytes(encode_frame(utils.encode_msg(b"me", b"hello", 1))))
+        self.queue.start()
+        msgs = self.receive(2)
+        self.assertEqual([msg.flags for msg in msgs], [1, 2])
+        self.assertEqual(utils.decode_multimedia_body(msgs[1].data)[0], "song.mp3")
+        self.assertTrue(wait_until(lambda: upload.status == SENT))
+
+    def test_progress_is_reported(self):
+        upload = make_upload("song.mp3", 300_000)
+        data = upload.data
+        self.queue.put_upload(upload)
+        self.queue.start()
+        msgs = self.receive(1)
+        self.assertEqual(bytes(utils.decode_multimedia_body(msgs[0].data)[1]), data)
+        self.assertTrue(wait_until(lambda: self.finished == [upload]))
+        self.assertEqual(upload.status, SENT)
+        self.assertEqual(self.progress, sorted(self.progress))
+        self.assertGreaterEqual(len(self.progress), 300_000 // 65536)
+        self.assertEqual(self.progress[-1], 1.0)
+
+    def test_cancel_queued_upload(self):
+        first = make_upload("first.mp3", 1000)
+        second = make_upload("second.mp3", 1000)
+        self.queue.put_upload(first)
+        self.queue.put_upload(second)
+        self.queue.cancel(second)
+        self.assertEqual(second.status, CANCELLED)
+        self.assertEqual(self.finished, [second])
+        self.assertEqual(self.queue.pending_uploads(), [first])
+        self.queue.start()
+        msgs = self.receive(1)
+        self.assertEqual(utils.decode_multimedia_body(msgs[0].data)[0], "first.mp3")
+        self.assertTrue(wait_until(lambda: first.status == SENT))
+        self.assertFalse(self.queue.is_closed) # Nothing of the cancelled upload was sent, so the connection is fine
+
+    def test_cancel_upload_in_flight(self):
+        upload = make_upload("large.mp3", 4_000_000)
+        self.queue.put_upload(upload)
+        self.queue.start()
+        self.assertTrue(wait_until(lambda: upload.status == SENDING and upload.sent > 0))
+        self.queue.cancel(upload)
+        self.receive(1) # Drains until the connection is shut down
+        self.assertTrue(wait_until(lambda: self.finished == [upload]))
+        self.assertEqual(upload.status, CANCELLED)
+        self.assertLess(upload.sent, upload.size)
+        self.assertTrue(self.queue.is_closed)
+
+    def test_cancel_after_last_chunk_written(self):
+        upload = make_upload("song.mp3", 1000)
+        with self.queue._cond: # As if the sender thread had just written the last chunk
+            self.queue._current = upload
+        upload.status = SENDING
+        upload.sent = upload.size
+        self.queue.cancel(upload)
+        self.assertEqual(upload.status, SENDING) # Left for the sender thread to report as sent
+        self.soc.sendall(b"still connected")
+        self.assertEqual(self.peer.recv(100), b"still connected")
+        self.assertEqual(self.finished, [])
+
+    def test_close_fails_waiting_uploads(self):
+        upload = make_upload("song.mp3", 1000)
+        self.queue.put_upload(upload)
+        self.assertEqual(upload.status, QUEUED)
+        self.queue.close()
+        self.assertEqual(upload.status, "failed")
+        self.assertFalse(self.queue.put(b"x"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Socket option tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import socket
+import unittest
+
+from socket_options import SocketOptions, PROFILES
+
+
+class SocketOptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    def tearDown(self):
+        self.soc.close()
+
+    def get(self, level, option):
+        return self.soc.getsockopt(level, option)
+
+    def test_text_profile(self):
+        PROFILES["text"].apply(self.soc)
+        self.assertEqual(self.get(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+        self.assertEqual(self.get(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            self.assertEqual(self.get(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL), 10)
+
+    def test_bulk_profile(self):
+        default = self.get(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        options = PROFILES["bulk"].replace(send_buffer=262144, recv_buffer=262144)
+        options.apply(self.soc)
+        self.assertEqual(self.get(socket.IPPROTO_TCP, socket.TCP_NODELAY), 0)
+        self.assertGreater(self.get(socket.SOL_SOCKET, socket.SO_RCVBUF), default)
+        self.assertGreaterEqual(self.get(socket.SOL_SOCKET, socket.SO_SNDBUF), 262144) # Linux doubles it
+
+    def test_listening_socket_only_gets_buffers(self):
+        SocketOptions(nodelay=True, send_buffer=262144, keepalive=True).apply(self.soc, listening=True)
+        self.assertGreaterEqual(self.get(socket.SOL_SOCKET, socket.SO_SNDBUF), 262144)
+        self.assertEqual(self.get(socket.IPPROTO_TCP, socket.TCP_NODELAY), 0)
+        self.assertEqual(self.get(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 0)
+
+    def test_replace(self):
+        options = PROFILES["text"].replace(nodelay=False, send_buffer=None)
+        self.assertEqual((options.nodelay, options.send_buffer, options.keepalive), (False, None, True))
+        self.assertTrue(PROFILES["text"].nodelay) # The profile itself is unchanged
+        with self.assertRaises(ValueError):
+            SocketOptions(recv_buffer=0)
+
+    def test_failure_logged(self):
+        with self.assertLogs("socket_options", "WARNING"):
+            SocketOptions(send_buffer=262144).apply(ClosedSocket()) # Skipped, since the connection still works
+
+
+class ClosedSocket:
+    def setsockopt(self, level, option, value):
+        raise OSError("Bad file descriptor")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Spectator tests (for pychat)
+Written by Joshua Kitchen - 2025
+"""
+
+import unittest
+
+from frame_parser import FrameParser, MessageRejected, encode_frame
+from server.backend.spectators import SpectatorTable, SPECTATE_HANDSHAKE, SPECTATOR
+from tests.test_routing import RoutingTestCase, RecordingClient
+import utils
+
+
+class HandshakeClient:
+    """
+    Stands in for the TCPLib client that on_connect() reads the handshake from
+    """
+    def __init__(self, handshake):
+        self.handshake = handshake
+        self.peer_addr = ("127.0.0.1", 5000)
+        self.sent = []
+
+    def receive(self):
+        return self.handshake
+
+    def send(self, data):
+        self.sent.append(bytes(data))
+
+
+class Spectator(RecordingClient):
+    is_running = False
+
+    def send(self, data):
+        self.msgs.append(bytes(data))
+        return True
+
+
+class SpectatorTest(RoutingTestCase):
+    def add_spectator(self, spectator_id):
+        spectator = Spectator()
+        self.server._spectators.add(spectator_id, spectator)
+        return spectator
+
+    def test_handshake(self):
+        for handshake in (SPECTATE_HANDSHAKE + b"dashboard", SPECTATE_HANDSHAKE):
+            client = HandshakeClient(handshake)
+            self.assertEqual(self.server.on_connect(client, "10"), SPECTATOR)
+            self.assertEqual(client.sent, [b"MEMBERS:alice,bob"])
+        self.assertIsNone(self.server.get_username("10"))
+
+    def test_username_like_handshake(self):
+        client = HandshakeClient(b"SPECTATE:dashboard") # A member can be called anything
+        self.assertIs(self.server.on_connect(client, "10"), True)
+        self.assertEqual(self.server.get_username("10"), "SPECTATE:dashboard")
+
+    def test_full(self):
+        self.server._max_spectators = 1
+        self.add_spectator("10")
+        client = HandshakeClient(SPECTATE_HANDSHAKE)
+        self.assertIs(self.server.on_connect(client, "11"), False)
+        self.assertEqual(client.sent, [b"SERVER IS FULL"])
+
+    def test_broadcast_reaches_spectators(self):
+        spectators = [self.add_spectator(str(i)) for i in range(10, 20)]
+        msg = utils.encode_msg(b"alice", b"hello", 1)
+        self.assertTrue(self.route(msg))
+        self.assertEqual(self.receiver.msgs, [bytes(msg)])
+        self.assertEqual([spectator.msgs for spectator in spectators], [[bytes(msg)]] * 10)
+
+    def test_excluded_member_only(self):
+        spectator = self.add_spectator("10")
+        self.server.broadcast_msg(utils.encode_msg(b"", b"JOINED:bob", 4), exclude="2")
+        self.assertEqual(self.receiver.msgs, [])
+        self.assertEqual(len(spectator.msgs), 1)
+
+    def test_text_rejected(self):
+        parser = FrameParser(size_limits=self.server._spectator_size_limits)
+        for flags in (1, 2, 1 | 16):
+            events = parser.feed(encode_frame(utils.encode_msg(b"", b"hello", flags)))
+            self.assertEqual([type(event) for event in events], [MessageRejected])
+        spectator = self.add_spectator("10")
+        self.server.on_reject("10", 1, 5, 0)
+        self.assertEqual([utils.decode_msg(msg)["data"] for msg in spectator.msgs],
+                         [b"SERVERMSG:Spectators can't send messages"])
+        self.assertEqual(self.server.rejected_msg_counts()["text"], 0) # Not counted against the room's size limits
+
+    def test_text_not_routed(self):
+        self.add_spectator("10")
+        self.put(utils.encode_msg(b"", b"hello", 1), "10") # In case one got past the size limits
+        self.assertTrue(self.wait_until_routed())
+        self.assertEqual(self.receiver.msgs, [])
+
+    def test_disconnect(self):
+        self.add_spectator("10")
+        self.put(utils.encode_msg(b"", b"", 8), "10")
+        self.assertTrue(self.wait_until_routed())
+        self.assertEqual(self.server.list_spectators(), [])
+
+
+class SpectatorTableTest(unittest.TestCase):
+    def test_add_and_remove(self):
+        table = SpectatorTable(num_buckets=4)
+        for i in range(10):
+            table.add(str(i), i)
+        table.add("3", 3)
+        self.assertEqual(len(table), 10)
+        self.assertEqual(sorted(table.values()), list(range(10)))
+        self.assertEqual(table.remove("3"), 3)
+        self.assertIsNone(table.remove("3"))
+        self.assertNotIn("3", table)
+        self.assertEqual(table.get("4"), 4)
+        self.assertEqual(sorted(table.clear()), [0, 1, 2, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(len(table), 0)
+
+    def test_values_while_changing(self):
+        table = SpectatorTable(num_buckets=4)
+        for i in range(10):
+            table.add(str(i), i)
+        seen = []
+        for value in table.values(): # Each bucket is a snapshot, so changes don't break the loop
+            seen.append(value)
+            table.add(str(value + 100), value + 100)
+            table.remove(str(value))
+        self.assertEqual(len(seen), len(set(seen)))
+
+
+if __name__ == '__main__':
+    unittest.main()
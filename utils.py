@@ -14,9 +14,25 @@ FLAGS:
     2 = Image
     4 = Information
     8 = Disconnecting
+    16 = Direct (combined with 1 or 2)
+    32 = Media announcement
+    128 = Trace (may be combined with any other flag)
+
+If the trace flag is set, the first 8 bytes of the data are the time the client sent the message (nanoseconds since
+the epoch). The server strips the timestamp and the trace flag before relaying the message.
+
+If the direct flag is set, an additional header is included at the start of the data. The message is only sent to the
+listed recipients (and echoed back to the sender):
+[Recipients Length (4 bytes)][Comma separated list of recipient usernames]
+
+A media announcement is sent by the server in place of a multimedia message. Clients download the file only when the
+user opens it by sending the info message "FETCH:<SHA-256 hex digest>", and the server replies with the full
+multimedia message. The announcement's data is:
+[Filename Length (4 bytes)][Filename][File Size (8 bytes)][SHA-256 digest (32 bytes)][PNG thumbnail (may be empty)]
 """
 import io
 import os
+import time
 import logging
 
 logger = logging.getLogger()
@@ -51,6 +67,112 @@ def decode_msg(msg: bytearray):
         "data": data
     }
 
+def encode_multimedia_body(filename: str, data: bytes):
+    """
+    Additional multimedia message header included in the message body:
+    [Filename Length (4 bytes)][Filename]
+    """
+    filename = bytes(filename, "utf-8")
+    msg = bytearray()
+    msg.extend(len(filename).to_bytes(4, byteorder="big"))
+    msg.extend(filename)
+    msg.extend(data)
+    return msg
+
+
+def decode_multimedia_body(data: bytes):
+    """
+    Returns a tuple of the filename and the file's data
+    """
+    filename_len = int.from_bytes(data[0:4], byteorder='big')
+    filename = str(data[4: filename_len + 4], 'utf-8')
+    return filename, data[filename_len + 4:]
+
+
+def encode_multimedia_header(username: bytes, filename: str, file_size: int):
+    """
+    Returns everything in a multimedia message that comes before the file's data, for when the data is sent separately
+    (see Outbox.put_file())
+    """
+    body = encode_multimedia_body(filename, b"")
+    msg = encode_msg(username, body, 2)
+    msg[4:8] = (len(body) + file_size).to_bytes(4, "big")
+    return msg
+
+
+def encode_media_announcement(filename: str, size: int, digest: bytes, thumbnail: bytes):
+    msg = encode_multimedia_body(filename, b"")
+    msg.extend(size.to_bytes(8, byteorder="big"))
+    msg.extend(digest)
+    msg.extend(thumbnail)
+    return msg
+
+
+def decode_media_announcement(data: bytes):
+    """
+    Returns a tuple of the filename, the file size, the SHA-256 hex digest, and the thumbnail
+    """
+    filename, data = decode_multimedia_body(data)
+    return filename, int.from_bytes(data[0:8], byteorder="big"), bytes(data[8:40]).hex(), data[40:]
+
+
+def encode_direct_body(recipients, data: bytes):
+    """
+    Additional direct message header included at the start of the data:
+    [Recipients Length (4 bytes)][Comma separated list of recipient usernames]
+    """
+    recipients = bytes(','.join(recipients), "utf-8")
+    msg = bytearray()
+    msg.extend(len(recipients).to_bytes(4, byteorder="big"))
+    msg.extend(recipients)
+    msg.extend(data)
+    return msg
+
+
+def decode_direct_body(data: bytes):
+    """
+    Returns a tuple of the list of recipients and the rest of the data
+    """
+    recipients_len = int.from_bytes(data[0:4], byteorder='big')
+    recipients = str(data[4: recipients_len + 4], 'utf-8')
+    return [recipient for recipient in recipients.split(',') if recipient], data[recipients_len + 4:]
+
+
+def encode_presence(changes):
+    """
+    Returns the data of a PRESENCE info message, given a dictionary of username -> True if they joined or False if
+    they left (see presence.py)
+    """
+    return bytes("PRESENCE:" + ','.join(f"{'+' if joined else '-'}{username}"
+                                        for username, joined in changes.items()), 'utf-8')
+
+
+def decode_presence(changes: str):
+    """
+    Returns a tuple of the list of usernames that joined and the list that left, given what follows "PRESENCE:"
+    """
+    joined, left = [], []
+    for change in changes.split(','):
+        if change[0:1] == '+':
+            joined.append(change[1:])
+        elif change[0:1] == '-':
+            left.append(change[1:])
+    return joined, left
+
+
+def add_trace_timestamp(data: bytes):
+    msg = bytearray(time.time_ns().to_bytes(8, "big"))
+    msg.extend(data)
+    return msg
+
+
+def strip_trace_timestamp(data: bytes):
+    """
+    Returns a tuple of the client's send time (in seconds since the epoch) and the data without the timestamp
+    """
+    return int.from_bytes(data[0:8], "big") / 1e9, data[8:]
+
+
 def save_image(img, filename, save_path: str | io.BytesIO):
     """
     From https://stackoverflow.com/questions/33101935/convert-pil-image-to-byte-array: